@@ -0,0 +1,160 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from sqlite3_engine import SQLite3PooledEngine
+from meal_storage import MealStorage
+
+
+class _ReadWriteEngine(SQLite3PooledEngine):
+    """
+    pooled engine whose connections are read only (query_only)
+    except the one of the writer thread
+    """
+
+    def __init__(self, constr, **kwds):
+        super().__init__(constr, **kwds)
+        self._role = threading.local()
+
+
+    def mark_reader(self):
+        """called on every reader thread before it connects"""
+        self._role.reader = True
+
+
+    def _connect(self):
+        conn = super()._connect()
+        if getattr(self._role, 'reader', False):
+            conn.execute('PRAGMA query_only = ON')
+
+        return conn
+
+
+def _read(name):
+    async def method(self, *args, **kwds):
+        return await self._call(self._readers, getattr(self.storage, name), args, kwds)
+
+    method.__name__ = name
+    method.__doc__ = getattr(MealStorage, name).__doc__
+    return method
+
+
+def _write(name):
+    async def method(self, *args, **kwds):
+        return await self._call(self._writer, getattr(self.storage, name), args, kwds)
+
+    method.__name__ = name
+    method.__doc__ = getattr(MealStorage, name).__doc__
+    return method
+
+
+class AsyncMealStorage(object):
+    """
+    MealStorage for asyncio - same methods, but coroutines.
+    reads run on bounded pool of threads with read only connections,
+    writes are serialized through one writer thread owning the only write connection,
+    so writers never wait for each other on database lock.
+    constr has to be a database file (readers need their own connections to it)
+    """
+
+    def __init__(self, constr, readers=4, **kwds):
+        if constr == ':memory:':
+            raise ValueError('AsyncMealStorage needs database file')
+
+        self.engine = _ReadWriteEngine(constr)
+        self.storage = MealStorage(self.engine, **kwds)
+
+        self._writer = ThreadPoolExecutor(1, thread_name_prefix='meal-storage-writer')
+        self._readers = ThreadPoolExecutor(readers, thread_name_prefix='meal-storage-reader',
+                initializer=self.engine.mark_reader)
+
+
+    def _call(self, executor, func, args, kwds):
+        return asyncio.get_running_loop().run_in_executor(executor, partial(func, *args, **kwds))
+
+
+    def close(self):
+        """wait for queued statements and close all connections"""
+        self._writer.shutdown()
+        self._readers.shutdown()
+        self.storage.close()
+        self.engine.close()
+
+
+    async def __aenter__(self):
+        return self
+
+
+    async def __aexit__(self, *exc):
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+
+    # only memory, no need for thread
+
+    def table_versions(self, *tables):
+        return self.storage.table_versions(*tables)
+
+
+    def etag(self, *tables):
+        return self.storage.etag(*tables)
+
+
+    # schema
+
+    clear = _write('clear')
+    delete = _write('delete')
+    init = _write('init')
+    version = _read('version')
+    has_fts = _read('has_fts')
+    rebuild_nutrition = _write('rebuild_nutrition')
+
+    # ingredients
+
+    add_ingredient = _write('add_ingredient')
+    update_ingredient = _write('update_ingredient')
+    add_ingredients = _write('add_ingredients')
+    delete_ingredient = _write('delete_ingredient')
+    get_ingredients = _read('get_ingredients')
+    get_ingredient = _read('get_ingredient')
+    search_ingredients = _read('search_ingredients')
+
+    # meals
+
+    add_meal = _write('add_meal')
+    delete_meal = _write('delete_meal')
+    get_meals = _read('get_meals')
+    get_meal = _read('get_meal')
+    search_meals = _read('search_meals')
+
+    # meal ingredients
+
+    add_meal_ingredient = _write('add_meal_ingredient')
+    add_meal_ingredients = _write('add_meal_ingredients')
+    delete_meal_ingredient = _write('delete_meal_ingredient')
+    get_meal_ingredients = _read('get_meal_ingredients')
+    get_meal_ingredients_with_ingredient = _read('get_meal_ingredients_with_ingredient')
+
+    # stats
+
+    get_nutrition = _read('get_nutrition')
+
+
+    async def page(self, get, count, after=None, *conds, **kwds):
+        """
+        keyset pagination like MealStorage.page, get is one of the read coroutines
+        (e.g. get_meals) - whole page is read on one reader thread
+        """
+        get = getattr(self.storage, get.__name__)
+        return await self._call(self._readers, self.storage.page, (get, count, after) + conds, kwds)
+
+
+    async def iter_pages(self, get, count, *conds, **kwds):
+        """asynchronously generate pages (lists of at most count objects) of get until exhausted"""
+        after = None
+        while True:
+            objs, after = await self.page(get, count, after, *conds, **kwds)
+            if objs:
+                yield objs
+            if after is None:
+                return
@@ -0,0 +1,90 @@
+"""
+compare throughput of 100 concurrent clients (every 5th operation a write,
+others reads) - AsyncMealStorage tasks vs MealStorage (SQLite3PooledEngine)
+used from threads
+
+usage: python bench_async.py [operations per client] [clients]
+"""
+
+import os
+import sys
+import time
+import asyncio
+import sqlite3
+import tempfile
+import threading
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from sqlite3_engine import SQLite3PooledEngine
+from meal_storage import MealStorage
+from async_meal_storage import AsyncMealStorage
+from model import *
+
+
+def ingredient(client, i):
+    return Ingredient(name='ingr{}-{}'.format(client, i), calories=i)
+
+
+def bench_threads(path, n, clients):
+    engine = SQLite3PooledEngine(path)
+    storage = MealStorage(engine)
+    storage.init()
+    storage.add_ingredients([ingredient(-1, i) for i in range(100)])
+    errors = []
+
+    def client(c):
+        for i in range(n):
+            try:
+                if i % 5 == 0:
+                    storage.add_ingredient(ingredient(c, i))
+                else:
+                    storage.get_ingredients(id=(c + i) % 100 + 1)
+            except sqlite3.OperationalError as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=client, args=(c,)) for c in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    engine.close()
+    return clients * n / elapsed, len(errors)
+
+
+def bench_async(path, n, clients):
+    async def run():
+        async with AsyncMealStorage(path) as storage:
+            await storage.init()
+            await storage.add_ingredients([ingredient(-1, i) for i in range(100)])
+
+            async def client(c):
+                for i in range(n):
+                    if i % 5 == 0:
+                        await storage.add_ingredient(ingredient(c, i))
+                    else:
+                        await storage.get_ingredients(id=(c + i) % 100 + 1)
+
+            start = time.perf_counter()
+            await asyncio.gather(*(client(c) for c in range(clients)))
+            return time.perf_counter() - start
+
+    elapsed = asyncio.run(run())
+    return clients * n / elapsed, 0
+
+
+def main(n=50, clients=100):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        threads, errors = bench_threads(os.path.join(tmpdir, 'threads.db'), n, clients)
+        tasks, _ = bench_async(os.path.join(tmpdir, 'async.db'), n, clients)
+
+    print('MealStorage, {} threads     {:10.0f} ops/s ({} database is locked errors)'.format(clients, threads, errors))
+    print('AsyncMealStorage, {} tasks  {:10.0f} ops/s'.format(clients, tasks))
+    print('speedup                      {:10.2f}x'.format(tasks / threads))
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
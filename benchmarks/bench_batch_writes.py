@@ -0,0 +1,56 @@
+"""
+compare writes/sec of concurrent add_meal calls (threads, like cherrypy workers)
+with and without MealStorage batch_writes (group commit)
+
+usage: python bench_batch_writes.py [meals per thread] [threads]
+"""
+
+import os
+import sys
+import time
+import tempfile
+import threading
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from sqlite3_engine import SQLite3PooledEngine
+from meal_storage import MealStorage
+from model import *
+from utils import today_at
+
+
+def bench(path, n, threads, **kwds):
+    engine = SQLite3PooledEngine(path, synchronous='FULL')
+    storage = MealStorage(engine, **kwds)
+    storage.init()
+
+    def client(c):
+        for i in range(n):
+            storage.add_meal(Meal(name='obiad{}-{}'.format(c, i), date=today_at('14:00'), meal_ingredients=[
+                MealIngredient(ingredient=Ingredient(name='ingr{}-{}'.format(c, i), calories=i), quantity=100)]))
+
+    workers = [threading.Thread(target=client, args=(c,)) for c in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    storage.close()
+    engine.close()
+    return n * threads / elapsed
+
+
+def main(n=50, threads=20):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        before = bench(os.path.join(tmpdir, 'plain.db'), n, threads)
+        after = bench(os.path.join(tmpdir, 'batch.db'), n, threads, batch_writes=True)
+
+    print('transaction per write  {:10.0f} meals/s'.format(before))
+    print('batch_writes           {:10.0f} meals/s'.format(after))
+    print('speedup                {:10.2f}x'.format(after / before))
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,48 @@
+"""
+compare statements/sec of SQLite3Engine (connection per statement)
+and SQLite3PooledEngine (persistent connection per thread)
+
+usage: python bench_engine.py [statements]
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from sqlite3_engine import SQLite3Engine, SQLite3PooledEngine
+from meal_storage import MealStorage
+from model import *
+
+
+def bench(engine, n):
+    storage = MealStorage(engine)
+    storage.delete()
+    storage.init()
+    ids = [storage.add_ingredient(Ingredient(name='ingr{}'.format(i), calories=i)).id for i in range(100)]
+
+    start = time.perf_counter()
+    for i in range(n):
+        storage.get_ingredient(ids[i % len(ids)])
+    elapsed = time.perf_counter() - start
+
+    return n / elapsed
+
+
+def main(n=2000):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        before = bench(SQLite3Engine(os.path.join(tmpdir, 'plain.db')), n)
+
+        pooled = SQLite3PooledEngine(os.path.join(tmpdir, 'pooled.db'))
+        after = bench(pooled, n)
+        pooled.close()
+
+    print('SQLite3Engine        {:10.0f} stmt/s'.format(before))
+    print('SQLite3PooledEngine  {:10.0f} stmt/s'.format(after))
+    print('speedup              {:10.2f}x'.format(after / before))
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,66 @@
+"""
+peak RSS of exporting all ingredients through MealsController:
+list response (encoded at once) vs streamed response
+
+usage: python bench_export.py [rows]
+"""
+
+import os
+import sys
+import json
+import resource
+import subprocess
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from sqlite3_engine import SQLite3PooledEngine
+from meal_storage import MealStorage
+from controllers import MealsController
+
+
+def populate(path, rows):
+    storage = MealStorage(SQLite3PooledEngine(path))
+    storage.init()
+    batch = 50000
+    for start in range(0, rows, batch):
+        storage.sqlstorage.insert_many('ingredients', [
+            {'name': 'ingr{}'.format(i), 'calories': i, 'protein': 1.5, 'carbo': 2.5, 'fats': 3.5}
+            for i in range(start, min(rows, start + batch))])
+
+
+def export(path, mode):
+    """run in child process, print bytes, seconds and peak rss in kB"""
+    ctrl = MealsController(MealStorage(SQLite3PooledEngine(path)))
+
+    start = time.perf_counter()
+    size = 0
+    if mode == 'stream':
+        for chunk in ctrl.get_ingredients(stream='1'):
+            size += len(chunk)
+    else:
+        for chunk in json.JSONEncoder().iterencode(ctrl.get_ingredients()):
+            size += len(chunk.encode('utf-8'))
+
+    elapsed = time.perf_counter() - start
+    print(size, elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def main(rows=1000000):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'export.db')
+        populate(path, rows)
+
+        for mode in ('list', 'stream'):
+            out = subprocess.check_output([sys.executable, __file__, 'export', path, mode])
+            size, elapsed, rss = out.split()
+            print('{:8} {:8d} rows {:12d} bytes {:8.2f} s  peak rss {:8.1f} MB'.format(
+                mode, rows, int(size), float(elapsed), int(rss) / 1024))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['export']:
+        export(*sys.argv[2:])
+    else:
+        main(*[int(x) for x in sys.argv[1:]])
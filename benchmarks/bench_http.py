@@ -0,0 +1,71 @@
+"""
+load test of http stack - server.start() on shared in-memory database
+(SQLite3SharedMemoryEngine, no disk), concurrent keep-alive clients hitting
+GET /ingredients/<id> and GET /meals?limit=20
+
+usage: python bench_http.py [requests per client] [clients]
+"""
+
+import os
+import sys
+import time
+import threading
+import http.client
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import cherrypy
+
+import server
+from sqlite3_engine import SQLite3SharedMemoryEngine
+from meal_storage import MealStorage
+from model import *
+
+PORT = 18090
+
+
+def client(n, results):
+    conn = http.client.HTTPConnection('127.0.0.1', PORT)
+    errors = 0
+    for i in range(n):
+        conn.request('GET', '/ingredients/{}'.format(i % 100 + 1) if i % 2 else '/meals?limit=20')
+        response = conn.getresponse()
+        response.read()
+        errors += response.status != 200
+    conn.close()
+    results.append(errors)
+
+
+def main(n=500, clients=8):
+    storage = MealStorage(SQLite3SharedMemoryEngine())
+    storage.init()
+    ingredients = storage.add_ingredients([Ingredient(name='ingr{}'.format(i), calories=i) for i in range(100)])
+    for i in range(50):
+        storage.add_meal(Meal(name='meal{}'.format(i), meal_ingredients=[
+            MealIngredient(ingredient_id=x.id, quantity=100) for x in ingredients[i:i + 3]]))
+
+    cherrypy.config.update({'server.socket_port': PORT, 'server.thread_pool': clients})
+    # start() blocks, run it aside
+    cherrypy.engine.block = lambda: None
+    server.start(storage, profile='production')
+
+    results = []
+    threads = [threading.Thread(target=client, args=(n, results)) for _ in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    cherrypy.engine.exit()
+    storage.sqlstorage.engine.close()
+
+    print('clients     {:10d}'.format(clients))
+    print('requests    {:10d}'.format(n * clients))
+    print('errors      {:10d}'.format(sum(results)))
+    print('req/s       {:10.0f}'.format(n * clients / elapsed))
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
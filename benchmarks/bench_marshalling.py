@@ -0,0 +1,40 @@
+"""
+time dumping Ingredients: fresh schema per object (old behaviour),
+cached schema per object, batched dump_many and generated
+(trusted) serializers
+
+usage: python bench_marshalling.py [objects]
+"""
+
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from model import *
+
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main(n=10000):
+    ingredients = [Ingredient(id=i, name='ingr{}'.format(i), calories=i, sugar=1.0, veg_protein=2.0,
+                              protein=3.0, carbo=4.0, fats=5.0) for i in range(n)]
+
+    results = (
+        ('fresh schema per object', timed(lambda: [Ingredient._schema().dump(x) for x in ingredients])),
+        ('cached schema per object', timed(lambda: [x.dump() for x in ingredients])),
+        ('dump_many', timed(lambda: Ingredient.dump_many(ingredients))),
+        ('dump_many trusted', timed(lambda: Ingredient.dump_many(ingredients, trusted=True))),
+    )
+
+    for name, elapsed in results:
+        print('{:28} {:8.3f} s {:10.0f} obj/s'.format(name, elapsed, n / elapsed))
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,41 @@
+"""
+per-instance memory and construction time of model objects
+
+usage: python bench_model.py [objects]
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from model import *
+
+
+def measure(name, func, n):
+    tracemalloc.start()
+    start = time.perf_counter()
+    objs = func()
+    elapsed = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print('{:24} {:8.0f} bytes/obj {:10.2f} us/obj'.format(name, size / n, elapsed / n * 1e6))
+    return objs
+
+
+def main(n=100000):
+    columns = Ingredient.columns()
+    rows = [(i, 'ingr{}'.format(i), float(i), 1.0, 2.0, 3.0, 4.0, 5.0) for i in range(n)]
+    dics = [dict(zip(columns, row)) for row in rows]
+
+    measure('Ingredient(**dic)', lambda: [Ingredient(**x) for x in dics], n)
+    measure('load_many', lambda: Ingredient.load_many(dics), n)
+    if hasattr(Ingredient, 'from_rows'):
+        measure('from_rows', lambda: Ingredient.from_rows(columns, rows), n)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
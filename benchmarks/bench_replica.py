@@ -0,0 +1,88 @@
+"""
+compare reads/sec of SQLite3PooledEngine (reads from database file)
+and SQLite3ReplicaEngine (reads from in-memory replica of it), from one and more threads,
+and cost of replica verification - its duration and longest wait of a write during it.
+on local disk with warm page cache reads are about the same - the replica
+pays off on slow (network) storage, where every read transaction touches the file
+
+usage: python bench_replica.py [reads per thread] [threads] [ingredients]
+"""
+
+import os
+import sys
+import time
+import tempfile
+import threading
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from sqlite3_engine import SQLite3PooledEngine, SQLite3ReplicaEngine
+from meal_storage import MealStorage
+from model import *
+from conditions import eq, limit
+
+
+def reads(storage, n, size):
+    for i in range(n):
+        storage.get_ingredients(eq('id', i * 7919 % size + 1))
+        if i % 100 == 0:
+            storage.get_ingredients(limit(50))
+
+
+def bench(storage, n, threads, size):
+    workers = [threading.Thread(target=reads, args=(storage, n, size)) for _ in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+
+    return n * threads / (time.perf_counter() - start)
+
+
+def bench_verify(engine, storage):
+    """(seconds of verify(), longest add_ingredient while it runs)"""
+    waits, done = [], threading.Event()
+
+    def writes():
+        while not done.is_set():
+            start = time.perf_counter()
+            storage.add_ingredient(Ingredient(name='extra'))
+            waits.append(time.perf_counter() - start)
+
+    writer = threading.Thread(target=writes)
+    writer.start()
+    start = time.perf_counter()
+    same = engine.verify()
+    elapsed = time.perf_counter() - start
+    done.set()
+    writer.join()
+
+    assert same
+    return elapsed, max(waits)
+
+
+def main(n=5000, threads=4, size=100000):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'bench.db')
+        pooled = SQLite3PooledEngine(path)
+        storage = MealStorage(pooled)
+        storage.init()
+        storage.add_ingredients([Ingredient(name='ingr{}'.format(i), calories=i) for i in range(size)])
+        results = [('SQLite3PooledEngine', bench(storage, n, 1, size), bench(storage, n, threads, size))]
+        pooled.close()
+
+        replica = SQLite3ReplicaEngine(path, verify_interval=None)
+        storage = MealStorage(replica)
+        results.append(('SQLite3ReplicaEngine', bench(storage, n, 1, size), bench(storage, n, threads, size)))
+        verify, wait = bench_verify(replica, storage)
+        replica.close()
+
+    print('                      1 thread   {} threads (reads/s)'.format(threads))
+    for name, one, many in results:
+        print('{:20} {:10.0f} {:10.0f}'.format(name, one, many))
+    print('verify() of {} ingredients {:8.3f}s, longest write during it {:8.4f}s'.format(size, verify, wait))
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
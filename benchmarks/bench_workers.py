@@ -0,0 +1,121 @@
+"""
+throughput of server.create_app() with growing number of pre-forked worker processes
+(cheroot wsgi server per worker, one port shared with SO_REUSEPORT), keep-alive clients
+in their own processes hitting GET /ingredients/<id> and GET /meals?limit=20 for some seconds.
+scaling stops at number of cores - clients compete for them too
+
+usage: python bench_workers.py [seconds] [max workers]
+"""
+
+import os
+import sys
+import time
+import signal
+import tempfile
+import http.client
+import multiprocessing
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from cheroot import wsgi
+
+import server
+from sqlite3_engine import SQLite3PooledEngine
+from meal_storage import MealStorage
+from model import *
+
+PORT = 18091
+CLIENTS = 8
+
+
+def populate(path):
+    engine = SQLite3PooledEngine(path)
+    storage = MealStorage(engine)
+    storage.init()
+    ingredients = storage.add_ingredients([Ingredient(name='ingr{}'.format(i), calories=i) for i in range(100)])
+    for i in range(50):
+        storage.add_meal(Meal(name='meal{}'.format(i), meal_ingredients=[
+            MealIngredient(ingredient_id=x.id, quantity=100) for x in ingredients[i:i + 3]]))
+    # nothing open is inherited by workers
+    engine.close()
+
+
+def worker(app):
+    wsgi.Server(('127.0.0.1', PORT), app, numthreads=8, reuse_port=True).safe_start()
+
+
+def client(seconds, results):
+    conn = http.client.HTTPConnection('127.0.0.1', PORT)
+    count = errors = 0
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        conn.request('GET', '/ingredients/{}'.format(count % 100 + 1) if count % 2 else '/meals?limit=20')
+        response = conn.getresponse()
+        response.read()
+        count += 1
+        errors += response.status != 200
+    conn.close()
+    results.put((count, errors))
+
+
+def wait_ready():
+    for _ in range(100):
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', PORT)
+            conn.request('GET', '/meals?limit=1')
+            conn.getresponse().read()
+            conn.close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError('workers did not start')
+
+
+def bench(app, workers, seconds):
+    pids = []
+    for _ in range(workers):
+        pid = os.fork()
+        if not pid:
+            try:
+                worker(app)
+            finally:
+                os._exit(0)
+        pids.append(pid)
+
+    try:
+        wait_ready()
+        results = multiprocessing.Queue()
+        clients = [multiprocessing.Process(target=client, args=(seconds, results)) for _ in range(CLIENTS)]
+        for p in clients:
+            p.start()
+        done = [results.get() for _ in clients]
+        for p in clients:
+            p.join()
+    finally:
+        for pid in pids:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+
+    return sum(x for x, _ in done) / seconds, sum(x for _, x in done)
+
+
+def main(seconds=3, max_workers=4):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'bench.db')
+        populate(path)
+        # created once in master, every worker opens its own storage after fork
+        app = server.create_app({'database': path})
+
+        print('cores {}'.format(os.cpu_count()))
+        print('workers      req/s  errors  speedup')
+        base = None
+        workers = 1
+        while workers <= max_workers:
+            rate, errors = bench(app, workers, seconds)
+            base = base or rate
+            print('{:7d} {:10.0f} {:7d} {:7.2f}x'.format(workers, rate, errors, rate / base))
+            workers *= 2
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,230 @@
+"""
+microbenchmarks of hot operations - sql generation, storage (SQLite3MemoryEngine
+and file backed SQLite3Engine) and marshalling, on synthetic dataset.
+reports ops/sec and latency percentiles, saves results as json and compares
+them with baseline, exit status 1 if any operation got slower than threshold
+
+usage: python suite.py [--size N] [--engine memory|file|all] [--repeat N] [--only SUBSTR]
+                       [--out results.json] [--baseline baseline.json] [--threshold 0.2]
+                       [--save-baseline]
+
+e.g. python suite.py --save-baseline --baseline master.json (on master)
+     python suite.py --baseline master.json (on branch)
+"""
+
+import gc
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import platform
+import tempfile
+from datetime import datetime
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from sqlite3_engine import SQLite3Engine, SQLite3MemoryEngine
+from sql_storage import SQLStorage
+from meal_storage import MealStorage
+from model import *
+from conditions import *
+
+
+def measure(func, iterations, min_time=0.2):
+    """call func (warmed up) at least iterations times or min_time seconds, return stats"""
+    for _ in range(min(10, iterations)):
+        func()
+
+    # like timeit, collector pauses would land on random calls
+    gc.collect()
+    gc.disable()
+    try:
+        timings = []
+        deadline = time.perf_counter() + min_time
+        while len(timings) < iterations or time.perf_counter() < deadline:
+            start = time.perf_counter_ns()
+            func()
+            timings.append(time.perf_counter_ns() - start)
+    finally:
+        gc.enable()
+
+    timings.sort()
+
+    def percentile(p):
+        return timings[min(len(timings) - 1, int(len(timings) * p / 100))] / 1000
+
+    return {
+        'calls': len(timings),
+        'ops_sec': len(timings) / (sum(timings) / 1e9),
+        'p50_us': percentile(50),
+        'p90_us': percentile(90),
+        'p99_us': percentile(99),
+        'max_us': timings[-1] / 1000,
+    }
+
+
+def meal(i, ingredient_ids=None):
+    if ingredient_ids:
+        mis = [MealIngredient(ingredient_id=ingredient_ids[(i + j) % len(ingredient_ids)], quantity=100 + j) for j in range(5)]
+    else:
+        mis = [MealIngredient(ingredient=Ingredient(name='ingr{}-{}'.format(i, j), calories=j), quantity=100 + j) for j in range(5)]
+
+    return Meal(name='meal{}'.format(i), date=datetime(2020, 1, 1 + i % 28, 12, 0), meal_ingredients=mis)
+
+
+def populate(storage, size):
+    """size ingredients, size / 10 meals with 5 ingredients each"""
+    storage.delete()
+    storage.init()
+    ids = [x.id for x in storage.add_ingredients(
+        [Ingredient(name='ingr{}'.format(i), calories=i, protein=i % 30, carbo=i % 70) for i in range(size)])]
+
+    for i in range(max(1, size // 10)):
+        storage.add_meal(meal(i, ids))
+
+    return ids
+
+
+def storage_benchmarks(storage, size):
+    ids = populate(storage, size)
+    meal_ids = [x.id for x in storage.get_meals()]
+    rnd = random.Random(0)
+    counter = iter(range(10 ** 9))
+
+    return {
+        'select_by_id': lambda: storage.sqlstorage.select('ingredients', (), where(eq('id', rnd.choice(ids)))),
+        'get_ingredient_uncached': lambda: storage.get_ingredients(id=rnd.choice(ids)),
+        'get_meals_page': lambda: storage.page(storage.get_meals, 100, rnd.choice(meal_ids)),
+        'get_meal_ingredients': lambda: storage.get_meal_ingredients_with_ingredient(meal_id=rnd.choice(meal_ids)),
+        'search_ingredients': lambda: storage.search_ingredients(name='ingr{}'.format(rnd.randrange(size))),
+        'add_meal': lambda: storage.add_meal(meal(next(counter))),
+    }
+
+
+def sql_benchmarks():
+    sqlstorage = SQLStorage(None)
+    conds = where(eq('meal_id', 1), between('date', 'a', 'b'), in_('id', [1, 2, 3]), order_by('-date'), limit(10))
+
+    return {
+        'prep_select': lambda: sqlstorage._prep_select('meals', Meal.columns(), conds),
+        'prep_insert': lambda: sqlstorage._prep_insert('ingredients', {'name': 'x', 'calories': 1.0}),
+        'prep_update': lambda: sqlstorage._prep_update('ingredients', {'name': 'x'}, where(eq('id', 1))),
+    }
+
+
+def marshalling_benchmarks():
+    data = meal(1).dump()
+    data['id'] = 1
+    obj = Meal.load(data)
+    objs = [Meal.load(data) for _ in range(100)]
+
+    return {
+        'Meal.load': lambda: Meal.load(data),
+        'Meal.load_trusted': lambda: Meal.load(data, trusted=True),
+        'Meal.dump': lambda: obj.dump(),
+        'Meal.dump_trusted': lambda: obj.dump(trusted=True),
+        'Meal.dump_many_100': lambda: Meal.dump_many(objs, trusted=True),
+    }
+
+
+def run(size, engines, iterations, only=None, repeat=3):
+    results = {}
+
+    def bench_all(prefix, benchmarks):
+        for name, func in benchmarks.items():
+            key = '{}/{}'.format(prefix, name)
+            if only and only not in key:
+                continue
+
+            # best of rounds - noise only ever makes things slower
+            stats = min((measure(func, iterations) for _ in range(repeat)), key=lambda x: x['p50_us'])
+            results[key] = stats
+            print('{:42} {:12.0f} ops/s  p50 {:9.1f} us  p99 {:9.1f} us'.format(
+                key, stats['ops_sec'], stats['p50_us'], stats['p99_us']))
+
+    bench_all('sql', sql_benchmarks())
+    bench_all('marshalling', marshalling_benchmarks())
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name in engines:
+            if name == 'memory':
+                engine = SQLite3MemoryEngine()
+            else:
+                engine = SQLite3Engine(os.path.join(tmpdir, 'bench.db'))
+
+            bench_all('{}'.format(name), storage_benchmarks(MealStorage(engine), size))
+
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    names of operations slower than baseline by more than threshold 
+    (fraction of median ops/sec, less noisy than mean)
+    """
+    regressions = []
+    for key, stats in sorted(results.items()):
+        base = baseline.get(key)
+        if base is None:
+            continue
+
+        change = base['p50_us'] / stats['p50_us'] - 1
+        regressed = change < -threshold
+        print('{:42} {:+7.1%}{}'.format(key, change, '  REGRESSION' if regressed else ''))
+        if regressed:
+            regressions.append(key)
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--size', type=int, default=1000, help='number of synthetic ingredients (meals = size / 10)')
+    parser.add_argument('--engine', choices=('memory', 'file', 'all'), default='all')
+    parser.add_argument('--iterations', type=int, default=1000, help='minimum calls per operation')
+    parser.add_argument('--repeat', type=int, default=3, help='rounds per operation, best is kept')
+    parser.add_argument('--only', help='run operations containing this substring')
+    parser.add_argument('--out', default='bench_results.json', help='file to save results to')
+    parser.add_argument('--baseline', help='results to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed median ops/sec drop, fraction')
+    parser.add_argument('--save-baseline', action='store_true', help='save results as baseline instead of comparing')
+    args = parser.parse_args(argv)
+
+    engines = ('memory', 'file') if args.engine == 'all' else (args.engine,)
+    results = run(args.size, engines, args.iterations, args.only, args.repeat)
+
+    report = {
+        'meta': {
+            'time': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'size': args.size,
+            'repeat': args.repeat,
+        },
+        'results': results,
+    }
+
+    out = args.baseline if args.save_baseline and args.baseline else args.out
+    with open(out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('results saved to {}'.format(out))
+
+    if args.save_baseline or not args.baseline:
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)['results']
+
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print('{} operation(s) slower than baseline by more than {:.0%}'.format(len(regressions), args.threshold))
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,156 @@
+"""
+bulk import and export of ingredient catalog as ndjson (json object per line) or csv
+"""
+
+import io
+import csv
+import json
+
+from model import Ingredient
+from meta import MarshallError
+
+FORMATS = ('ndjson', 'csv')
+
+CONTENT_TYPES = {
+    'application/x-ndjson': 'ndjson',
+    'application/ndjson': 'ndjson',
+    'application/jsonlines': 'ndjson',
+    'text/csv': 'csv',
+}
+
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def iter_lines(fp, size=1 << 16):
+    """lines of binary file-like fp read in blocks (cherrypy request body readline loses data)"""
+    rest = b''
+    while True:
+        data = fp.read(size)
+        if not data:
+            break
+
+        lines = (rest + data).split(b'\n')
+        rest = lines.pop()
+        for line in lines:
+            yield line + b'\n'
+
+    if rest:
+        yield rest
+
+
+def _text(lines):
+    for line in lines:
+        yield line.decode('utf-8') if isinstance(line, bytes) else line
+
+
+def parse(lines, fmt):
+    """
+    generate (line number, dict or error message) from lines (bytes or str) of ndjson or csv,
+    csv has header line and empty values are missing values
+    """
+    if fmt == 'ndjson':
+        for n, line in enumerate(_text(lines), 1):
+            if not line.strip():
+                continue
+            try:
+                dic = json.loads(line)
+            except ValueError as e:
+                yield n, 'invalid json: {}'.format(e)
+                continue
+
+            yield n, dic if isinstance(dic, dict) else 'json object expected'
+
+    elif fmt == 'csv':
+        reader = csv.DictReader(_text(lines))
+        try:
+            for dic in reader:
+                if None in dic:
+                    yield reader.line_num, 'more values than columns'
+                    continue
+                yield reader.line_num, dict((k, v) for k, v in dic.items() if v not in ('', None))
+        except csv.Error as e:
+            yield reader.line_num, 'invalid csv: {}'.format(e)
+
+    else:
+        raise ValueError('format must be one of: {}'.format(', '.join(FORMATS)))
+
+
+def validate(records):
+    """
+    (line number, Ingredient or error) of parsed records, ids are not imported.
+    name is required - ingredient without it can't be read back
+    """
+    for n, dic in records:
+        if isinstance(dic, str):
+            yield n, dic
+            continue
+
+        dic.pop('id', None)
+        if dic.get('name') is None:
+            yield n, {'name': ['Missing data for required field.']}
+            continue
+        try:
+            yield n, Ingredient.load(dic)
+        except MarshallError as e:
+            yield n, e.errors
+
+
+def import_ingredients(storage, lines, fmt, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    parse, validate and add ingredients from lines incrementally, chunk_size ingredients
+    per transaction (executemany). generates events - {"line": n, "error": ...} for every
+    invalid line or line of failed chunk, {"progress": {...}} after every chunk and {"done": {...}}
+    """
+    status = dict(lines=0, imported=0, errors=0)
+    chunk = []
+
+    def flush():
+        try:
+            storage.add_ingredients([x for _, x in chunk])
+            status['imported'] += len(chunk)
+        except Exception as e:
+            status['errors'] += len(chunk)
+            yield {'lines': [chunk[0][0], chunk[-1][0]], 'error': str(e)}
+
+        del chunk[:]
+        yield {'progress': dict(status)}
+
+    for n, ret in validate(parse(lines, fmt)):
+        status['lines'] = n
+        if isinstance(ret, Ingredient):
+            chunk.append((n, ret))
+            if len(chunk) >= chunk_size:
+                yield from flush()
+        else:
+            status['errors'] += 1
+            yield {'line': n, 'error': ret}
+
+    if chunk:
+        yield from flush()
+
+    yield {'done': status}
+
+
+def export_ingredients(storage, fmt, batch=DEFAULT_CHUNK_SIZE):
+    """generate catalog as chunks of ndjson or csv bytes, one batch of rows (keyset page) at a time"""
+    if fmt not in FORMATS:
+        raise ValueError('format must be one of: {}'.format(', '.join(FORMATS)))
+
+    columns = Ingredient.columns()
+    if fmt == 'csv':
+        out = io.StringIO()
+        writer = csv.writer(out, lineterminator='\n')
+        writer.writerow(columns)
+
+    for objs in storage.iter_pages(storage.get_ingredients, batch):
+        dics = Ingredient.dump_many(objs, trusted=True)
+        if fmt == 'ndjson':
+            yield ''.join(json.dumps(x) + '\n' for x in dics).encode('utf-8')
+        else:
+            writer.writerows([x.get(col) for col in columns] for x in dics)
+            yield out.getvalue().encode('utf-8')
+            out.seek(0)
+            out.truncate()
+
+    if fmt == 'csv' and out.tell():
+        yield out.getvalue().encode('utf-8')
@@ -1,10 +1,17 @@
 from functools import namedtuple
 
-__all__ = ['cond', 'eq', 'lt', 'gt', 'neq', 'like', 'where']
+__all__ = ['cond', 'eq', 'lt', 'gt', 'neq', 'like', 'match', 'in_', 'between', 'is_null', 
+           'and_', 'or_', 'group_by', 'order_by', 'limit', 'prefixed', 'where']
+
+# condition AST, compiled to sql by SQLStorage
+condition = namedtuple('condition', ['op', 'lval', 'rval'])
+group = namedtuple('group', ['op', 'conds'])
+grouping = namedtuple('grouping', ['columns'])
+ordering = namedtuple('ordering', ['columns'])
+limiting = namedtuple('limiting', ['count', 'offset'])
 
 def cond(*args):
-    c = namedtuple('condition', ['op', 'lval', 'rval'])
-    return c(*args)
+    return condition(*args)
 
 def eq(*args):
     return cond('=', *args)
@@ -21,5 +28,49 @@ def neq(*args):
 def like(*args):
     return cond('like', *args)
 
+def match(*args):
+    """full text search condition, lval is fts table"""
+    return cond('MATCH', *args)
+
+def in_(lval, values):
+    return cond('IN', lval, tuple(values))
+
+def between(lval, low, high):
+    return cond('BETWEEN', lval, (low, high))
+
+def is_null(lval):
+    return cond('IS NULL', lval, ())
+
+def and_(*conds):
+    return group('AND', tuple(conds))
+
+def or_(*conds):
+    return group('OR', tuple(conds))
+
+def group_by(*columns):
+    return grouping(tuple(columns))
+
+def order_by(*columns):
+    """columns prefixed with '-' are sorted descending"""
+    return ordering(tuple(columns))
+
+def limit(count, offset=None):
+    return limiting(count, offset)
+
+def prefixed(prefix, conds):
+    """conditions with column names prefixed (e.g. with table alias)"""
+    def _prefixed(c):
+        if isinstance(c, group):
+            return c._replace(conds=tuple(_prefixed(x) for x in c.conds))
+        if isinstance(c, grouping):
+            return c._replace(columns=tuple(prefix + x for x in c.columns))
+        if isinstance(c, ordering):
+            return c._replace(columns=tuple('-' + prefix + x[1:] if x.startswith('-') else prefix + x for x in c.columns))
+        if isinstance(c, condition):
+            return c._replace(lval=prefix + c.lval)
+        return c
+
+    return tuple(_prefixed(c) for c in conds)
+
 def where(*args):
     return tuple(args)
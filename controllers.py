@@ -1,25 +1,168 @@
+import io
 import json
 import cherrypy
+from datetime import date, datetime, timedelta
 
-from sqlite3_engine import SQLite3Engine
-from meal_storage import MealStorage
+from sqlite3_engine import SQLite3PooledEngine
+from meal_storage import MealStorage, NUTRITION_BUCKETS
+import catalog
+import planner
 from model import *
 from conditions import *
 from utils import first 
+from metrics import exposition
+from profiling import PROFILER, collapsed
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH_SIZE = 1000
+
+
+def _page_params(limit, after):
+    """validate ?limit=&after= query parameters"""
+    try:
+        limit = DEFAULT_PAGE_SIZE if limit is None else int(limit)
+        after = None if after is None else int(after)
+    except ValueError:
+        raise cherrypy.HTTPError(400, 'limit and after must be integers')
+
+    if limit < 1:
+        raise cherrypy.HTTPError(400, 'limit must be positive')
+
+    return min(limit, MAX_PAGE_SIZE), after
+
+
+def _stream_param(stream):
+    """validate ?stream= query parameter"""
+    if stream is None or stream in ('0', 'false'):
+        return False
+    if stream in ('1', 'true'):
+        return True
+
+    raise cherrypy.HTTPError(400, 'stream must be one of: 0, 1, false, true')
+
+
+def _unread_body(*args):
+    """request body processor (and default_proc) leaving body to be read (streamed) by handler"""
+
 
 class MealsController(object):
-    def __init__(self):
-        self.storage = MealStorage(SQLite3Engine('e.db'))
+    def __init__(self, storage=None):
+        if storage is None:
+            storage = MealStorage(SQLite3PooledEngine('e.db'))
+
+        self.storage = storage
+        self._nutrients = None # planner.NutrientMatrix, created on first /plan
+
+    def _conditional(self, *tables):
+        """
+        set ETag from versions of tables response is read from, 
+        answer 304 Not Modified if client has it already - before any query or serialization. 
+        versions are read before the data, a write in between only makes next request miss
+        """
+        etag = self.storage.etag(*tables)
+        cherrypy.serving.response.headers['ETag'] = etag
+
+        tags = cherrypy.serving.request.headers.get('If-None-Match')
+        if tags:
+            tags = [x.strip() for x in tags.split(',')]
+            if '*' in tags or etag in (x[2:] if x.startswith('W/') else x for x in tags):
+                raise cherrypy.HTTPRedirect([], 304)
+
+    def _page(self, cls, get, limit, after, **kwds):
+        """
+        paginated response {"items": [...], "next": <after for next page or null>}
+        """
+        count, after = _page_params(limit, after)
+        objs, next_ = self.storage.page(get, count, after, **kwds)
+
+        return {'items': cls.dump_many(objs, trusted=True), 'next': next_}
+
+    def _stream(self, cls, get, **kwds):
+        """
+        streamed response - json array encoded in chunks, one batch of rows at a time 
+        (json_out passes generators through, see server.json_handler)
+        """
+        cherrypy.serving.response.stream = True
+
+        def chunks():
+            yield b'['
+            sep = b''
+            for objs in self.storage.iter_pages(get, STREAM_BATCH_SIZE, **kwds):
+                yield sep + b', '.join(json.dumps(x).encode('utf-8') for x in cls.dump_many(objs, trusted=True))
+                sep = b', '
+            yield b']'
+
+        return chunks()
 
     # INGREDIENTS
 
     @cherrypy.tools.accept(media='application/json')
-    def get_ingredients(self):
+    def get_ingredients(self, limit=None, after=None, stream=None):
+        """
+        Handler for /ingredients (GET), paginated if limit or after given,
+        streamed if stream=1 (or true)
+        """
+        stream = _stream_param(stream)
+        self._conditional('ingredients')
+
+        if stream:
+            return self._stream(Ingredient, self.storage.get_ingredients)
+
+        if limit is None and after is None:
+            return Ingredient.dump_many(self.storage.get_ingredients(), trusted=True)
+
+        return self._page(Ingredient, self.storage.get_ingredients, limit, after)
+
+
+    @cherrypy.config(**{
+        'tools.json_in.on': False, 
+        'tools.json_out.on': False, 
+        'request.body.processors': {},
+        'request.body.default_proc': _unread_body})
+    def import_ingredients(self, format=None, chunk_size=None):
+        """
+        Handler for /ingredients/import?format=<ndjson|csv> (POST) - body is read and added 
+        incrementally, chunk_size ingredients per transaction (format can be given by Content-Type).
+        response is streamed ndjson of progress and error events (see catalog.import_ingredients)
         """
-        Handler for /meals (GET)
+        request = cherrypy.serving.request
+        fmt = format or catalog.CONTENT_TYPES.get(request.headers.get('Content-Type', '').split(';')[0].strip())
+        if fmt not in catalog.FORMATS:
+            raise cherrypy.HTTPError(400, 'format must be one of: {0}'.format(', '.join(catalog.FORMATS)))
+
+        try:
+            chunk_size = catalog.DEFAULT_CHUNK_SIZE if chunk_size is None else max(1, int(chunk_size))
+        except ValueError:
+            raise cherrypy.HTTPError(400, 'chunk_size must be integer')
+
+        response = cherrypy.serving.response
+        response.headers['Content-Type'] = 'application/x-ndjson'
+        response.stream = True
+
+        def events():
+            for event in catalog.import_ingredients(self.storage, catalog.iter_lines(request.body), fmt, chunk_size):
+                yield (json.dumps(event) + '\n').encode('utf-8')
+
+        return events()
+
+
+    @cherrypy.config(**{'tools.json_out.on': False})
+    def export_ingredients(self, format='ndjson'):
         """
+        Handler for /ingredients/export?format=<ndjson|csv> (GET) - whole catalog, streamed
+        """
+        if format not in catalog.FORMATS:
+            raise cherrypy.HTTPError(400, 'format must be one of: {0}'.format(', '.join(catalog.FORMATS)))
+
+        self._conditional('ingredients')
+
+        response = cherrypy.serving.response
+        response.headers['Content-Type'] = 'text/csv; charset=utf-8' if format == 'csv' else 'application/x-ndjson'
+        response.headers['Content-Disposition'] = 'attachment; filename="ingredients.{0}"'.format(format)
+        response.stream = True
 
-        return [x.dump() for x in self.storage.get_ingredients()]
+        return catalog.export_ingredients(self.storage, format, STREAM_BATCH_SIZE)
 
 
     @cherrypy.tools.accept(media='application/json')
@@ -46,12 +189,13 @@ class MealsController(object):
         """
         Handler for /ingredients/<id> (GET)
         """
-        ret = first(self.storage.get_ingredients(eq('id', id)))
+        self._conditional('ingredients')
+        ret = self.storage.get_ingredient(id)
 
         if ret is None:
             raise cherrypy.HTTPError(404, 'Ingredient id:\"{0}\" not found'.format(id))
 
-        return ret.dump()
+        return ret.dump(trusted=True)
 
     # MEAL INGREDIENTS
 
@@ -60,34 +204,42 @@ class MealsController(object):
         """
         Handler for /meals/<meal_id>/ingredients (GET)
         """
+        self._conditional('meal_ingredients', 'ingredients')
 
-        meal_ingredients = self.storage.get_meal_ingredients(eq('meal_id', meal_id))
-        for mi in meal_ingredients:
-            mi.ingredient = self.storage.get_ingredient(mi.ingredient_id)
-
-        return [x.dump() for x in meal_ingredients]
+        meal_ingredients = self.storage.get_meal_ingredients_with_ingredient(eq('meal_id', meal_id))
+        return MealIngredient.dump_many(meal_ingredients, trusted=True)
 
 
     # MEALS
 
     @cherrypy.tools.accept(media='application/json')
-    def get_meals(self):
+    def get_meals(self, limit=None, after=None, stream=None):
         """
-        Handler for /meals (GET)
+        Handler for /meals (GET), paginated if limit or after given,
+        streamed if stream=1 (or true)
         """
+        stream = _stream_param(stream)
+        self._conditional('meals')
 
-        return [x.dump() for x in self.storage.get_meals()]
+        if stream:
+            return self._stream(Meal, self.storage.get_meals)
+
+        if limit is None and after is None:
+            return Meal.dump_many(self.storage.get_meals(), trusted=True)
+
+        return self._page(Meal, self.storage.get_meals, limit, after)
 
 
     def get_meal(self, id):
         """
         Handler for /meals/<name> (GET)
         """
+        self._conditional('meals')
         ret = self.storage.get_meal(id)
         if ret is None:
             raise cherrypy.HTTPError(404, 'Meal id:\"{0}\" not found'.format(id))
 
-        return ret.dump()
+        return ret.dump(trusted=True)
 
 
     def add_meal(self):
@@ -108,8 +260,65 @@ class MealsController(object):
             raise cherrypy.HTTPError(
                 400, 'Malformed POST request data: {0}'.format(errmsg))
 
-        id_ = self.storage.add_meal(meal)
-        meal.id = id_
+        meal = self.storage.add_meal(meal)
+        return meal.dump()
+
+
+    # STATS
+
+    def get_nutrition(self, bucket='day', **kwds):
+        """
+        Handler for /stats/nutrition?from=<YYYY-MM-DD>&to=<YYYY-MM-DD>&bucket=<day|week|month> (GET),
+        defaults to last 30 days
+        """
+        if bucket not in NUTRITION_BUCKETS:
+            raise cherrypy.HTTPError(400, 'bucket must be one of: {0}'.format(', '.join(sorted(NUTRITION_BUCKETS))))
+
+        try:
+            end = datetime.strptime(kwds['to'], '%Y-%m-%d').date() if 'to' in kwds else date.today()
+            start = datetime.strptime(kwds['from'], '%Y-%m-%d').date() if 'from' in kwds else end - timedelta(days=30)
+        except ValueError:
+            raise cherrypy.HTTPError(400, 'from and to must be dates in YYYY-MM-DD format')
+
+        self._conditional('meals', 'meal_ingredients', 'ingredients', 'nutrition_daily')
+
+        return self.storage.get_nutrition(start.isoformat(), end.isoformat(), bucket)
+
+
+    # PLANNING
+
+    def plan(self, name=None, ingredients=None, max_quantity=None, size=None, **kwds):
+        """
+        Handler for /plan?<calories|protein|carbo|fats>=<target>&ingredients=<id,id...>&max_quantity=<grams>&size=<n> (GET)
+        meal (ready to POST to /meals) with quantities of ingredients closest to targets,
+        best size ingredients of whole catalog if ingredients not given
+        """
+        if planner.np is None:
+            raise cherrypy.HTTPError(501, 'meal planning needs numpy')
+
+        try:
+            targets = dict((k, float(v)) for k, v in kwds.items() if k in planner.PLAN_NUTRIENTS)
+            ids = None if ingredients is None else [int(x) for x in ingredients.split(',') if x.strip()]
+            max_quantity = 500.0 if max_quantity is None else float(max_quantity)
+            size = 5 if size is None else int(size)
+        except ValueError:
+            raise cherrypy.HTTPError(400, 'targets, max_quantity, size and ingredients must be numbers')
+
+        if not targets:
+            raise cherrypy.HTTPError(400, 'at least one target required: {0}'.format(', '.join(planner.PLAN_NUTRIENTS)))
+        if max_quantity <= 0 or size < 1:
+            raise cherrypy.HTTPError(400, 'max_quantity and size must be positive')
+
+        if self._nutrients is None:
+            self._nutrients = planner.NutrientMatrix(self.storage)
+
+        try:
+            quantities, _ = planner.plan(self._nutrients, targets, ids, max_quantity, size)
+        except KeyError as e:
+            raise cherrypy.HTTPError(404, 'Ingredient id:\"{0}\" not found'.format(e.args[0]))
+
+        meal = Meal(name=name or 'plan', meal_ingredients=[
+            MealIngredient(ingredient_id=id_, quantity=quantity) for id_, quantity in quantities])
         return meal.dump()
 
 
@@ -140,11 +349,91 @@ class MealsController(object):
         return ''
 
 
-    def search(self, q, **kwds):
-        table = q
+    def search(self, q, limit=None, after=None, stream=None, **kwds):
+        """
+        Handler for /search?q=<meals|ingredients>&<column>=<text> (GET), 
+        paginated (by id instead of relevance) if limit or after given,
+        streamed (by id) if stream=1 (or true)
+        """
         if q == 'meals':
-            conditions = [like(key, '%'+value+'%') for (key, value) in kwds.items() if key in Meal.columns()]
-            return [x.dump() for x in self.storage.get_meals(*conditions)]
+            cls, search, table = Meal, self.storage.search_meals, 'meals'
         elif q == 'ingredients':
-            conditions = [like(key, '%'+value+'%') for (key, value) in kwds.items() if key in Ingredient.columns()]
-            return [x.dump() for x in self.storage.get_ingredients(*conditions)]
+            cls, search, table = Ingredient, self.storage.search_ingredients, 'ingredients'
+        else:
+            return
+
+        stream = _stream_param(stream)
+        self._conditional(table)
+
+        if stream:
+            return self._stream(cls, search, **kwds)
+
+        if limit is None and after is None:
+            return cls.dump_many(search(**kwds), trusted=True)
+
+        return self._page(cls, search, limit, after, **kwds)
+
+
+class MetricsController(object):
+
+    @cherrypy.config(**{'tools.json_out.on': False})
+    def metrics(self):
+        """
+        Handler for /metrics (GET) - sql statement and request metrics in prometheus text format
+        """
+        cherrypy.serving.response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+        return exposition().encode('utf-8')
+
+
+class ProfileController(object):
+    """admin - request profiles collected by server.profile tool, from allowed addresses only"""
+
+    def __init__(self, profiler=PROFILER):
+        self.profiler = profiler
+
+    def _check_access(self):
+        request = cherrypy.serving.request
+        if not self.profiler.is_allowed(request.headers, request.remote.ip):
+            raise cherrypy.HTTPError(403, 'Forbidden')
+
+    @cherrypy.config(**{'tools.json_out.on': False})
+    def get_profile(self, route=None, format='pstats'):
+        """
+        Handler for /admin/profile (GET) - profiled routes with request count and seconds 
+        spent in total, storage, marshalling and json encoding,
+        /admin/profile?route=<route>&format=<pstats|collapsed|text> - stats of route 
+        (pstats file, collapsed stacks for flamegraph or text report)
+        """
+        self._check_access()
+        headers = cherrypy.serving.response.headers
+
+        if route is None:
+            headers['Content-Type'] = 'application/json'
+            return json.dumps(self.profiler.routes()).encode('utf-8')
+
+        stats = self.profiler.stats(route)
+        if stats is None:
+            raise cherrypy.HTTPError(404, 'Route \"{0}\" not profiled'.format(route))
+
+        if format == 'pstats':
+            headers['Content-Type'] = 'application/octet-stream'
+            headers['Content-Disposition'] = 'attachment; filename="{0}.pstats"'.format(route)
+            return self.profiler.dump(route)
+
+        headers['Content-Type'] = 'text/plain; charset=utf-8'
+        if format == 'collapsed':
+            return collapsed(stats).encode('utf-8')
+        if format == 'text':
+            stats.stream = out = io.StringIO()
+            stats.sort_stats('cumulative').print_stats(50)
+            return out.getvalue().encode('utf-8')
+
+        raise cherrypy.HTTPError(400, 'format must be one of: collapsed, pstats, text')
+
+    def delete_profile(self):
+        """
+        Handler for /admin/profile (DELETE) - forget collected profiles
+        """
+        self._check_access()
+        self.profiler.clear()
+        cherrypy.response.status = 204
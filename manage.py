@@ -0,0 +1,44 @@
+"""
+database maintenance commands
+
+usage: python manage.py <command> [database]
+
+commands:
+    migrate             create schema or upgrade database to latest version
+    rebuild-nutrition   recompute daily nutrition rollup from meals
+"""
+
+import sys
+
+from sqlite3_engine import SQLite3Engine
+from meal_storage import MealStorage
+
+
+def migrate(storage):
+    before = storage.version()
+    storage.init()
+    print('schema version {} -> {}'.format(before, storage.version()))
+
+
+def rebuild_nutrition(storage):
+    storage.rebuild_nutrition()
+    print('nutrition rollup rebuilt')
+
+
+COMMANDS = {
+    'migrate': migrate,
+    'rebuild-nutrition': rebuild_nutrition,
+}
+
+
+def main(command=None, constr='e.db'):
+    if command not in COMMANDS:
+        print(__doc__)
+        return 1
+
+    COMMANDS[command](MealStorage(SQLite3Engine(constr)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(*sys.argv[1:]))
@@ -1,27 +1,237 @@
+import re
 import sys
+import threading
+from copy import copy
+from uuid import uuid4
 
-from sql_storage import SQLStorage 
+from functools import partial
+from sql_storage import SQLStorage, WriteQueue
 from model import *
 from conditions import *
-from utils import extract, first
+from conditions import ordering
+from utils import extract, first, LRUCache
+
+
+FTS_TABLES = ('ingredients', 'meals')
+
+
+def _fts_ddl(table):
+    # external content fts5 table over name column kept in sync by triggers
+    return (
+        "CREATE VIRTUAL TABLE IF NOT EXISTS {0}_fts USING fts5(name, content='{0}', content_rowid='id')".format(table),
+        """
+            CREATE TRIGGER IF NOT EXISTS {0}_fts_ai AFTER INSERT ON {0} BEGIN
+                INSERT INTO {0}_fts(rowid, name) VALUES (new.id, new.name);
+            END
+        """.format(table),
+        """
+            CREATE TRIGGER IF NOT EXISTS {0}_fts_ad AFTER DELETE ON {0} BEGIN
+                INSERT INTO {0}_fts({0}_fts, rowid, name) VALUES ('delete', old.id, old.name);
+            END
+        """.format(table),
+        """
+            CREATE TRIGGER IF NOT EXISTS {0}_fts_au AFTER UPDATE OF name ON {0} BEGIN
+                INSERT INTO {0}_fts({0}_fts, rowid, name) VALUES ('delete', old.id, old.name);
+                INSERT INTO {0}_fts(rowid, name) VALUES (new.id, new.name);
+            END
+        """.format(table),
+        "INSERT INTO {0}_fts({0}_fts) VALUES ('rebuild')".format(table))
+
+
+def _migrate_fts(sqlstorage):
+    # sqlite can be compiled without fts5, search falls back to LIKE then
+    options = [x['compile_options'] for x in sqlstorage.select('pragma_compile_options', ('compile_options',))]
+    if 'ENABLE_FTS5' not in options:
+        return
+
+    for table in FTS_TABLES:
+        sqlstorage.execute_ddl(_fts_ddl(table))
+
+
+def fts_query(text):
+    """convert user text to fts5 query - prefix match of every word"""
+    return ' '.join('"{}"*'.format(x) for x in re.findall(r'\w+', text))
+
+
+# ingredient nutrients are per 100 (g) of quantity
+NUTRIENTS = ('calories', 'fats', 'sugar', 'veg_protein', 'protein', 'carbo')
+
+# bucket of nutrition_daily.day
+NUTRITION_BUCKETS = {
+    'day': 'day',
+    'week': "date(day, 'weekday 0', '-6 days')", # monday
+    'month': "date(day, 'start of month')",
+}
+
+
+def _nutrition_upsert(select):
+    """add rows of select (day, nutrients...) to nutrition_daily"""
+    return """
+        INSERT INTO nutrition_daily(day, {0})
+        {1}
+        ON CONFLICT(day) DO UPDATE SET {2};
+    """.format(
+        ', '.join(NUTRIENTS), 
+        select, 
+        ', '.join('{0} = {0} + excluded.{0}'.format(x) for x in NUTRIENTS))
+
+
+def _nutrition_ddl():
+    # meal ingredient row added (sign='') or removed (sign='-') as row
+    def meal_ingredient(row, sign):
+        return _nutrition_upsert("""
+            SELECT date(m.date), {}
+            FROM meals m, ingredients i
+            WHERE m.id = {row}.meal_id AND i.id = {row}.ingredient_id
+        """.format(', '.join('{}i.{} * {}.quantity / 100'.format(sign, x, row) for x in NUTRIENTS), row=row))
+
+    # all meal ingredients of ingredient, nutrients changed by expr
+    def ingredient(row, expr):
+        return _nutrition_upsert("""
+            SELECT date(m.date), {}
+            FROM meal_ingredients mi, meals m
+            WHERE mi.ingredient_id = {}.id AND m.id = mi.meal_id
+            GROUP BY date(m.date)
+        """.format(', '.join('{} * total(mi.quantity) / 100'.format(expr.format(x)) for x in NUTRIENTS), row))
+
+    # all meal ingredients of meal added or removed
+    def meal(row, sign):
+        return _nutrition_upsert("""
+            SELECT date({row}.date), {}
+            FROM meal_ingredients mi, ingredients i
+            WHERE mi.meal_id = {row}.id AND i.id = mi.ingredient_id
+            GROUP BY date({row}.date)
+        """.format(', '.join('{}total(i.{} * mi.quantity) / 100'.format(sign, x) for x in NUTRIENTS), row=row))
+
+    return (
+        """
+            CREATE TABLE IF NOT EXISTS nutrition_daily (
+                day TEXT PRIMARY KEY,
+                {}
+            )
+        """.format(',\n'.join('{} FLOAT DEFAULT 0 NOT NULL'.format(x) for x in NUTRIENTS)),
+        'CREATE TRIGGER IF NOT EXISTS nutrition_mi_ai AFTER INSERT ON meal_ingredients BEGIN {} END'.format(
+            meal_ingredient('new', '')),
+        'CREATE TRIGGER IF NOT EXISTS nutrition_mi_ad AFTER DELETE ON meal_ingredients BEGIN {} END'.format(
+            meal_ingredient('old', '-')),
+        'CREATE TRIGGER IF NOT EXISTS nutrition_mi_au AFTER UPDATE OF meal_id, ingredient_id, quantity ON meal_ingredients BEGIN {} {} END'.format(
+            meal_ingredient('old', '-'), meal_ingredient('new', '')),
+        'CREATE TRIGGER IF NOT EXISTS nutrition_i_au AFTER UPDATE OF {} ON ingredients BEGIN {} END'.format(
+            ', '.join(NUTRIENTS), ingredient('new', '(new.{0} - old.{0})')),
+        'CREATE TRIGGER IF NOT EXISTS nutrition_i_ad AFTER DELETE ON ingredients BEGIN {} END'.format(
+            ingredient('old', '-old.{0}')),
+        'CREATE TRIGGER IF NOT EXISTS nutrition_m_au AFTER UPDATE OF date ON meals BEGIN {} {} END'.format(
+            meal('old', '-'), meal('new', '')),
+        'CREATE TRIGGER IF NOT EXISTS nutrition_m_ad AFTER DELETE ON meals BEGIN {} END'.format(
+            meal('old', '-')),
+    ) + REBUILD_NUTRITION
+
+
+REBUILD_NUTRITION = (
+    'DELETE FROM nutrition_daily',
+    """
+        INSERT INTO nutrition_daily(day, {})
+        SELECT date(m.date), {}
+        FROM meal_ingredients mi
+        JOIN meals m ON m.id = mi.meal_id
+        JOIN ingredients i ON i.id = mi.ingredient_id
+        GROUP BY date(m.date)
+    """.format(', '.join(NUTRIENTS), ', '.join('total(i.{} * mi.quantity) / 100'.format(x) for x in NUTRIENTS)),
+)
+
+
+# schema migrations, MIGRATIONS[n] upgrades database from version n to n + 1,
+# migration is either tuple of ddl statements or function taking SQLStorage.
+# version is kept in PRAGMA user_version, append only - never edit released migrations
+MIGRATIONS = (
+    (
+        # initial schema, IF NOT EXISTS to adopt unversioned databases
+        """
+            CREATE TABLE IF NOT EXISTS ingredients (
+                id INTEGER PRIMARY KEY,
+                name TEXT,
+                calories FLOAT DEFAULT 0 NOT NULL,
+                fats FLOAT DEFAULT 0 NOT NULL,
+                sugar FLOAT DEFAULT 0 NOT NULL,
+                veg_protein FLOAT DEFAULT 0 NOT NULL,
+                protein FLOAT DEFAULT 0 NOT NULL,
+                carbo FLOAT DEFAULT 0 NOT NULL
+            )
+        """,
+        """
+            CREATE TABLE IF NOT EXISTS meals (
+                id INTEGER PRIMARY KEY,
+                date TEXT NOT NULL,
+                name TEXT
+            )
+        """,
+        """
+            CREATE TABLE IF NOT EXISTS meal_ingredients (
+                id INTEGER PRIMARY KEY,
+                ingredient_id INTEGER NOT NULL,
+                meal_id INTEGER NOT NULL,
+                quantity FLOAT NOT NULL,
+                FOREIGN KEY(meal_id) REFERENCES meal(id)
+                FOREIGN KEY(ingredient_id) REFERENCES ingredient(id)
+            )
+        """,
+    ),
+    ('CREATE INDEX IF NOT EXISTS idx_meal_ingredients_meal_id ON meal_ingredients(meal_id)',),
+    ('CREATE INDEX IF NOT EXISTS idx_meal_ingredients_ingredient_id ON meal_ingredients(ingredient_id)',),
+    ('CREATE INDEX IF NOT EXISTS idx_meals_date ON meals(date)',),
+    ('CREATE INDEX IF NOT EXISTS idx_ingredients_name ON ingredients(name)',),
+    _migrate_fts,
+    # daily nutrition rollup kept up to date by triggers
+    _nutrition_ddl(),
+)
+
+
+TABLES = ('ingredients', 'meals', 'meal_ingredients')
 
 
 class MealStorage():
 
-    def __init__(self, engine):
+    def __init__(self, engine, ingredient_cache_size=1024, ingredient_cache_ttl=None,
+                 batch_writes=False, batch_max_delay=0.002, batch_max_size=256, external_writes=False):
         self.sqlstorage = SQLStorage(engine)
+        self._fts = None
+
+        # group commit of concurrent writes, engine has to be usable from writer thread
+        self.write_queue = WriteQueue(self.sqlstorage, batch_max_delay, batch_max_size) if batch_writes else None
+
+        # ingredients by id, get_ingredient hands out copies - callers mutate them
+        self.ingredient_cache = LRUCache(ingredient_cache_size, ingredient_cache_ttl)
+
+        # per table change counters bumped after every committed write (etags),
+        # epoch tells counters of different storage instances (restarts) apart
+        self._versions = dict.fromkeys(TABLES, 0)
+        self._versions_lock = threading.Lock()
+        self._epoch = uuid4().hex[:8]
+        self.sqlstorage.write_listeners.append(self._bump)
+
+        # database written by other processes too (pre-fork workers) - their commits
+        # are noticed by engine's data_version (SQLite3PooledEngine), last seen per thread.
+        # SQLite3ReplicaEngine's changes once its replica has them
+        self.external_writes = external_writes
+        self._seen = threading.local()
 
 
     def clear(self):
         self.sqlstorage.execute_ddl((
             'DELETE FROM meal_ingredients',
             'DELETE FROM ingredients',
-            'DELETE FROM meals'))
+            'DELETE FROM meals',
+            'DELETE FROM nutrition_daily'))
+        self.ingredient_cache.invalidate()
+        self._bump(*TABLES)
 
 
     def delete(self):
         
         ddl = [
+            'DROP TABLE nutrition_daily',
+            'DROP TABLE ingredients_fts',
+            'DROP TABLE meals_fts',
             'DROP TABLE meal_ingredients',
             'DROP TABLE ingredients',
             'DROP TABLE meals'
@@ -33,116 +243,370 @@ class MealStorage():
             except:
                 pass
 
+        self.sqlstorage.pragma('user_version', 0)
+        self._fts = None
+        self.ingredient_cache.invalidate()
+        self._bump(*TABLES)
+
+
+    def close(self):
+        """commit queued writes and stop writer thread (batch_writes)"""
+        if self.write_queue is not None:
+            self.write_queue.close()
+
+
+    def _write(self, work):
+        """
+        run work() - directly or through write queue (batch_writes), 
+        writes in caller's own transaction can't be batched with others
+        """
+        if self.write_queue is None or self.sqlstorage.in_transaction():
+            return work()
+
+        return self.write_queue.submit(work)
+
+
+    def version(self):
+        """schema version of database (0 - empty/unversioned)"""
+        return self.sqlstorage.pragma('user_version')
+
 
     def init(self):
-        self.sqlstorage.execute_ddl((
-                """
-                    CREATE TABLE ingredients (
-                        id INTEGER PRIMARY KEY,
-                        name TEXT,
-                        calories FLOAT DEFAULT 0 NOT NULL,
-                        fats FLOAT DEFAULT 0 NOT NULL,
-                        sugar FLOAT DEFAULT 0 NOT NULL,
-                        veg_protein FLOAT DEFAULT 0 NOT NULL,
-                        protein FLOAT DEFAULT 0 NOT NULL,
-                        carbo FLOAT DEFAULT 0 NOT NULL
-                    )
-                """,
-                """
-                    CREATE TABLE meals (
-                        id INTEGER PRIMARY KEY,
-                        date TEXT NOT NULL,
-                        name TEXT
-                    )
-                """,
-                """
-                    CREATE TABLE meal_ingredients (
-                        id INTEGER PRIMARY KEY,
-                        ingredient_id INTEGER NOT NULL,
-                        meal_id INTEGER NOT NULL,
-                        quantity FLOAT NOT NULL,
-                        FOREIGN KEY(meal_id) REFERENCES meal(id)
-                        FOREIGN KEY(ingredient_id) REFERENCES ingredient(id)
-                    )
-                """))
+        """create schema or upgrade existing database to latest version"""
+        for version, ddl in enumerate(MIGRATIONS, 1):
+            with self.sqlstorage.transaction():
+                # checked inside transaction, other process could have migrated already
+                if self.version() >= version:
+                    continue
+
+                if callable(ddl):
+                    ddl(self.sqlstorage)
+                else:
+                    self.sqlstorage.execute_ddl(ddl)
+                self.sqlstorage.pragma('user_version', version)
+
+        self._fts = None
+
+
+    def _bump(self, *tables):
+        with self._versions_lock:
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+
+
+    def _sync(self):
+        """
+        with external_writes - anything could have changed if other process committed
+        (or thread sees database first time), bump all tables and drop cache
+        """
+        if not self.external_writes:
+            return
+
+        version = self.sqlstorage.engine.data_version()
+        if getattr(self._seen, 'version', None) != version:
+            self.ingredient_cache.invalidate()
+            self._bump(*TABLES + ('nutrition_daily',))
+            self._seen.version = version
+
+
+    def table_versions(self, *tables):
+        """change counters of tables, grow with every insert, update or delete"""
+        self._sync()
+        return tuple(self._versions.get(x, 0) for x in tables)
+
+
+    def etag(self, *tables):
+        """entity tag for data read from tables, changes when any of them is written"""
+        return '"{}-{}"'.format(self._epoch, '.'.join(str(x) for x in self.table_versions(*tables)))
+
+
+    def has_fts(self):
+        """true if database has full text search tables"""
+        if self._fts is None:
+            names = tuple('{}_fts'.format(x) for x in FTS_TABLES)
+            found = self.sqlstorage.select('sqlite_master', ('name',), where(eq('type', 'table')))
+            self._fts = set(names).issubset(x['name'] for x in found)
+
+        return self._fts
 
 
     def add_ingredient(self, ingredient):
-        id_ = self.sqlstorage.insert('ingredients', ingredient.dump(ignore=('id',)))
-        ingredient.id = id_
+        id_ = self._write(partial(self.sqlstorage.insert, 'ingredients', ingredient.dump(ignore=('id',))))
+        self._assign(ingredient, id=id_)
         return ingredient
 
 
     def update_ingredient(self, ingredient):
-        self.sqlstorage.update('ingredients', ingredient.dump(ignore=('id',)), where(eq('id', ingredient.id)))
+        self._write(partial(self.sqlstorage.update, 
+                'ingredients', ingredient.dump(ignore=('id',)), where(eq('id', ingredient.id))))
+        self._invalidate_ingredients((), dict(id=ingredient.id))
         return ingredient
 
 
     def add_ingredients(self, ingredients):
-        return [self.add_ingredient(x) for x in ingredients if not hasattr(x,'id')]
+        new = [x for x in ingredients if not hasattr(x,'id')]
+        ids = self._write(partial(self.sqlstorage.insert_many, 'ingredients', [x.dump(ignore=('id',)) for x in new]))
+
+        for ingredient, id_ in zip(new, ids):
+            self._assign(ingredient, id=id_)
+
+        return new
+
+
+    def _assign(self, obj, **attrs):
+        """set attributes of obj (generated ids), restored if transaction they come from rolls back"""
+        old = dict((k, getattr(obj, k)) for k in attrs if hasattr(obj, k))
+
+        def undo():
+            for k in attrs:
+                if k in old:
+                    setattr(obj, k, old[k])
+                elif hasattr(obj, k):
+                    delattr(obj, k)
+
+        self.sqlstorage.on_rollback(undo)
+        for k, v in attrs.items():
+            setattr(obj, k, v)
+
+
+    def _invalidate_ingredients(self, conds, kwds):
+        """
+        after write - now for reads of writer's own transaction and once more after commit,
+        readers of old rows that started before it won't cache them (see LRUCache.generation)
+        """
+        self._invalidate_cached(conds, kwds)
+        if self.sqlstorage.in_transaction():
+            self.sqlstorage.after_transaction(partial(self._invalidate_cached, conds, kwds))
+
+
+    def _invalidate_cached(self, conds, kwds):
+        try:
+            if conds or list(kwds) != ['id']:
+                raise ValueError()
+            self.ingredient_cache.invalidate(int(kwds['id']))
+        except (TypeError, ValueError):
+            # can't tell which rows are affected
+            self.ingredient_cache.invalidate()
 
 
     def delete_ingredient(self, *conds, **kwds):
-        conds = where(*conds, *tuple(eq(k, v) for k, v in kwds.items()))
-        return self.sqlstorage.delete('ingredients', conds)
+        ret = self._write(partial(self.sqlstorage.delete, 
+                'ingredients', where(*conds, *tuple(eq(k, v) for k, v in kwds.items()))))
+        self._invalidate_ingredients(conds, kwds)
+        return ret
 
 
     def get_ingredients(self, *conds, **kwds):
         conds = where(*conds, *tuple(eq(k, v) for k, v in kwds.items()))
-        dics = self.sqlstorage.select('ingredients', Ingredient.columns(), conds)
-        return [Ingredient.load(dic) for dic in dics]
+        rows = self.sqlstorage.select_rows('ingredients', Ingredient.columns(), conds)
+        return Ingredient.from_rows(Ingredient.columns(), rows)
 
 
     def get_ingredient(self, id):
-        return first(self.get_ingredients(eq('id', id)))
+        try:
+            id = int(id)
+        except (TypeError, ValueError):
+            return None
+
+        self._sync()
+        ret = self.ingredient_cache.get(id)
+        if ret is None:
+            generation = self.ingredient_cache.generation()
+            ret = first(self.get_ingredients(eq('id', id), limit(1)))
+            if ret is None:
+                return None
+            self.ingredient_cache.put(id, copy(ret), generation)
+
+        return copy(ret)
 
 
     def add_meal(self, meal):
-        id_ = self.sqlstorage.insert('meals', meal.dump(ignore=('id', 'meal_ingredients')))
-        meal.id = id_
+        """add meal with its meal ingredients (and new ingredients) in one transaction"""
+        return self._write(partial(self._add_meal, meal))
 
-        for mi in meal.meal_ingredients:
-            mi.meal_id = meal.id
-            self.add_meal_ingredient(mi)
+
+    def _add_meal(self, meal):
+        with self.sqlstorage.transaction():
+            id_ = self.sqlstorage.insert('meals', meal.dump(ignore=('id', 'meal_ingredients')))
+            self._assign(meal, id=id_)
+
+            for mi in meal.meal_ingredients:
+                self._assign(mi, meal_id=meal.id)
+            self.add_meal_ingredients(meal.meal_ingredients)
 
         return meal
 
 
     def delete_meal(self, *conds, **kwds):
         conds = where(*conds, *tuple(eq(k, v) for k, v in kwds.items()))
-        return self.sqlstorage.delete('meals', conds)
+        return self._write(partial(self.sqlstorage.delete, 'meals', conds))
 
 
     def get_meals(self, *conds, **kwds):
         conds = where(*conds, *tuple(eq(k, v) for k, v in kwds.items()))
-        dics = self.sqlstorage.select('meals', Meal.columns(), conds)
-        return [Meal.load(dic) for dic in dics]
+        rows = self.sqlstorage.select_rows('meals', Meal.columns(), conds)
+        return Meal.from_rows(Meal.columns(), rows)
 
 
     def get_meal(self, id):
-        return first(self.get_meals(eq('id', id)))
+        return first(self.get_meals(eq('id', id), limit(1)))
 
 
     def add_meal_ingredient(self, meal_ingredient):
+        return self._write(partial(self._add_meal_ingredient, meal_ingredient))
+
+
+    def _add_meal_ingredient(self, meal_ingredient):
         ing = meal_ingredient.ingredient
 
         if ing is not None:
             if not hasattr(ing, 'id'):
                 ing = self.add_ingredient(ing)
-            meal_ingredient.ingredient_id = ing.id
+            self._assign(meal_ingredient, ingredient_id=ing.id)
 
         id_ = self.sqlstorage.insert('meal_ingredients', meal_ingredient.dump(ignore=('id', 'ingredient')))
-        meal_ingredient.id = id_
+        self._assign(meal_ingredient, id=id_)
 
         return meal_ingredient
 
 
+    def add_meal_ingredients(self, meal_ingredients):
+        return self._write(partial(self._add_meal_ingredients, meal_ingredients))
+
+
+    def _add_meal_ingredients(self, meal_ingredients):
+        # same new ingredient may be used by more than one meal ingredient
+        new = dict((id(mi.ingredient), mi.ingredient) for mi in meal_ingredients
+                if mi.ingredient is not None and not hasattr(mi.ingredient, 'id'))
+
+        with self.sqlstorage.transaction():
+            self.add_ingredients(list(new.values()))
+
+            for mi in meal_ingredients:
+                if mi.ingredient is not None:
+                    self._assign(mi, ingredient_id=mi.ingredient.id)
+
+            ids = self.sqlstorage.insert_many('meal_ingredients',
+                    [mi.dump(ignore=('id', 'ingredient')) for mi in meal_ingredients])
+
+            for mi, id_ in zip(meal_ingredients, ids):
+                self._assign(mi, id=id_)
+
+        return meal_ingredients
+
+
     def delete_meal_ingredient(self, *conds, **kwds):
         conds = where(*conds, *tuple(eq(k, v) for k, v in kwds.items()))
-        return self.sqlstorage.delete('meal_ingredients', conds)
+        return self._write(partial(self.sqlstorage.delete, 'meal_ingredients', conds))
 
 
     def get_meal_ingredients(self, *conds, **kwds):
         conds = where(*conds, *tuple(eq(k, v) for k, v in kwds.items()))
-        dics = self.sqlstorage.select('meal_ingredients', MealIngredient.columns(), conds)
-        return [MealIngredient.load(dic) for dic in dics]
+        rows = self.sqlstorage.select_rows('meal_ingredients', MealIngredient.columns(), conds)
+        return MealIngredient.from_rows(MealIngredient.columns(), rows)
+
+
+    def get_meal_ingredients_with_ingredient(self, *conds, **kwds):
+        """
+        get meal ingredients with nested ingredient loaded in the same (joined) query,
+        conditions refer to meal_ingredients columns
+        """
+        conds = where(*conds, *tuple(eq(k, v) for k, v in kwds.items()))
+        conds = prefixed('mi.', conds)
+
+        columns = tuple('mi.{0} AS {0}'.format(x) for x in MealIngredient.columns()) + \
+                  tuple('i.{0} AS ingredient__{0}'.format(x) for x in Ingredient.columns())
+
+        dics = self.sqlstorage.select(
+                'meal_ingredients mi LEFT JOIN ingredients i ON i.id = mi.ingredient_id', 
+                columns, conds)
+
+        for dic in dics:
+            ingredient = dict((k[len('ingredient__'):], dic.pop(k)) for k in list(dic) if k.startswith('ingredient__'))
+            if ingredient['id'] is not None:
+                dic['ingredient'] = ingredient
+
+        return MealIngredient.load_many(dics, trusted=True)
+
+
+    def _search(self, table, columns, *conds, **kwds):
+        """
+        select rows (tuples in order of columns) with all kwds values being substrings of columns,
+        name is searched with full text index (prefix match, by relevance) if available
+        """
+        kwds = dict((k, v) for k, v in kwds.items() if k in columns)
+        name = kwds.pop('name', None) if self.has_fts() else None
+        query = fts_query(name) if name is not None else ''
+
+        conds = where(*conds, *tuple(like(k, '%'+v+'%') for (k, v) in kwds.items()))
+        if not query:
+            if name is not None:
+                conds = where(*conds, like('name', '%'+name+'%'))
+            return self.sqlstorage.select_rows(table, columns, conds)
+
+        fts = '{}_fts'.format(table)
+        conds = where(match(fts, query), *prefixed('t.', conds))
+        if not any(isinstance(c, ordering) for c in conds):
+            # by relevance unless caller orders (e.g. paginates by id)
+            conds = where(*conds, order_by('{}.rank'.format(fts)))
+
+        return self.sqlstorage.select_rows(
+                '{0} JOIN {1} t ON t.id = {0}.rowid'.format(fts, table),
+                tuple('t.{0} AS {0}'.format(x) for x in columns),
+                conds)
+
+
+    def search_ingredients(self, *conds, **kwds):
+        rows = self._search('ingredients', Ingredient.columns(), *conds, **kwds)
+        return Ingredient.from_rows(Ingredient.columns(), rows)
+
+
+    def search_meals(self, *conds, **kwds):
+        rows = self._search('meals', Meal.columns(), *conds, **kwds)
+        return Meal.from_rows(Meal.columns(), rows)
+
+
+    def page(self, get, count, after=None, *conds, **kwds):
+        """
+        keyset pagination - up to count objects returned by get (e.g. get_meals) 
+        with id greater than after, ordered by id. 
+        returns (objects, id to pass as after for next page or None if last page)
+        """
+        if after is not None:
+            conds = where(gt('id', after), *conds)
+
+        objs = get(*conds, order_by('id'), limit(count + 1), **kwds)
+        if len(objs) > count:
+            return objs[:count], objs[count - 1].id
+
+        return objs, None
+
+
+    def iter_pages(self, get, count, *conds, **kwds):
+        """generate pages (lists of at most count objects) of get until exhausted"""
+        after = None
+        while True:
+            objs, after = self.page(get, count, after, *conds, **kwds)
+            if objs:
+                yield objs
+            if after is None:
+                return
+
+
+    def rebuild_nutrition(self):
+        """recompute nutrition_daily rollup from meals (e.g. after manual changes)"""
+        with self.sqlstorage.transaction():
+            self.sqlstorage.execute_ddl(REBUILD_NUTRITION)
+        self._bump('nutrition_daily')
+
+
+    def get_nutrition(self, start, end, bucket='day'):
+        """
+        nutrients eaten per bucket (day, week or month) of days between start and end 
+        (inclusive, 'YYYY-MM-DD'), read from daily rollup
+        """
+        columns = ('{} AS {}'.format(NUTRITION_BUCKETS[bucket], bucket),) + \
+                  tuple('total({0}) AS {0}'.format(x) for x in NUTRIENTS)
+
+        return self.sqlstorage.select('nutrition_daily', columns, 
+                where(between('day', start, end), group_by(bucket), order_by(bucket)))
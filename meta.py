@@ -1,5 +1,8 @@
 import json
+import threading
+from collections.abc import Mapping
 from datetime import datetime
+from functools import partial
 import marshmallow
 
 __all__ = ['JsonObject', 'fields', 'post_load']
@@ -39,6 +42,167 @@ class MarshallError(Exception):
         return "{}(errors={})".format(self.__class__.__name__, self.errors)
 
 
+class _Unsupported(Exception):
+    """field can't be handled by generated (de)serializers"""
+
+
+def _plain(field):
+    # options changing attribute/key names, validation or output are left to marshmallow
+    return not (field.attribute or field.load_from or field.dump_to or field.validators 
+            or field.required or field.load_only or field.dump_only or getattr(field, 'as_string', False))
+
+
+def _dump_expr(field, var, env):
+    """expression serializing non-None value held in var"""
+    n = len(env)
+    if not _plain(field):
+        raise _Unsupported(field)
+
+    if type(field) is marshmallow.fields.Integer:
+        return 'int({})'.format(var)
+    if type(field) is marshmallow.fields.Float:
+        return 'float({})'.format(var)
+    if type(field) is marshmallow.fields.String:
+        return 'str({})'.format(var)
+    if type(field) is marshmallow.fields.DateTime and field.dateformat and '%' in field.dateformat:
+        env['_fmt{}'.format(n)] = field.dateformat
+        return '{}.strftime(_fmt{})'.format(var, n)
+    if isinstance(field, marshmallow.fields.Nested) and getattr(field.nested, '_fast_dump', None):
+        env['_dump{}'.format(n)] = field.nested._fast_dump
+        if field.many:
+            return '[_dump{0}(x) for x in {1}]'.format(n, var)
+        return '_dump{}({})'.format(n, var)
+    if type(field) is marshmallow.fields.List:
+        item = _dump_expr(field.container, 'x', env)
+        return '[None if x is None else {} for x in {}]'.format(item, var)
+
+    raise _Unsupported(field)
+
+
+def _load_expr(field, var, env):
+    """expression deserializing non-None value held in var, raises on invalid value"""
+    n = len(env)
+    if not _plain(field):
+        raise _Unsupported(field)
+
+    if type(field) is marshmallow.fields.Integer:
+        return 'int({})'.format(var)
+    if type(field) is marshmallow.fields.Float:
+        return 'float({})'.format(var)
+    if type(field) is marshmallow.fields.String:
+        return '_str({})'.format(var)
+    if type(field) is marshmallow.fields.DateTime and field.dateformat and '%' in field.dateformat:
+        env['_fmt{}'.format(n)] = field.dateformat
+        return '_strptime({}, _fmt{})'.format(var, n)
+    if isinstance(field, marshmallow.fields.Nested) and getattr(field.nested, '_fast_load', None):
+        env['_load{}'.format(n)] = field.nested._fast_load
+        if field.many:
+            return '[_load{0}(x) for x in _list({1})]'.format(n, var)
+        return '_load{}({})'.format(n, var)
+    if type(field) is marshmallow.fields.List:
+        item = _load_expr(field.container, 'x', env)
+        return '[{} for x in _list({})]'.format(item, var)
+
+    raise _Unsupported(field)
+
+
+def _str(value):
+    if not isinstance(value, str):
+        raise TypeError(value)
+    return value
+
+
+def _list(value):
+    if not isinstance(value, list):
+        raise TypeError(value)
+    return value
+
+
+def _getter(obj):
+    if isinstance(obj, Mapping):
+        return obj.get
+    return partial(getattr, obj)
+
+
+def _compile(name, schema_fields, cls):
+    """
+    generate source of specialized dump/load functions for schema fields
+    (same output as marshmallow for valid data), 
+    return (None, None) if some field is not supported
+    """
+    env = dict(_missing=marshmallow.missing, _getter=_getter, _str=_str, _list=_list,
+               _strptime=datetime.strptime, _cls=cls)
+
+    dump = ['def dump(obj):', '    get = _getter(obj)', '    ret = {}']
+    load = ['def load(data):', '    get = data.get', '    ret = {}']
+
+    try:
+        for key, field in schema_fields:
+            dump.append('    v = get({!r}, _missing)'.format(key))
+            dump.append('    if v is not _missing:')
+            dump.append('        ret[{!r}] = None if v is None else {}'.format(key, _dump_expr(field, 'v', env)))
+            if field.default is not marshmallow.missing:
+                env['_default{}'.format(len(env))] = field.default
+                dump.append('    else:')
+                dump.append('        ret[{!r}] = _default{}{}'.format(key, len(env) - 1, '()' if callable(field.default) else ''))
+
+            load.append('    v = get({!r}, _missing)'.format(key))
+            load.append('    if v is None:')
+            load.append('        ret[{!r}] = None'.format(key) if field.allow_none else '        raise ValueError({!r})'.format(key))
+            load.append('    elif v is not _missing:')
+            load.append('        ret[{!r}] = {}'.format(key, _load_expr(field, 'v', env)))
+            if field.missing is not marshmallow.missing:
+                env['_default{}'.format(len(env))] = field.missing
+                load.append('    else:')
+                load.append('        ret[{!r}] = _default{}{}'.format(key, len(env) - 1, '()' if callable(field.missing) else ''))
+    except _Unsupported:
+        return None, None
+
+    dump.append('    return ret')
+    load.append('    return _cls(**ret)')
+
+    exec(compile('\n'.join(dump + [''] + load), '<{} serializers>'.format(name), 'exec'), env)
+    return env['dump'], env['load']
+
+
+def _compile_row(name, schema_fields, columns, cls):
+    """
+    generate loader of database row (tuple of values in order of columns), 
+    return None if some field is not supported
+    """
+    env = dict(_new=object.__new__, _cls=cls, _str=_str, _list=_list, _strptime=datetime.strptime)
+    fields = dict(schema_fields)
+    src = ['def load(row):', '    obj = _new(_cls)']
+
+    try:
+        # same defaults as __init__ for fields not in row
+        for key, field in schema_fields:
+            if key not in columns and field.missing is not marshmallow.missing:
+                env['_default{}'.format(len(env))] = field.missing
+                src.append('    obj.{} = _default{}{}'.format(key, len(env) - 1, '()' if callable(field.missing) else ''))
+
+        for i, key in enumerate(columns):
+            field = fields[key]
+            src.append('    v = row[{}]'.format(i))
+            if field.allow_none:
+                src.append('    obj.{} = None if v is None else {}'.format(key, _load_expr(field, 'v', env)))
+            else:
+                # None fails conversion, as it fails marshmallow validation
+                src.append('    obj.{} = {}'.format(key, _load_expr(field, 'v', env)))
+    except (_Unsupported, KeyError):
+        return None
+
+    src.append('    return obj')
+
+    exec(compile('\n'.join(src), '<{} row loader>'.format(name), 'exec'), env)
+    return env['load']
+
+
+def attrs(obj):
+    """dict of fields set on JsonObject (instances have __slots__, no vars())"""
+    return dict((k, getattr(obj, k)) for k in type(obj).fields() if hasattr(obj, k))
+
+
 class Meta(type):
     def __new__(mcs, name, bases, namespace, **kwargs):
         _fix_for_marshmallow_datetime_serialization(namespace)
@@ -46,16 +210,16 @@ class Meta(type):
         namespace = dict([(k,v) for (k,v) in namespace.items() if not isinstance(v, marshmallow.fields.Field)])
 
         defaults = [(k,v) for (k,v) in schema_fields if v.missing is not marshmallow.missing]
+        valid_keys = frozenset(k for (k,v) in schema_fields)
+
+        # instances keep only schema fields, no __dict__
+        namespace.setdefault('__slots__', tuple(k for (k,v) in schema_fields))
 
         new_cls = super(Meta, mcs).__new__(mcs, name, bases, namespace, **kwargs)
 
         def __init__(self, **data):
-            keys = set(data.keys())
-            valid_keys = set([k for (k,v) in schema_fields])
-
-            diff = keys.difference(valid_keys)
-            if diff:
-                raise InvalidFieldsError('Unknown fields: {}', list(diff))
+            if not valid_keys.issuperset(data):
+                raise InvalidFieldsError('Unknown fields: {}', list(set(data).difference(valid_keys)))
 
             for default in defaults:
                 setattr(self, default[0], default[1].missing)
@@ -80,10 +244,27 @@ class Meta(type):
             return [k for (k,v) in schema_fields]
 
 
+        # generated serializers for trusted data, in order of marshmallow output
+        _fast_dump, _fast_load = _compile(name, list(_Schema().fields.items()), new_cls)
+        _Schema._fast_dump, _Schema._fast_load = _fast_dump, _fast_load
+
+
+        # schema instances are reused, but marshmallow schema mutates its fields 
+        # while dumping so every (cherrypy) thread gets its own instance
+        _local = threading.local()
+
+        def _schema():
+            schema = getattr(_local, 'schema', None)
+            if schema is None:
+                schema = _local.schema = _Schema()
+            return schema
+
 
+        def loads(data, trusted=False):
+            if trusted:
+                return load(json.loads(data), trusted)
 
-        def loads(data):
-            obj, err = _Schema().loads(data)
+            obj, err = _schema().loads(data)
             if err: 
                 raise MarshallError(err, result=obj)
 
@@ -91,22 +272,39 @@ class Meta(type):
         
 
         # since we will be *only* marshalling/unmarshalling objects
-        # assume input is a dict. if instead it's a string assume dict in text (json)
-        def load(data):
+        # assume input is a dict. if instead it's a string assume dict in text (json).
+        # trusted data (e.g. rows from database) skips marshmallow validation, 
+        # anything generated code can't handle goes through marshmallow anyway
+        def load(data, trusted=False):
             if isinstance(data, str):
-                return loads(data)
+                return loads(data, trusted)
 
-            obj, err = _Schema().load(data)
+            if trusted and _fast_load is not None:
+                try:
+                    return _fast_load(data)
+                except Exception:
+                    pass
+
+            obj, err = _schema().load(data)
             if err: 
                 raise MarshallError(err, result=obj)
             return obj
 
 
-        def dump(self, ignore=None):
-            ret, err = _Schema().dump(self)
+        def load_many(datas, trusted=False):
+            if trusted and _fast_load is not None:
+                try:
+                    return [_fast_load(x) for x in datas]
+                except Exception:
+                    pass
+
+            objs, err = _schema().load(datas, many=True)
             if err: 
-                raise MarshallError(err, result=ret)
+                raise MarshallError(err, result=objs)
+            return objs
+
 
+        def _ignore(ret, ignore):
             if ignore is not None:
                 for key in ignore:
                     if key in ret: 
@@ -115,8 +313,57 @@ class Meta(type):
             return ret
 
 
-        def dumps(self):
-            ret, err = _Schema().dumps(self)
+        _row_loaders = {}
+
+        def from_rows(columns, rows):
+            """objects from database rows - tuples of values in order of columns"""
+            columns = tuple(columns)
+            if columns not in _row_loaders:
+                _row_loaders[columns] = _compile_row(name, schema_fields, columns, new_cls)
+
+            loader = _row_loaders[columns]
+            if loader is not None:
+                try:
+                    return [loader(x) for x in rows]
+                except Exception:
+                    pass
+
+            return load_many([dict(zip(columns, x)) for x in rows], trusted=True)
+
+
+        def dump(self, ignore=None, trusted=False):
+            if trusted and _fast_dump is not None:
+                try:
+                    return _ignore(_fast_dump(self), ignore)
+                except Exception:
+                    pass
+
+            ret, err = _schema().dump(self)
+            if err: 
+                raise MarshallError(err, result=ret)
+
+            return _ignore(ret, ignore)
+
+
+        def dump_many(objs, ignore=None, trusted=False):
+            if trusted and _fast_dump is not None:
+                try:
+                    return [_ignore(_fast_dump(x), ignore) for x in objs]
+                except Exception:
+                    pass
+
+            ret, err = _schema().dump(objs, many=True)
+            if err: 
+                raise MarshallError(err, result=ret)
+
+            return [_ignore(x, ignore) for x in ret]
+
+
+        def dumps(self, trusted=False):
+            if trusted:
+                return json.dumps(dump(self, trusted=trusted))
+
+            ret, err = _schema().dumps(self)
             if err: 
                 raise MarshallError(err, result=ret)
             return ret
@@ -124,7 +371,10 @@ class Meta(type):
 
         setattr(new_cls, 'load', load)
         setattr(new_cls, 'loads', load)
+        setattr(new_cls, 'load_many', load_many)
+        setattr(new_cls, 'from_rows', from_rows)
         setattr(new_cls, 'dump', dump)
+        setattr(new_cls, 'dump_many', dump_many)
         setattr(new_cls, 'dumps', dumps)
         setattr(new_cls, 'fields', _fields)
 
@@ -136,7 +386,7 @@ class Meta(type):
 class JsonObject(metaclass=Meta):
 
     def __repr__(self):
-        return "{}{}".format(self.__class__.__name__, vars(self))
+        return "{}{}".format(self.__class__.__name__, attrs(self))
 
 
 class Fields():
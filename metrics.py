@@ -0,0 +1,226 @@
+"""
+sql statement and http request metrics, exposed in prometheus text format
+"""
+
+import re
+import time
+import bisect
+import logging
+import threading
+from functools import lru_cache
+
+# seconds, upper bounds of histogram buckets (+Inf is implicit)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+slow_log = logging.getLogger('eatwatch.sql.slow')
+
+
+class Histogram(object):
+    """cumulative (prometheus) histogram, not thread safe - owner locks"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+    def lines(self, name, labels):
+        ret, total = [], 0
+        for le, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            ret.append('{}_bucket{} {}'.format(name, _labels(labels + (('le', le),)), total))
+
+        ret.append('{}_sum{} {}'.format(name, _labels(labels), self.sum))
+        ret.append('{}_count{} {}'.format(name, _labels(labels), self.count))
+        return ret
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, _escape(v)) for k, v in labels) + '}'
+
+
+def _header(name, kind, help_):
+    return ['# HELP {} {}'.format(name, help_), '# TYPE {} {}'.format(name, kind)]
+
+
+_IN_LIST = re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)', re.IGNORECASE)
+
+
+@lru_cache(maxsize=1024)
+def statement_shape(sql):
+    """
+    sql without string literals and extra whitespace - values are bound (?) 
+    by sql_storage, statements differing only in literals or in number of
+    IN (...) values are one shape
+    """
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = _IN_LIST.sub('IN (?...)', sql)
+    return ' '.join(sql.split())
+
+
+def redact(bind):
+    """bind parameters safe to log - only their types"""
+    return tuple(type(x).__name__ for x in bind)
+
+
+class _StatementStats(object):
+    __slots__ = ('count', 'errors', 'total', 'max', 'rows', 'histogram')
+
+    def __init__(self, buckets):
+        self.count = self.errors = self.rows = 0
+        self.total = self.max = 0.0
+        self.histogram = Histogram(buckets)
+
+
+class SQLMetrics(object):
+    """
+    per statement shape count, errors, total/max time, rows and latency histogram,
+    statements slower than slow_query_time (seconds) are logged to eatwatch.sql.slow
+    with bind parameters passed through redact (None logs them as they are)
+    """
+
+    def __init__(self, slow_query_time=None, redact=redact, buckets=DEFAULT_BUCKETS, clock=time.perf_counter):
+        self.slow_query_time = slow_query_time
+        self.redact = redact
+        self.buckets = buckets
+        self.clock = clock
+        self._stats = {}
+        self._lock = threading.Lock()
+
+
+    def observe(self, sql, bind, work):
+        """run work() returning (result, rows), record its time, return result"""
+        start = self.clock()
+        try:
+            ret, rows = work()
+        except Exception:
+            self.record(sql, bind, self.clock() - start, 0, error=True)
+            raise
+
+        self.record(sql, bind, self.clock() - start, rows)
+        return ret
+
+
+    def record(self, sql, bind, elapsed, rows, error=False):
+        shape = statement_shape(sql)
+        with self._lock:
+            stats = self._stats.get(shape)
+            if stats is None:
+                stats = self._stats[shape] = _StatementStats(self.buckets)
+
+            stats.count += 1
+            stats.errors += error
+            stats.total += elapsed
+            stats.max = max(stats.max, elapsed)
+            stats.rows += rows
+            stats.histogram.observe(elapsed)
+
+        if self.slow_query_time is not None and elapsed >= self.slow_query_time:
+            slow_log.warning('%.1f ms: %s bind: %r', elapsed * 1000, shape,
+                    self.redact(bind) if self.redact is not None else tuple(bind))
+
+
+    def stats(self):
+        """{shape: dict(count, errors, total, max, rows)}"""
+        with self._lock:
+            return dict((shape, dict(count=x.count, errors=x.errors, total=x.total, max=x.max, rows=x.rows))
+                    for shape, x in self._stats.items())
+
+
+    def clear(self):
+        with self._lock:
+            self._stats.clear()
+
+
+    def lines(self):
+        with self._lock:
+            items = sorted(self._stats.items())
+            ret = []
+            for name, kind, help_, attr in (
+                    ('eatwatch_sql_statements_total', 'counter', 'Executed statements.', 'count'),
+                    ('eatwatch_sql_errors_total', 'counter', 'Failed statements.', 'errors'),
+                    ('eatwatch_sql_seconds_total', 'counter', 'Time spent executing statements.', 'total'),
+                    ('eatwatch_sql_seconds_max', 'gauge', 'Slowest execution of statement.', 'max'),
+                    ('eatwatch_sql_rows_total', 'counter', 'Rows returned or changed by statements.', 'rows')):
+                ret += _header(name, kind, help_)
+                ret += ['{}{} {}'.format(name, _labels((('statement', shape),)), getattr(x, attr)) for shape, x in items]
+
+            ret += _header('eatwatch_sql_duration_seconds', 'histogram', 'Statement latency.')
+            for shape, x in items:
+                ret += x.histogram.lines('eatwatch_sql_duration_seconds', (('statement', shape),))
+
+        return ret
+
+
+class RequestMetrics(object):
+    """per route (handler) and method latency histogram, responses by status"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, clock=time.perf_counter):
+        self.buckets = buckets
+        self.clock = clock
+        self._latency = {}
+        self._statuses = {}
+        self._lock = threading.Lock()
+
+
+    def record(self, route, method, status, elapsed):
+        with self._lock:
+            histogram = self._latency.get((route, method))
+            if histogram is None:
+                histogram = self._latency[(route, method)] = Histogram(self.buckets)
+            histogram.observe(elapsed)
+
+            key = (route, method, status)
+            self._statuses[key] = self._statuses.get(key, 0) + 1
+
+
+    def clear(self):
+        with self._lock:
+            self._latency.clear()
+            self._statuses.clear()
+
+
+    def lines(self):
+        with self._lock:
+            ret = _header('eatwatch_http_requests_total', 'counter', 'Handled requests.')
+            ret += ['eatwatch_http_requests_total{} {}'.format(
+                    _labels((('route', r), ('method', m), ('status', s))), count)
+                    for (r, m, s), count in sorted(self._statuses.items())]
+
+            ret += _header('eatwatch_http_request_duration_seconds', 'histogram', 'Request latency.')
+            for (r, m), histogram in sorted(self._latency.items()):
+                ret += histogram.lines('eatwatch_http_request_duration_seconds', (('route', r), ('method', m)))
+
+        return ret
+
+
+def route_name(request):
+    """route of cherrypy request - name of handler routes dispatched it to"""
+    return getattr(getattr(request.handler, 'callable', None), '__name__', 'unmatched')
+
+
+# process wide metrics, engines are instrumented in routeconfig.init if sql.instrument config is on
+SQL_METRICS = SQLMetrics()
+REQUEST_METRICS = RequestMetrics()
+
+
+def exposition(*metrics):
+    """prometheus text format of metrics (default SQL_METRICS and REQUEST_METRICS)"""
+    lines = []
+    for x in metrics or (SQL_METRICS, REQUEST_METRICS):
+        lines += x.lines()
+
+    return '\n'.join(lines) + '\n'
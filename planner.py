@@ -0,0 +1,133 @@
+"""
+meal planning - quantities of ingredients hitting nutrient targets,
+solved with numpy over matrix of nutrients of whole catalog.
+numpy is optional - without it planner.np is None and planning is unavailable
+"""
+
+import threading
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from conditions import where, order_by
+
+PLAN_NUTRIENTS = ('calories', 'protein', 'carbo', 'fats')
+
+
+class NutrientMatrix(object):
+    """
+    nutrients of all ingredients as matrix (nutrients x ingredients, per gram)
+    with sorted array of ingredient ids, loaded once and reloaded after
+    ingredients are written (MealStorage.table_versions)
+    """
+
+    def __init__(self, storage, nutrients=PLAN_NUTRIENTS):
+        if np is None:
+            raise RuntimeError('meal planning needs numpy')
+
+        self.storage = storage
+        self.nutrients = tuple(nutrients)
+        self.loads = 0
+        self._cached = None
+        self._lock = threading.Lock()
+
+
+    def get(self):
+        """(ids, matrix) of current catalog"""
+        version = self.storage.table_versions('ingredients')
+        cached = self._cached
+        if cached is not None and cached[0] == version:
+            return cached[1:]
+
+        with self._lock:
+            if self._cached is not None and self._cached[0] == version:
+                return self._cached[1:]
+
+            # version read before rows, write in between only causes another reload
+            rows = self.storage.sqlstorage.select_rows(
+                    'ingredients', ('id',) + self.nutrients, where(order_by('id')))
+            data = np.array(rows, dtype=np.float64).reshape(len(rows), len(self.nutrients) + 1)
+
+            ids = data[:, 0].astype(np.int64)
+            matrix = np.ascontiguousarray(data[:, 1:].T) / 100
+            self._cached = (version, ids, matrix)
+            self.loads += 1
+
+            return ids, matrix
+
+
+def solve(matrix, targets, upper, iterations=2000, tol=1e-7):
+    """
+    bounded least squares - x with 0 <= x <= upper minimizing relative error
+    of matrix @ x against targets. accelerated projected gradient (fista),
+    every step is a couple of matrix-vector products over all columns
+    """
+    scale = 1 / np.maximum(np.abs(targets), 1)
+    a = matrix * scale[:, None]
+    b = targets * scale
+
+    # solve for x * norm of column - better conditioned, bounds stay a box
+    norms = np.linalg.norm(a, axis=0)
+    norms[norms == 0] = 1
+    a = a / norms
+    upper = upper * norms
+
+    lipschitz = np.linalg.norm(a @ a.T, 2)
+    x = np.zeros(a.shape[1])
+    if lipschitz == 0:
+        return x
+
+    y, t = x, 1.0
+    for _ in range(iterations):
+        new = np.clip(y - a.T @ (a @ y - b) / lipschitz, 0, upper)
+        new_t = (1 + (1 + 4 * t * t) ** 0.5) / 2
+        y = new + (t - 1) / new_t * (new - x)
+
+        done = np.max(np.abs(new - x)) < tol
+        x, t = new, new_t
+        if done:
+            break
+
+    return x / norms
+
+
+def plan(nutrient_matrix, targets, ingredient_ids=None, max_quantity=500.0, size=5):
+    """
+    [(ingredient id, grams)] and totals {nutrient: value} hitting targets {nutrient: value}
+    as close as possible, using ingredient_ids or (if None) best size ingredients of catalog
+    """
+    ids, matrix = nutrient_matrix.get()
+    rows = [nutrient_matrix.nutrients.index(x) for x in targets]
+    goal = np.array([float(targets[x]) for x in targets])
+
+    if ingredient_ids is None:
+        columns = np.arange(len(ids))
+    else:
+        wanted = np.array(sorted(set(ingredient_ids)), dtype=np.int64)
+        if not len(ids) and len(wanted):
+            # empty catalog
+            raise KeyError(', '.join(str(x) for x in wanted))
+        columns = np.searchsorted(ids, wanted)
+        found = (columns < len(ids)) & (ids[np.minimum(columns, len(ids) - 1)] == wanted)
+        if not found.all():
+            raise KeyError(', '.join(str(x) for x in wanted[~found]))
+
+    if not len(columns):
+        return [], dict((x, 0.0) for x in nutrient_matrix.nutrients)
+
+    quantities = solve(matrix[rows][:, columns], goal, max_quantity)
+
+    if ingredient_ids is None and len(columns) > size:
+        # catalog wide solution is spread thin, solve again for its main ingredients
+        columns = columns[np.argsort(-quantities, kind='stable')[:size]]
+        quantities = solve(matrix[rows][:, columns], goal, max_quantity)
+
+    quantities = np.round(quantities, 1)
+    keep = quantities > 0
+    columns, quantities = columns[keep], quantities[keep]
+
+    totals = matrix[:, columns] @ quantities
+    return ([(int(ids[c]), float(q)) for c, q in zip(columns, quantities)],
+            dict(zip(nutrient_matrix.nutrients, (round(float(x), 1) for x in totals))))
@@ -0,0 +1,231 @@
+"""
+on demand cProfile of requests, stats aggregated per route
+"""
+
+import os
+import random
+import marshal
+import cProfile
+import pstats
+import threading
+import ipaddress
+
+# where time goes - files of functions by category
+CATEGORIES = (
+    ('storage', ('meal_storage.py', 'sql_storage.py', 'sqlite3_engine.py')),
+    ('marshalling', ('meta.py', 'model.py', '{0}marshmallow{0}'.format(os.sep))),
+    ('json', ('{0}json{0}'.format(os.sep), '_json.py')),
+)
+
+
+def _category(func):
+    filename = func[0]
+    for name, patterns in CATEGORIES:
+        if any(x in filename for x in patterns):
+            return name
+
+    return None
+
+
+def _stacks(stats):
+    """
+    (stack of functions, seconds of its own time) estimated from pstats.Stats - 
+    cProfile keeps only caller-callee pairs, so time of function is divided between 
+    its callers in proportion to time spent when called from them
+    """
+    children = {}
+    for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+        for caller, edge in callers.items():
+            children.setdefault(caller, []).append((func, edge[3]))
+
+    def walk(func, path, fraction):
+        tt = stats.stats[func][2]
+        path = path + (func,)
+        if tt * fraction > 0:
+            yield path, tt * fraction
+
+        for child, edge_ct in children.get(func, ()):
+            child_ct = stats.stats[child][3]
+            if child_ct > 0 and child not in path and len(path) < 64:
+                yield from walk(child, path, fraction * edge_ct / child_ct)
+
+    for func, value in stats.stats.items():
+        if not value[4]:
+            yield from walk(func, (), 1.0)
+
+
+def split(stats):
+    """
+    {category: seconds} of pstats.Stats, time of functions outside of categories
+    (e.g. sqlite3 builtins) goes to category of innermost categorized caller
+    """
+    ret = dict((name, 0.0) for name, _ in CATEGORIES)
+    for path, seconds in _stacks(stats):
+        for func in reversed(path):
+            category = _category(func)
+            if category is not None:
+                ret[category] += seconds
+                break
+
+    return ret
+
+
+def _name(func):
+    filename, line, name = func
+    if filename == '~':
+        return name
+    return '{}:{}:{}'.format(os.path.basename(filename), line, name)
+
+
+def collapsed(stats, unit=1e6):
+    """collapsed stack lines ('root;caller;callee microseconds') for flamegraph.pl/speedscope"""
+    lines = {}
+    for path, seconds in _stacks(stats):
+        key = ';'.join(_name(x) for x in path)
+        lines[key] = lines.get(key, 0) + seconds * unit
+
+    return ''.join('{} {}\n'.format(k, int(v)) for k, v in sorted(lines.items()) if v >= 1)
+
+
+def _networks(networks):
+    return tuple(ipaddress.ip_network(x) for x in networks)
+
+
+def _in(ip, networks):
+    try:
+        ip = ipaddress.ip_address(ip)
+    except (TypeError, ValueError):
+        return False
+    return any(ip in x for x in networks)
+
+
+class RequestProfiler(object):
+    """
+    profiles sample_rate fraction of requests and requests with header
+    (e.g. X-Profile: 1) coming from allowed networks, stats are aggregated per route.
+    behind reverse proxy every request comes from proxy's address - proxies (networks)
+    have to be set, client is then taken from X-Forwarded-For. request forwarded
+    by proxy that isn't one of them has no known client and is never allowed.
+    one request is profiled at a time (cProfile is process wide since python 3.12)
+    """
+
+    def __init__(self, sample_rate=0.0, header='X-Profile', allowed=('127.0.0.1/32', '::1/128'), proxies=()):
+        self.configure(sample_rate, header, allowed, proxies)
+
+        self._stats = {}
+        self._counts = {}
+        self._lock = threading.Lock()
+        self._active = threading.Lock()
+
+
+    def configure(self, sample_rate=None, header=None, allowed=None, proxies=None):
+        """change settings given (not None)"""
+        if sample_rate is not None:
+            sample_rate = float(sample_rate)
+            if not 0 <= sample_rate <= 1:
+                raise ValueError('sample_rate must be between 0 and 1')
+            self.sample_rate = sample_rate
+        if header is not None:
+            self.header = header
+        if allowed is not None:
+            self.allowed = _networks(allowed)
+        if proxies is not None:
+            self.proxies = _networks(proxies)
+
+
+    def client_ip(self, headers, ip):
+        """address of client of request from ip, None if it can't be told"""
+        forwarded = [x.strip() for x in headers.get('X-Forwarded-For', '').split(',') if x.strip()]
+        if not _in(ip, self.proxies):
+            return None if forwarded else ip
+
+        # last address not added by one of proxies
+        for address in reversed(forwarded):
+            if not _in(address, self.proxies):
+                return address
+        return None
+
+
+    def is_allowed(self, headers, ip):
+        """may request with headers from ip profile and see profiles?"""
+        return _in(self.client_ip(headers, ip), self.allowed)
+
+
+    def wanted(self, headers, ip):
+        """profile request with headers from ip?"""
+        if self.sample_rate and random.random() < self.sample_rate:
+            return True
+
+        return bool(headers.get(self.header)) and self.is_allowed(headers, ip)
+
+
+    def start(self):
+        """enabled cProfile.Profile, None if other request is being profiled"""
+        if not self._active.acquire(blocking=False):
+            return None
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # other profiler (not ours) is active
+            self._active.release()
+            return None
+
+        return profile
+
+
+    def stop(self, route, profile):
+        """stop profile of start() and add it to route"""
+        try:
+            profile.disable()
+            self.add(route, profile)
+        finally:
+            self._active.release()
+
+
+    def add(self, route, profile):
+        stats = pstats.Stats(profile)
+        with self._lock:
+            if route in self._stats:
+                self._stats[route].add(stats)
+            else:
+                self._stats[route] = stats
+            self._counts[route] = self._counts.get(route, 0) + 1
+
+
+    def routes(self):
+        """{route: dict(requests, total, storage, marshalling, json)} - seconds"""
+        with self._lock:
+            ret = {}
+            for route, stats in self._stats.items():
+                ret[route] = dict(requests=self._counts[route], total=stats.total_tt, **split(stats))
+
+            return ret
+
+
+    def stats(self, route):
+        """pstats.Stats of route or None"""
+        with self._lock:
+            stats = self._stats.get(route)
+            if stats is None:
+                return None
+
+            ret = pstats.Stats()
+            ret.add(stats)
+            return ret
+
+
+    def dump(self, route):
+        """stats of route in pstats (marshal) format, what pstats.Stats(file) loads"""
+        stats = self.stats(route)
+        return None if stats is None else marshal.dumps(stats.stats)
+
+
+    def clear(self):
+        with self._lock:
+            self._stats.clear()
+            self._counts.clear()
+
+
+PROFILER = RequestProfiler()
@@ -1,14 +1,19 @@
 import cherrypy
 
-from controllers import MealsController
+from controllers import MealsController, MetricsController, ProfileController
+from metrics import SQL_METRICS
 
-def init(disp: cherrypy.dispatch.RoutesDispatcher):
+def init(disp: cherrypy.dispatch.RoutesDispatcher, storage=None):
     get_c = dict(method=["GET", "HEAD"])
     put_c = dict(method=["PUT"])
     post_c = dict(method=["POST"])
     delete_c = dict(method=["DELETE"])
 
-    ctrl = MealsController()
+    ctrl = MealsController(storage)
+    if cherrypy.config.get('sql.instrument', False):
+        ctrl.storage.sqlstorage.engine.instrument(SQL_METRICS)
+    metrics = MetricsController()
+    profile = ProfileController()
 
     # GET
     disp.connect(name='get_meals', route='/meals', action='get_meals', controller=ctrl, conditions=get_c)
@@ -16,16 +21,25 @@ def init(disp: cherrypy.dispatch.RoutesDispatcher):
     disp.connect(name='get_meal', route='/meals/{id}', action='get_meal', controller=ctrl, conditions=get_c)
 
     disp.connect(name='get_ingredients', route='/ingredients', action='get_ingredients', controller=ctrl, conditions=get_c)
+    disp.connect(name='export_ingredients', route='/ingredients/export', action='export_ingredients', controller=ctrl, conditions=get_c)
     disp.connect(name='get_ingredient', route='/ingredients/{id}', action='get_ingredient', controller=ctrl, conditions=get_c)
 
     disp.connect(name='search', route='/search', action='search', controller=ctrl, conditions=get_c )
 
+    disp.connect(name='get_nutrition', route='/stats/nutrition', action='get_nutrition', controller=ctrl, conditions=get_c)
+    disp.connect(name='plan', route='/plan', action='plan', controller=ctrl, conditions=get_c)
+
+    disp.connect(name='metrics', route='/metrics', action='metrics', controller=metrics, conditions=get_c)
+    disp.connect(name='get_profile', route='/admin/profile', action='get_profile', controller=profile, conditions=get_c)
+
     # POST
     disp.connect(name='meals', route='/meals', action='add_meal', controller=ctrl, conditions=post_c)
     disp.connect(name='add_ingredient', route='/ingredients', action='add_ingredient', controller=ctrl, conditions=post_c)
+    disp.connect(name='import_ingredients', route='/ingredients/import', action='import_ingredients', controller=ctrl, conditions=post_c)
 
     # PUT
     disp.connect(name='update_ingredient', route='/ingredients', action='update_ingredient', controller=ctrl, conditions=put_c)
 
     # DELETE
     disp.connect(name='delete_ingredient', route='/ingredients/{id}', action='delete_ingredient', controller=ctrl, conditions=delete_c)
+    disp.connect(name='delete_profile', route='/admin/profile', action='delete_profile', controller=profile, conditions=delete_c)
@@ -2,11 +2,17 @@
 CherryPy-based webservice
 """
 
+import os
 import json
+import types
+import threading
 import cherrypy
+import cherrypy._json
 
 import routeconfig
-from sqlite3_engine import SQLite3Engine
+from metrics import REQUEST_METRICS, SQL_METRICS, route_name
+from profiling import PROFILER
+from sqlite3_engine import SQLite3Engine, SQLite3PooledEngine, SQLite3SharedMemoryEngine
 from meal_storage import MealStorage
 from model import *
 from conditions import *
@@ -32,40 +38,200 @@ def jsonify_error(status, message, traceback, version):
     return response_body
 
 
+def json_handler(*args, **kwargs):
+    """json_out handler, generators (streamed responses) are already json encoded"""
+    value = cherrypy.serving.request._json_inner_handler(*args, **kwargs)
+    if isinstance(value, types.GeneratorType):
+        return value
+
+    return cherrypy._json.encode(value)
+
+
 def cors():
     if cherrypy.request.method in ('OPTIONS', 'OPTONS'): # firefox HTTP Request Maker sends OPTONS ???
         # preflign request 
         # see http://www.w3.org/TR/cors/#cross-origin-request-with-preflight-0
         cherrypy.response.headers['Access-Control-Allow-Methods'] = 'POST, GET, PUT, DELETE, OPTIONS'
-        cherrypy.response.headers['Access-Control-Allow-Headers'] = 'content-type'
+        cherrypy.response.headers['Access-Control-Allow-Headers'] = 'content-type, if-none-match'
         cherrypy.response.headers['Access-Control-Allow-Origin']  = '*'
         # tell CherryPy to avoid normal handler
         return True
     else:
         cherrypy.response.headers['Access-Control-Allow-Origin'] = '*'
+        cherrypy.response.headers['Access-Control-Expose-Headers'] = 'ETag'
+
+
+def request_metrics():
+    """time request, recorded per route (handler name), method and status once it ends"""
+    request = cherrypy.serving.request
+    start = REQUEST_METRICS.clock()
+    # before json_out replaces the handler
+    route = route_name(request)
+
+    def record():
+        status = str(cherrypy.serving.response.status).split(' ')[0]
+        REQUEST_METRICS.record(route, request.method, status, REQUEST_METRICS.clock() - start)
+
+    request.hooks.attach('on_end_request', record)
+
+
+def profile():
+    """
+    cProfile sampled requests and requests with profiling header from allowed address
+    (see profiling.PROFILER, set by profiler.* config), until response body (json encoded
+    lazily, maybe streamed) is written
+    """
+    request = cherrypy.serving.request
+    if not PROFILER.wanted(request.headers, request.remote.ip):
+        return
+
+    route = route_name(request)
+    profiler = PROFILER.start()
+    if profiler is None:
+        # other request is being profiled
+        return
+
+    request.hooks.attach('on_end_request', lambda: PROFILER.stop(route, profiler))
+
+
+def _profiler_config(key, value):
+    """profiler.<sample_rate|header|allowed|proxies> global config - settings of profiling.PROFILER"""
+    if key not in ('sample_rate', 'header', 'allowed', 'proxies'):
+        raise KeyError('unknown profiler config: {0}'.format(key))
+    PROFILER.configure(**{key: value})
 
 
-def start():
+def _sql_config(key, value):
+    """
+    sql.<slow_query_time|instrument> global config - seconds, statements logged when slower
+    (None - never), time statements into metrics.SQL_METRICS (off by default, read when mounted)
+    """
+    if key == 'slow_query_time':
+        SQL_METRICS.slow_query_time = None if value is None else float(value)
+    elif key != 'instrument':
+        raise KeyError('unknown sql config: {0}'.format(key))
+
+
+cherrypy.config.namespaces['profiler'] = _profiler_config
+cherrypy.config.namespaces['sql'] = _sql_config
+
+
+# cherrypy global config of deployment profiles
+PROFILES = {
+    # built-in server, restarted on code change
+    'development': {
+        'engine.autoreload.on': True,
+    },
+    # wsgi application behind (pre-fork) server
+    'production': {
+        'engine.autoreload.on': False,
+        'checker.on': False,
+        'log.screen': False,
+        'request.show_tracebacks': False,
+    },
+}
+
+# engine by name, called with database file (memory database is per process).
+# no SQLite3ReplicaEngine - worker would read its stale replica until next verification
+ENGINES = {
+    'pooled': SQLite3PooledEngine,
+    'memory': lambda database: SQLite3SharedMemoryEngine(),
+}
+
+
+def _mount(storage):
+    """mount application serving storage (None - MealStorage of e.db) at /"""
     dispatcher = cherrypy.dispatch.RoutesDispatcher()
-    routeconfig.init(dispatcher)
+    routeconfig.init(dispatcher, storage)
 
     config = {
-        'global': {
-            'engine.autoreload.on': True
-        },
         '/': {
             'request.dispatch': dispatcher,
             'error_page.default': jsonify_error,
             'tools.cors.on' : True,
+            'tools.metrics.on': True,
+            'tools.profile.on': True,
             'tools.json_in.on': True,
             'tools.json_out.on': True,
+            'tools.json_out.handler': json_handler,
             'tools.response_headers.on': True,
             'tools.response_headers.headers': [('Content-Type', 'application/json')],
         },
     }
 
-    cherrypy.tree.mount(root=None, config=config)
     cherrypy.tools.cors = cherrypy._cptools.HandlerTool(cors)
+    cherrypy.tools.metrics = cherrypy.Tool('on_start_resource', request_metrics)
+    cherrypy.tools.profile = cherrypy.Tool('on_start_resource', profile)
+
+    return cherrypy.tree.mount(root=None, config=config)
+
+
+class _PerProcessApp(object):
+    """
+    wsgi callable - on first request in every process (after fork) opens storage,
+    mounts application and starts cherrypy engine, so workers share no connections
+    """
+
+    def __init__(self, engine='pooled', database='e.db'):
+        self.engine = engine
+        self.database = database
+        self._app = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+
+    def _init(self):
+        engine = ENGINES[self.engine](self.database)
+        # other workers write the same database
+        storage = MealStorage(engine, external_writes=self.engine != 'memory')
+        if self.engine == 'memory':
+            storage.init()
+
+        self._app = _mount(storage)
+        cherrypy.engine.start()
+        self._pid = os.getpid()
+
+
+    def __call__(self, environ, start_response):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._init()
+
+        return self._app(environ, start_response)
+
+
+def create_app(config=None):
+    """
+    wsgi application for (pre-fork) servers, e.g. gunicorn -w 4 'server:create_app()'.
+    config - 'profile' (PROFILES, production by default), 'engine' (ENGINES, pooled),
+    'database' (e.db), rest is cherrypy global config, including profiler.* (settings of
+    profiling.PROFILER - behind reverse proxy set profiler.proxies) and sql.* (statement metrics).
+    nothing is opened before first request, the application can be created in master process.
+    every worker has its own table versions (MealStorage.etag), so ETag of one worker
+    never matches in other - with N workers If-None-Match hits about 1/N of the time
+    """
+    config = dict(config or {})
+    profile = config.pop('profile', 'production')
+    engine = config.pop('engine', 'pooled')
+    if engine not in ENGINES:
+        raise ValueError('engine must be one of: {}'.format(', '.join(ENGINES)))
+    if profile not in PROFILES:
+        raise ValueError('profile must be one of: {}'.format(', '.join(PROFILES)))
+
+    app = _PerProcessApp(engine, config.pop('database', 'e.db'))
+
+    cherrypy.config.update(dict(PROFILES[profile], **config))
+    # server is the wsgi one
+    cherrypy.server.unsubscribe()
+
+    return app
+
+
+def start(storage=None, profile='development'):
+    """serve storage (MealStorage of e.db by default), e.g. MealStorage(SQLite3SharedMemoryEngine()) for load tests"""
+    cherrypy.config.update(PROFILES[profile])
+    _mount(storage)
 
     cherrypy.engine.start()
     cherrypy.engine.block()
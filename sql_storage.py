@@ -1,46 +1,269 @@
 import sys
 import re
+import time
+import queue
 import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import Future
 from pathlib import Path
 from datetime import datetime
-from functools import namedtuple
+from functools import namedtuple, lru_cache
 from model import *
+from conditions import group, grouping, ordering, limiting
 
 class InvalidFieldsError(Exception):
     pass
 
+keysvalues = namedtuple('keysvalues', ['keys', 'values'])
+
 def _keysvalues(dic):
-    items = dic.items()
-    kv = namedtuple('keysvalues', ['keys', 'values'])
-    return kv(tuple(x[0] for x in items), tuple(x[1] for x in items))
+    return keysvalues(tuple(dic.keys()), tuple(dic.values()))
+
+def _shape(conds):
+    """conditions without values - what compiled sql depends on"""
+    ret = []
+    for cond in conds:
+        if isinstance(cond, group):
+            ret.append((cond.op, _shape(cond.conds)))
+        elif isinstance(cond, grouping):
+            ret.append(('GROUP BY', cond.columns))
+        elif isinstance(cond, ordering):
+            ret.append(('ORDER BY', cond.columns))
+        elif isinstance(cond, limiting):
+            ret.append(('LIMIT', cond.offset is not None))
+        elif cond.op == 'IN':
+            ret.append((cond.op, cond.lval, len(cond.rval)))
+        else:
+            ret.append((cond.op, cond.lval))
+
+    return tuple(ret)
+
+
+def _fragment(shape):
+    op = shape[0]
+    if op in ('AND', 'OR'):
+        if not shape[1]:
+            # empty group - true for AND, false for OR
+            return '1' if op == 'AND' else '0'
+        return '({})'.format(' {} '.format(op).join(_fragment(x) for x in shape[1]))
+    if op == 'IN':
+        return '{} IN ({})'.format(shape[1], ', '.join('?' * shape[2]))
+    if op == 'BETWEEN':
+        return '{} BETWEEN ? AND ?'.format(shape[1])
+    if op == 'IS NULL':
+        return '{} IS NULL'.format(shape[1])
+
+    return '{} {} ?'.format(shape[1], op)
+
+
+@lru_cache(maxsize=256)
+def _compile(shape):
+    """(where lines, group by/order by/limit lines) for conditions shape"""
+    lines, groups, columns, limit = [], [], [], None
+    for x in shape:
+        if x[0] == 'GROUP BY':
+            groups.extend(x[1])
+        elif x[0] == 'ORDER BY':
+            columns.extend(x[1])
+        elif x[0] == 'LIMIT':
+            limit = 'LIMIT ? OFFSET ?' if x[1] else 'LIMIT ?'
+        else:
+            lines.append('AND {}'.format(_fragment(x)))
+
+    tail = []
+    if groups:
+        tail.append('GROUP BY {}'.format(', '.join(groups)))
+    if columns:
+        tail.append('ORDER BY {}'.format(', '.join(
+            '{} DESC'.format(x[1:]) if x.startswith('-') else x for x in columns)))
+    if limit:
+        tail.append(limit)
+
+    return tuple(lines), tuple(tail)
+
+
+def _bind(conds):
+    """values for placeholders, in order of compiled sql"""
+    bind, tail = [], []
+
+    def collect(conds):
+        for cond in conds:
+            if isinstance(cond, group):
+                collect(cond.conds)
+            elif isinstance(cond, limiting):
+                tail[:] = (cond.count,) if cond.offset is None else (cond.count, cond.offset)
+            elif isinstance(cond, (grouping, ordering)):
+                pass
+            elif cond.op in ('IN', 'BETWEEN', 'IS NULL'):
+                bind.extend(cond.rval)
+            else:
+                bind.append(cond.rval)
+
+    collect(conds)
+    return tuple(bind + tail)
 
 prep = namedtuple('prep_stmt', ['sql', 'bind'])
 
 
+class StatementCache(object):
+    """
+    bounded (lru) cache of sql text by statement shape - 
+    kind, table, columns and conditions without values. 
+    same text for same shape also lets sqlite reuse compiled statement 
+    from connection's cached_statements
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._stmts = OrderedDict()
+        self._lock = threading.Lock()
+
+
+    def get(self, key, build):
+        """return sql for key, build() it on miss"""
+        with self._lock:
+            sql = self._stmts.get(key)
+            if sql is not None:
+                self.hits += 1
+                self._stmts.move_to_end(key)
+                return sql
+
+            self.misses += 1
+
+        sql = build()
+
+        with self._lock:
+            self._stmts[key] = sql
+            if len(self._stmts) > self.maxsize:
+                self._stmts.popitem(last=False)
+
+        return sql
+
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, size=len(self._stmts))
+
+
+    def clear(self):
+        with self._lock:
+            self._stmts.clear()
+            self.hits = self.misses = 0
+
+
 class SQLStorage(object):
     """
     class to construct sql statements for basic operations, 
     relays on Engine to actually execute them
     """
 
-    def __init__(self, engine):
+    def __init__(self, engine, stmt_cache_size=256):
         self.engine = engine
+        self.stmt_cache = StatementCache(stmt_cache_size)
+
+        # called with names of written tables once the write is committed
+        self.write_listeners = []
+        self._tx = threading.local()
 
     
     def execute_ddl(self, ddl=()):
         self.engine.execute_ddl(ddl)
 
 
+    def pragma(self, name, value=None):
+        """read pragma or set it if value is given (pragmas can't use bind parameters)"""
+        if value is None:
+            return self.engine.execute('PRAGMA {}'.format(name), func=lambda cursor: cursor.fetchone()[0])
+
+        self.engine.execute_ddl(('PRAGMA {} = {}'.format(name, value),))
+
+
+    @contextmanager
+    def transaction(self):
+        """context manager, statements inside are committed (or rolled back) together"""
+        if self.in_transaction():
+            mark = len(self._tx.undo)
+            try:
+                with self.engine.transaction():
+                    yield
+            except BaseException:
+                self._undo(mark)
+                raise
+            return
+
+        self._tx.written = written = set()
+        self._tx.undo, self._tx.deferred = [], []
+        try:
+            with self.engine.transaction():
+                yield
+        except BaseException:
+            self._undo(0)
+            raise
+        finally:
+            # listeners hear about writes after commit (also after rollback - harmless)
+            deferred = self._tx.deferred
+            self._tx.written = self._tx.undo = self._tx.deferred = None
+            self._notify(written)
+            for func in deferred:
+                func()
+
+
+    def _undo(self, mark):
+        undo = self._tx.undo[mark:]
+        del self._tx.undo[mark:]
+        for func in reversed(undo):
+            func()
+
+
+    def on_rollback(self, func):
+        """
+        call func if (innermost) transaction of calling thread rolls back - to undo
+        changes of objects made along with its statements. nothing outside transaction
+        """
+        if self.in_transaction():
+            self._tx.undo.append(func)
+
+
+    def after_transaction(self, func):
+        """call func once outermost transaction of calling thread ends, right away outside transaction"""
+        if self.in_transaction():
+            self._tx.deferred.append(func)
+        else:
+            func()
+
+
+    def in_transaction(self):
+        """true if calling thread is inside transaction()"""
+        return getattr(self._tx, 'written', None) is not None
+
+
+    def _written(self, table):
+        written = getattr(self._tx, 'written', None)
+        if written is not None:
+            written.add(table)
+        else:
+            self._notify((table,))
+
+
+    def _notify(self, tables):
+        if tables:
+            for listener in self.write_listeners:
+                listener(*tables)
+
+
     def _prep_select(self, table, columns=(), conds=()):
-        if not columns:
-            columns = ('*',)
+        shape = _shape(conds)
 
-        sql = ['SELECT {} FROM {} WHERE 1 = 1'.format(', '.join(columns), table)]
-        for cond in conds:
-            sql.append('AND {} {} ?'.format(cond.lval, cond.op))
-        bind = tuple(cond.rval for cond in conds)
+        def build():
+            lines, tail = _compile(shape)
+            sql = ['SELECT {} FROM {} WHERE 1 = 1'.format(', '.join(columns or ('*',)), table)]
+            return '\n'.join(sql + list(lines) + list(tail))
 
-        return prep('\n'.join(sql), bind)
+        key = ('select', table, tuple(columns), shape)
+        return prep(self.stmt_cache.get(key, build), _bind(conds))
 
 
     def select(self, table, columns=(), conds=()):
@@ -51,44 +274,235 @@ class SQLStorage(object):
         return self.engine.execute(*self._prep_select(table, columns, conds), get_result)
 
 
+    def select_rows(self, table, columns=(), conds=()):
+        """like select, but rows are tuples of values in order of columns"""
+        return self.engine.execute(*self._prep_select(table, columns, conds), lambda cursor: cursor.fetchall())
+
+
     def _prep_insert(self, table, dic):
         columns, bind = _keysvalues(dic)
-        sql = ['INSERT INTO {}({}) VALUES({})'.format(table, ', '.join(columns), ', '.join('?' * len(columns)))]
-    
-        return prep('\n'.join(sql), bind)
+
+        def build():
+            return 'INSERT INTO {}({}) VALUES({})'.format(table, ', '.join(columns), ', '.join('?' * len(columns)))
+
+        return prep(self.stmt_cache.get(('insert', table, columns), build), bind)
 
 
     def insert(self, table, dic):
-        return self.engine.execute(*self._prep_insert(table, dic), lambda cursor: cursor.lastrowid)
+        try:
+            return self.engine.execute(*self._prep_insert(table, dic), lambda cursor: cursor.lastrowid)
+        finally:
+            self._written(table)
+
+
+    def _prep_insert_many(self, table, dics):
+        # rows may have different sets of columns (unset fields are not dumped),
+        # one statement for every distinct set of columns
+        groups = {}
+        for i, dic in enumerate(dics):
+            groups.setdefault(tuple(dic.keys()), []).append(i)
+
+        ret = []
+        for columns, idxs in groups.items():
+            sql, _ = self._prep_insert(table, dics[idxs[0]])
+            binds = [tuple(dics[i][col] for col in columns) for i in idxs]
+            ret.append((idxs, prep(sql, binds)))
+
+        return ret
+
+
+    def insert_many(self, table, dics):
+        """
+        insert all dics in one transaction (all or nothing), 
+        return generated ids in order of dics
+        """
+        def last_rowid(cursor):
+            return cursor.connection.execute('SELECT last_insert_rowid()').fetchone()[0]
+
+        ids = [None] * len(dics)
+        with self.transaction():
+            for idxs, stmt in self._prep_insert_many(table, dics):
+                last = self.engine.executemany(stmt.sql, stmt.bind, last_rowid)
+
+                # write lock is held for whole transaction so generated rowids are consecutive
+                if 'id' in dics[idxs[0]]:
+                    new_ids = [dics[i]['id'] for i in idxs]
+                else:
+                    new_ids = range(last - len(idxs) + 1, last + 1)
+
+                for i, id_ in zip(idxs, new_ids):
+                    ids[i] = id_
+
+                self._written(table)
+
+        return ids
 
 
     def _prep_delete(self, table, conds):
-        sql = ['DELETE FROM {} WHERE 1 = 1'.format(table)]
+        shape = _shape(conds)
 
-        for cond in conds:
-            sql.append('AND {} {} ?'.format(cond.lval, cond.op, cond.rval))
-        bind = tuple(cond.rval for cond in conds)
+        def build():
+            lines, tail = _compile(shape)
+            if tail:
+                raise ValueError('group by/order by/limit not supported in delete')
 
-        return prep('\n'.join(sql), bind)
+            return '\n'.join(['DELETE FROM {} WHERE 1 = 1'.format(table)] + list(lines))
+
+        key = ('delete', table, shape)
+        return prep(self.stmt_cache.get(key, build), _bind(conds))
 
 
     def delete(self, table, conds):
-        return self.engine.execute(*self._prep_delete(table, conds))
+        try:
+            return self.engine.execute(*self._prep_delete(table, conds))
+        finally:
+            self._written(table)
 
 
     def _prep_update(self, table, dic, conds):
         cols, bind = _keysvalues(dic)
-        sql = ['UPDATE {} SET {} WHERE 1 = 1'.format(
-            table, 
-            ', '.join('{} = ?'.format(x) for x in cols))]
+        shape = _shape(conds)
 
-        for cond in conds:
-            sql.append('AND {} {} ?'.format(cond.lval, cond.op))
+        def build():
+            lines, tail = _compile(shape)
+            if tail:
+                raise ValueError('group by/order by/limit not supported in update')
+
+            sql = ['UPDATE {} SET {} WHERE 1 = 1'.format(
+                table, 
+                ', '.join('{} = ?'.format(x) for x in cols))]
 
-        bind = bind + tuple(cond.rval for cond in conds)
+            return '\n'.join(sql + list(lines))
 
-        return prep('\n'.join(sql), bind)
+        key = ('update', table, cols, shape)
+        return prep(self.stmt_cache.get(key, build), bind + _bind(conds))
 
 
     def update(self, table, dic, conds):
-        return self.engine.execute(*self._prep_update(table, dic, conds))
+        try:
+            return self.engine.execute(*self._prep_update(table, dic, conds))
+        finally:
+            self._written(table)
+
+
+class WriteQueue(object):
+    """
+    group commit - writes submitted by many threads are run by one writer thread
+    in batches, one transaction per batch instead of one per write. 
+    every write runs in its own savepoint, failed write is rolled back alone 
+    and only its caller gets the error
+    """
+
+    def __init__(self, storage, max_delay=0.002, max_batch=256):
+        self.storage = storage
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self.batches = 0
+        self.writes = 0
+
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+
+    def submit(self, work):
+        """
+        run work() (storage writes) in writer thread, 
+        wait for its batch to commit and return its result or raise its error
+        """
+        future = Future()
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='write-queue', daemon=True)
+                self._thread.start()
+            self._queue.put((work, future))
+
+        return future.result()
+
+
+    def close(self):
+        """commit queued writes and stop writer thread"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+
+    def _collect(self, item):
+        """batch starting with item - whatever else comes in max_delay, up to max_batch"""
+        batch = [item]
+        deadline = time.monotonic() + self.max_delay
+
+        while len(batch) < self.max_batch:
+            try:
+                item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+
+            if item is None:
+                return batch, True
+            batch.append(item)
+
+        return batch, False
+
+
+    def _run(self):
+        batch = []
+        try:
+            stop = False
+            while not stop:
+                item = self._queue.get()
+                if item is None:
+                    return
+
+                batch, stop = self._collect(item)
+                self._commit(batch)
+        except BaseException:
+            self._fail(batch)
+            raise
+
+
+    def _fail(self, batch):
+        """writer thread died - fail writes of batch and queued ones, next submit starts new writer"""
+        error = RuntimeError('write queue writer stopped')
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(error)
+
+        with self._lock:
+            self._thread = None
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    return
+                if item is not None:
+                    item[1].set_exception(error)
+
+
+    def _commit(self, batch):
+        results = []
+        try:
+            with self.storage.transaction():
+                for work, future in batch:
+                    try:
+                        with self.storage.transaction():
+                            results.append((future, work(), None))
+                    except BaseException as e:
+                        # e.g. SystemExit of work - its caller's, writer goes on
+                        results.append((future, None, e))
+        except BaseException as e:
+            # commit failed, nothing of the batch is written
+            results = [(future, None, error or e) for future, _, error in results]
+            results += [(future, None, e) for _, future in batch[len(results):]]
+
+        self.batches += 1
+        self.writes += len(batch)
+
+        for future, ret, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(ret)
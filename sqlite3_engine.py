@@ -1,11 +1,134 @@
+import logging
 import sqlite3
+import threading
+from contextlib import contextmanager
+from urllib.parse import quote
+from uuid import uuid4
+
+replica_log = logging.getLogger('eatwatch.sql.replica')
+
+
+def _rows(ret, cursor):
+    """rows returned (fetched list) or changed by statement"""
+    if isinstance(ret, list):
+        return len(ret)
+    return max(cursor.rowcount, 0)
+
+
+def _kind(sql):
+    """
+    'read', 'pragma' (connection or file settings) or 'write' statement.
+    WITH may lead to insert, update or delete - only plain SELECT is a read
+    """
+    words = sql.split(None, 1)
+    word = words[0].upper() if words else ''
+    if word in ('SELECT', 'EXPLAIN'):
+        return 'read'
+    if word == 'PRAGMA':
+        return 'pragma'
+    return 'write'
+
+
+def _schema(conn):
+    return conn.execute('SELECT type, name, sql FROM sqlite_master ORDER BY type, name').fetchall()
+
+
+def _chunk_sql(table, sql, first):
+    """rows of table for comparison, keyset chunks by rowid (WITHOUT ROWID tables whole)"""
+    if 'WITHOUT ROWID' in (sql or '').upper():
+        return 'SELECT * FROM "{}" NOT INDEXED'.format(table)
+    if first:
+        return 'SELECT rowid, * FROM "{}" ORDER BY rowid LIMIT ?'.format(table)
+    return 'SELECT rowid, * FROM "{}" WHERE rowid > ? ORDER BY rowid LIMIT ?'.format(table)
 
 
 # TODO: interface for engines?
-class SQLite3Engine():
-    """class for executing sql statements"""
-    def __init__(self, constr):
-        self.constr = constr
+class _SQLite3BaseEngine():
+    """
+    executes statements on connection provided by subclass (_acquire),
+    commits after every statement unless inside transaction()
+    """
+
+    def __init__(self):
+        self._tx = threading.local()
+        self.metrics = None
+
+
+    def instrument(self, metrics):
+        """time every statement into metrics (metrics.SQLMetrics), None turns it off"""
+        self.metrics = metrics
+
+
+    def _acquire(self):
+        raise NotImplementedError
+
+
+    def _release(self, conn):
+        pass
+
+
+    def _rollback(self, conn):
+        conn.rollback()
+
+
+    @contextmanager
+    def transaction(self):
+        """
+        run all statements executed by calling thread in one transaction,
+        nested transactions are savepoints
+        """
+        depth = getattr(self._tx, 'depth', 0)
+
+        if depth:
+            conn = self._tx.conn
+            savepoint = 'sp{}'.format(depth)
+            conn.execute('SAVEPOINT {}'.format(savepoint))
+            self._tx.depth += 1
+            try:
+                yield
+            except BaseException:
+                conn.execute('ROLLBACK TO {}'.format(savepoint))
+                conn.execute('RELEASE {}'.format(savepoint))
+                raise
+            else:
+                conn.execute('RELEASE {}'.format(savepoint))
+            finally:
+                self._tx.depth -= 1
+            return
+
+        conn = self._acquire()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            self._tx.conn, self._tx.depth = conn, 1
+            try:
+                yield
+                conn.commit()
+            except BaseException:
+                self._rollback(conn)
+                raise
+            finally:
+                self._tx.conn, self._tx.depth = None, 0
+        finally:
+            self._release(conn)
+
+
+    def _run(self, work):
+        conn = getattr(self._tx, 'conn', None)
+        if conn is not None:
+            # commit/rollback is up to transaction()
+            return work(conn)
+
+        conn = self._acquire()
+        try:
+            ret = work(conn)
+            conn.commit()
+            return ret
+        except BaseException:
+            # also errors of func - persistent connection must not keep write transaction open
+            self._rollback(conn)
+            raise
+        finally:
+            self._release(conn)
 
 
     def execute(self, sql, bind=(), func=None):
@@ -14,42 +137,481 @@ class SQLite3Engine():
             def func(cursor):
                 return cursor.lastrowid
 
-        with sqlite3.connect(self.constr) as c:
-            cur = c.cursor()
-            cur.execute(sql, bind)
-            return func(cur)
+        if self.metrics is None:
+            return self._run(lambda conn: func(conn.execute(sql, bind)))
+
+        def work(conn):
+            cursor = conn.execute(sql, bind)
+            ret = func(cursor)
+            return ret, _rows(ret, cursor)
+
+        return self.metrics.observe(sql, bind, lambda: self._run(work))
+
+
+    def executemany(self, sql, binds=(), func=None):
+        """execute statement for every bind in binds"""
+        if func is None:
+            def func(cursor):
+                return cursor.rowcount
+
+        if self.metrics is None:
+            return self._run(lambda conn: func(conn.executemany(sql, binds)))
+
+        def work(conn):
+            cursor = conn.executemany(sql, binds)
+            return func(cursor), max(cursor.rowcount, 0)
+
+        return self.metrics.observe(sql, (), lambda: self._run(work))
 
 
     def execute_ddl(self, ddl=()):
-        with sqlite3.connect(self.constr) as cur:
+        metrics = self.metrics
+
+        def work(conn):
             for stmt in ddl:
-                cur.execute(stmt)
+                if metrics is None:
+                    conn.execute(stmt)
+                else:
+                    metrics.observe(stmt, (), lambda: (None, max(conn.execute(stmt).rowcount, 0)))
+
+        self._run(work)
+
+
+class SQLite3Engine(_SQLite3BaseEngine):
+    """class for executing sql statements"""
+    def __init__(self, constr):
+        super().__init__()
+        self.constr = constr
+
+
+    def _acquire(self):
+        return sqlite3.connect(self.constr)
+
+
+    def _release(self, conn):
+        conn.close()
+
+
+class SQLite3PooledEngine(_SQLite3BaseEngine):
+    """
+    class for executing sql statements, keeps one persistent connection
+    per thread (cherrypy worker) instead of connecting for every statement
+    """
+
+    def __init__(self, constr, journal_mode='WAL', synchronous='NORMAL',
+                 cache_size=-16000, mmap_size=0, busy_timeout=5000, cached_statements=128):
+        super().__init__()
+        self.constr = constr
+        self.cached_statements = cached_statements
+        self.pragmas = (
+            ('journal_mode', journal_mode),
+            ('synchronous', synchronous),
+            ('cache_size', cache_size),
+            ('mmap_size', mmap_size),
+            ('busy_timeout', busy_timeout))
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._conns = set()
+
+
+    def _connect(self):
+        conn = sqlite3.connect(
+                self.constr,
+                check_same_thread=False,
+                cached_statements=self.cached_statements,
+                uri=self.constr.startswith('file:'))
+
+        for name, value in self.pragmas:
+            if value is not None:
+                conn.execute('PRAGMA {} = {}'.format(name, value))
+
+        with self._lock:
+            self._conns.add(conn)
+
+        return conn
+
+
+    def _discard(self, conn):
+        with self._lock:
+            self._conns.discard(conn)
+
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+        if getattr(self._local, 'conn', None) is conn:
+            self._local.conn = None
+
+
+    def connection(self):
+        """return connection owned by the calling thread, (re)connect if needed"""
+        conn = getattr(self._local, 'conn', None)
+
+        if conn is not None:
+            try:
+                conn.total_changes # raises on closed connection
+            except sqlite3.ProgrammingError:
+                self._discard(conn)
+                conn = None
+
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+
+        return conn
+
+
+    def _acquire(self):
+        return self.connection()
+
+
+    def data_version(self):
+        """
+        (connection id, PRAGMA data_version) of calling thread's connection,
+        changes when any other connection - of this or other process - commits
+        """
+        conn = self.connection()
+        return id(conn), conn.execute('PRAGMA data_version').fetchone()[0]
+
 
+    def _rollback(self, conn):
+        # connection that can't even rollback is broken, recycle it
+        try:
+            conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
 
-class SQLite3MemoryEngine():
+
+    def close(self):
+        """close connections of all threads"""
+        with self._lock:
+            conns, self._conns = self._conns, set()
+
+        for conn in conns:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+
+class SQLite3MemoryEngine(_SQLite3BaseEngine):
     """class for executing sql statements"""
     def __init__(self):
+        super().__init__()
         self.conn = sqlite3.connect(':memory:')
 
 
+    def _acquire(self):
+        return self.conn
+
+
+class _ReadWriteLock(object):
+    """many readers or one writer, waiting writer goes first"""
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting = 0
+
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._waiting += 1
+            try:
+                while self._writer or self._readers:
+                    self._cond.wait()
+            finally:
+                self._waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+class SQLite3SharedMemoryEngine(SQLite3PooledEngine):
+    """
+    in-memory database shared by connections of all threads (named shared cache),
+    one connection per thread like SQLite3PooledEngine. shared cache locks tables
+    instead of waiting (SQLITE_LOCKED), so statements take engine lock instead -
+    reads run together, writes and transactions alone. database lives until close()
+    """
+
+    def __init__(self, name=None, cache_size=-16000, cached_statements=128):
+        self.name = name or 'eatwatch-{}'.format(uuid4().hex)
+        super().__init__('file:{}?mode=memory&cache=shared'.format(quote(self.name)),
+                journal_mode=None, synchronous=None, cache_size=cache_size, mmap_size=None,
+                busy_timeout=None, cached_statements=cached_statements)
+
+        self._rwlock = _ReadWriteLock()
+        # memory database is gone with its last connection
+        self._keeper = self._connect()
+
+
+    def load_from(self, conn):
+        """replace database with copy of conn's database (backup api), other threads wait"""
+        with self._rwlock.write():
+            conn.backup(self.connection())
+
+
+    @contextmanager
+    def transaction(self):
+        """see _SQLite3BaseEngine.transaction, other threads wait until it ends"""
+        if getattr(self._tx, 'depth', 0):
+            with super().transaction():
+                yield
+            return
+
+        with self._rwlock.write():
+            with super().transaction():
+                yield
+
+
+    def _locked(self, read, work):
+        if getattr(self._tx, 'depth', 0):
+            # lock is held by transaction
+            return work()
+
+        with (self._rwlock.read() if read else self._rwlock.write()):
+            return work()
+
+
     def execute(self, sql, bind=(), func=None):
         """execute statement"""
-        if func is None:
-            def func(cursor):
-                return cursor.lastrowid
+        return self._locked(_kind(sql) == 'read',
+                lambda: super(SQLite3SharedMemoryEngine, self).execute(sql, bind, func))
 
-        cur = self.conn.cursor()
-        cur.execute(sql, bind)
-        self.conn.commit()
 
-        return func(cur)
+    def executemany(self, sql, binds=(), func=None):
+        """execute statement for every bind in binds"""
+        return self._locked(False,
+                lambda: super(SQLite3SharedMemoryEngine, self).executemany(sql, binds, func))
 
 
     def execute_ddl(self, ddl=()):
-        cur = self.conn.cursor()
-        for stmt in ddl:
-            cur.execute(stmt)
+        self._locked(False, lambda: super(SQLite3SharedMemoryEngine, self).execute_ddl(ddl))
+
+
+class SQLite3ReplicaEngine(SQLite3PooledEngine):
+    """
+    pooled engine on database file with hot replica of it in memory (SQLite3SharedMemoryEngine,
+    connection per thread, reads run together), copied by backup api at start.
+    reads outside transactions are served by replica, writes go to file and, once committed,
+    are replayed on replica before the write returns (writes of this process are serialized),
+    so every read after a write sees it. replica is compared to file every verify_interval
+    seconds (and by verify()) and copied again if they diverged - e.g. after write by other process,
+    which this process doesn't see until then
+    """
+
+    def __init__(self, constr, verify_interval=300, verify_chunk=1000, **kwds):
+        super().__init__(constr, **kwds)
+        self.verify_chunk = verify_chunk
+        self.divergences = 0
+        self.loads = 0
+
+        self._write_lock = threading.Lock()
+        self.replica = SQLite3SharedMemoryEngine(cached_statements=self.cached_statements)
+        self._load()
+
+        self._closed = threading.Event()
+        if verify_interval:
+            threading.Thread(target=self._verify_loop, args=(verify_interval,),
+                             name='replica-verify', daemon=True).start()
+
+
+    def instrument(self, metrics):
+        """time every statement (file and replica) into metrics, None turns it off"""
+        super().instrument(metrics)
+        self.replica.instrument(metrics)
+
+
+    def _load(self):
+        """copy file to replica"""
+        self.replica.load_from(self.connection())
+        self.loads += 1
+
+
+    def data_version(self):
+        """
+        changes when replica is copied from file again - reads see other processes' writes
+        only then, writes of this process are in replica once committed
+        """
+        return id(self), self.loads
+
+
+    def _replay(self, log):
+        """apply committed writes to replica, copy whole file instead if any had unknown effect"""
+        if not log:
+            return
+
+        if None not in log:
+            try:
+                with self.replica.transaction():
+                    for many, sql, bind in log:
+                        if many:
+                            self.replica.executemany(sql, bind)
+                        else:
+                            self.replica.execute(sql, bind)
+                return
+            except sqlite3.Error:
+                replica_log.warning('replay on replica failed, copying file again', exc_info=True)
+
+        self._load()
+
+
+    @contextmanager
+    def transaction(self):
+        """
+        transaction on file (see _SQLite3BaseEngine.transaction), reads inside it see
+        its uncommitted writes. committed writes are replayed on replica
+        """
+        if getattr(self._tx, 'depth', 0):
+            # savepoint rolled back - so are its writes
+            mark = len(self._tx.log)
+            try:
+                with super().transaction():
+                    yield
+            except BaseException:
+                del self._tx.log[mark:]
+                raise
+            return
+
+        with self._write_lock:
+            self._tx.log = log = []
+            try:
+                with super().transaction():
+                    yield
+            finally:
+                self._tx.log = None
+
+            self._replay(log)
+
+
+    def _write(self, many, sql, bind, work):
+        if not getattr(self._tx, 'depth', 0):
+            with self.transaction():
+                return self._write(many, sql, bind, work)
+
+        try:
+            ret = work()
+        except sqlite3.Error:
+            # failed statement may have left some changes (executemany) in transaction
+            self._tx.log.append(None)
+            raise
+
+        self._tx.log.append((many, sql, bind))
+        return ret
+
+
+    def execute(self, sql, bind=(), func=None):
+        """execute statement, reads outside transaction on replica"""
+        kind = _kind(sql)
+        if kind == 'read' and not getattr(self._tx, 'depth', 0):
+            return self.replica.execute(sql, bind, func)
+
+        run = lambda: super(SQLite3ReplicaEngine, self).execute(sql, bind, func)
+        if kind == 'write':
+            return self._write(False, sql, bind, run)
+        return run()
+
+
+    def executemany(self, sql, binds=(), func=None):
+        """execute statement for every bind in binds on file, replay on replica"""
+        binds = list(binds)
+        return self._write(True, sql, binds,
+                lambda: super(SQLite3ReplicaEngine, self).executemany(sql, binds, func))
+
+
+    def execute_ddl(self, ddl=()):
+        ddl = list(ddl)
+        if all(_kind(x) == 'pragma' for x in ddl):
+            # some pragmas (journal_mode) can't run in transaction
+            return super().execute_ddl(ddl)
+
+        with self.transaction():
+            super().execute_ddl(ddl)
+            self._tx.log.extend((False, x, ()) for x in ddl if _kind(x) == 'write')
+
+
+    def _same(self):
+        """
+        compare file and replica chunk by chunk (verify_chunk rows), writes of this process
+        wait only for one chunk at a time, reads don't wait
+        """
+        fetchall = lambda cursor: cursor.fetchall()
+        with self._write_lock:
+            schema = _schema(self.connection())
+            if self.replica.execute('SELECT type, name, sql FROM sqlite_master ORDER BY type, name',
+                                    func=fetchall) != schema:
+                return False
+
+        for type_, name, sql in schema:
+            if type_ != 'table' or (sql or '').upper().startswith('CREATE VIRTUAL'):
+                # virtual tables are compared through their shadow tables
+                continue
+
+            after = None
+            while True:
+                query = _chunk_sql(name, sql, after is None)
+                bind = (self.verify_chunk,) if after is None else (after, self.verify_chunk)
+                if 'LIMIT' not in query:
+                    bind = ()
+
+                with self._write_lock:
+                    expected = self.connection().execute(query, bind).fetchall()
+                    if self.replica.execute(query, bind, fetchall) != expected:
+                        return False
+
+                if not bind or len(expected) < self.verify_chunk:
+                    break
+                after = expected[-1][0]
+
+        return True
+
+
+    def verify(self):
+        """compare replica with file, copy file again if they diverged. true if they were same"""
+        same = self._same()
+        if not same:
+            with self._write_lock:
+                self._load()
+                self.divergences += 1
+            replica_log.warning('replica diverged from %s, copied file again', self.constr)
+
+        return same
+
 
-        self.conn.commit()
+    def _verify_loop(self, interval):
+        while not self._closed.wait(interval):
+            try:
+                self.verify()
+            except sqlite3.Error:
+                replica_log.warning('replica verification failed', exc_info=True)
 
 
+    def close(self):
+        """stop verification, close replica and connections of all threads"""
+        self._closed.set()
+        super().close()
+        self.replica.close()
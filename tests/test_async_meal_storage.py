@@ -0,0 +1,77 @@
+import os
+import sys
+import sqlite3
+import asyncio
+import tempfile
+import threading
+import unittest
+
+sys.path.append('../')
+
+from model import *
+from async_meal_storage import AsyncMealStorage
+from utils import today_at
+
+
+class TestAsyncMealStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.storage = AsyncMealStorage(os.path.join(self.tmpdir.name, 'test.db'), readers=3)
+
+
+    def tearDown(self):
+        self.storage.close()
+        self.tmpdir.cleanup()
+
+
+    def run_async(self, coro):
+        return asyncio.run(coro)
+
+
+    def test_memory_database(self):
+        self.assertRaises(ValueError, lambda: AsyncMealStorage(':memory:'))
+
+
+    def test_add_and_get(self):
+        async def work():
+            await self.storage.init()
+            meal = await self.storage.add_meal(Meal(name='obiad', date=today_at('14:00'), meal_ingredients=[
+                MealIngredient(ingredient=Ingredient(name='ryż', calories=350), quantity=100)]))
+
+            self.assertEqual((await self.storage.get_meal(meal.id)).name, 'obiad')
+            self.assertEqual([x.name for x in await self.storage.search_ingredients(name='ryż')], ['ryż'])
+            ret = await self.storage.get_meal_ingredients_with_ingredient(meal_id=meal.id)
+            self.assertEqual(ret[0].ingredient.calories, 350)
+
+        self.run_async(work())
+
+
+    def test_concurrent_writes(self):
+        async def work():
+            await self.storage.init()
+            ingredients = await asyncio.gather(*(
+                self.storage.add_ingredient(Ingredient(name='ingr{}'.format(i), calories=i)) for i in range(50)))
+
+            self.assertEqual(sorted(x.id for x in ingredients), list(range(1, 51)))
+            got = await asyncio.gather(*(self.storage.get_ingredient(x.id) for x in ingredients))
+            self.assertEqual([x.name for x in got], [x.name for x in ingredients])
+
+            pages = [[x.id for x in objs] async for objs in self.storage.iter_pages(self.storage.get_ingredients, 20)]
+            self.assertEqual([len(x) for x in pages], [20, 20, 10])
+
+        self.run_async(work())
+
+
+    def test_readers_are_read_only(self):
+        async def work():
+            await self.storage.init()
+            with self.assertRaises(sqlite3.OperationalError):
+                await self.storage._call(self.storage._readers, self.storage.storage.add_ingredient,
+                        (Ingredient(name='ryż'),), {})
+
+            writers = await asyncio.gather(*(
+                self.storage._call(self.storage._writer, threading.get_ident, (), {}) for _ in range(10)))
+            self.assertEqual(len(set(writers)), 1)
+
+        self.run_async(work())
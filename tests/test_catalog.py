@@ -0,0 +1,148 @@
+import io
+import sys
+import json
+import sqlite3
+import unittest
+
+import cherrypy
+
+sys.path.append('../')
+
+from model import *
+from sqlite3_engine import SQLite3MemoryEngine
+from meal_storage import MealStorage
+from controllers import MealsController
+import catalog
+
+
+class TestParse(unittest.TestCase):
+
+    def test_iter_lines(self):
+        fp = io.BytesIO(b'a\nbb\n\nccc')
+        self.assertEqual(list(catalog.iter_lines(fp, size=2)), [b'a\n', b'bb\n', b'\n', b'ccc'])
+
+
+    def test_ndjson(self):
+        lines = [b'{"name": "a", "calories": 1}\n', b'\n', b'{"name": \n', b'[1, 2]\n', '{"name": "ż"}'.encode('utf-8')]
+        ret = list(catalog.parse(lines, 'ndjson'))
+
+        self.assertEqual([n for n, _ in ret], [1, 3, 4, 5])
+        self.assertEqual(ret[0][1], {'name': 'a', 'calories': 1})
+        self.assertTrue(ret[1][1].startswith('invalid json'))
+        self.assertEqual(ret[2][1], 'json object expected')
+        self.assertEqual(ret[3][1], {'name': 'ż'})
+
+
+    def test_csv(self):
+        lines = ['name,calories,fats\n', 'a,1,\n', '"b, c",2,3\n', 'd,1,2,3\n']
+        self.assertEqual(list(catalog.parse(lines, 'csv')), [
+            (2, {'name': 'a', 'calories': '1'}),
+            (3, {'name': 'b, c', 'calories': '2', 'fats': '3'}),
+            (4, 'more values than columns')])
+
+
+    def test_unknown_format(self):
+        self.assertRaises(ValueError, lambda: list(catalog.parse([], 'xml')))
+
+
+class TestImportExport(unittest.TestCase):
+
+    def setUp(self):
+        self.storage = MealStorage(SQLite3MemoryEngine())
+        self.storage.init()
+
+
+    def test_import(self):
+        lines = ['name,calories,id\n'] + ['ingr{},{},100\n'.format(i, 'x' if i == 3 else i) for i in range(10)]
+        events = list(catalog.import_ingredients(self.storage, lines, 'csv', chunk_size=4))
+
+        self.assertEqual(events[0], {'line': 5, 'error': {'calories': ['Not a valid number.']}})
+        self.assertEqual([x['progress']['imported'] for x in events if 'progress' in x], [4, 8, 9])
+        self.assertEqual(events[-1], {'done': {'lines': 11, 'imported': 9, 'errors': 1}})
+
+        ingredients = self.storage.get_ingredients()
+        self.assertEqual([x.id for x in ingredients], list(range(1, 10)))
+        self.assertEqual([x.name for x in ingredients], ['ingr{}'.format(i) for i in range(10) if i != 3])
+
+
+    def test_failed_chunk(self):
+        storage, add = self.storage, self.storage.add_ingredients
+
+        def add_ingredients(ingredients):
+            if any(x.name == 'bad' for x in ingredients):
+                raise sqlite3.IntegrityError('constraint failed')
+            return add(ingredients)
+
+        storage.add_ingredients = add_ingredients
+        lines = ['{{"name": "{}"}}\n'.format(x) for x in ('a', 'b', 'bad', 'c', 'd')]
+        events = list(catalog.import_ingredients(storage, lines, 'ndjson', chunk_size=2))
+
+        self.assertIn({'lines': [3, 4], 'error': 'constraint failed'}, events)
+        self.assertEqual(events[-1], {'done': {'lines': 5, 'imported': 3, 'errors': 2}})
+        self.assertEqual([x.name for x in self.storage.get_ingredients()], ['a', 'b', 'd'])
+
+
+    def test_round_trip(self):
+        self.storage.add_ingredients([Ingredient(name='ingr, {}'.format(i), calories=i, fats=0.5) for i in range(7)])
+        expected = Ingredient.dump_many(self.storage.get_ingredients())
+
+        for fmt in catalog.FORMATS:
+            data = b''.join(catalog.export_ingredients(self.storage, fmt, batch=3))
+
+            other = MealStorage(SQLite3MemoryEngine())
+            other.init()
+            events = list(catalog.import_ingredients(other, io.BytesIO(data), fmt))
+            self.assertEqual(events[-1]['done']['imported'], 7)
+            self.assertEqual(Ingredient.dump_many(other.get_ingredients()), expected)
+
+
+    def test_missing_name(self):
+        lines = ['name,calories\n', 'a,1\n', ',2\n', 'b,3\n']
+        events = list(catalog.import_ingredients(self.storage, lines, 'csv'))
+
+        self.assertEqual(events[0], {'line': 3, 'error': {'name': ['Missing data for required field.']}})
+        self.assertEqual(events[-1], {'done': {'lines': 4, 'imported': 2, 'errors': 1}})
+
+        events = list(catalog.import_ingredients(self.storage, [b'{"name": null, "calories": 1}\n'], 'ndjson'))
+        self.assertEqual(events[-1]['done']['errors'], 1)
+
+        # catalog stays readable
+        data = b''.join(catalog.export_ingredients(self.storage, 'csv'))
+        self.assertEqual([x.split(',')[1] for x in data.decode('utf-8').splitlines()[1:]], ['a', 'b'])
+
+
+    def test_export_empty(self):
+        self.assertEqual(b''.join(catalog.export_ingredients(self.storage, 'csv')),
+                (','.join(Ingredient.columns()) + '\n').encode('utf-8'))
+        self.assertEqual(b''.join(catalog.export_ingredients(self.storage, 'ndjson')), b'')
+
+
+class TestController(unittest.TestCase):
+
+    def setUp(self):
+        self.storage = MealStorage(SQLite3MemoryEngine())
+        self.storage.init()
+        self.ctrl = MealsController(self.storage)
+
+
+    def tearDown(self):
+        cherrypy.serving.request.headers.pop('Content-Type', None)
+
+
+    def test_import(self):
+        cherrypy.serving.request.headers['Content-Type'] = 'application/x-ndjson; charset=utf-8'
+        cherrypy.serving.request.body = io.BytesIO(b'{"name": "a"}\n{"name": "b"}\n')
+
+        events = [json.loads(x) for x in b''.join(self.ctrl.import_ingredients()).splitlines()]
+        self.assertEqual(events[-1], {'done': {'lines': 2, 'imported': 2, 'errors': 0}})
+        self.assertEqual(len(self.storage.get_ingredients()), 2)
+
+        self.assertRaises(cherrypy.HTTPError, lambda: self.ctrl.import_ingredients(format='xml'))
+        self.assertRaises(cherrypy.HTTPError, lambda: self.ctrl.import_ingredients(chunk_size='x'))
+
+
+    def test_export(self):
+        self.storage.add_ingredients([Ingredient(name='a'), Ingredient(name='b')])
+        lines = b''.join(self.ctrl.export_ingredients()).splitlines()
+        self.assertEqual([json.loads(x)['name'] for x in lines], ['a', 'b'])
+        self.assertRaises(cherrypy.HTTPError, lambda: self.ctrl.export_ingredients('xml'))
@@ -0,0 +1,257 @@
+import sys
+import json
+import types
+import unittest
+
+import cherrypy
+
+sys.path.append('../')
+
+from model import *
+from sqlite3_engine import SQLite3MemoryEngine
+from meal_storage import MealStorage
+from controllers import MealsController
+from conditions import *
+from utils import today_at
+
+
+class CountingEngine(SQLite3MemoryEngine):
+    """in memory engine counting executed statements"""
+
+    def __init__(self):
+        super().__init__()
+        self.count = 0
+
+
+    def execute(self, sql, bind=(), func=None):
+        self.count += 1
+        return super().execute(sql, bind, func)
+
+
+class TestMealIngredients(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = CountingEngine()
+        self.storage = MealStorage(self.engine)
+        self.storage.init()
+        self.ctrl = MealsController(self.storage)
+
+
+    def add_meal(self, n):
+        meal = Meal(name='obiad', date=today_at('14:00'), meal_ingredients=[
+            MealIngredient(ingredient=Ingredient(name='ingr{}'.format(i), calories=i), quantity=i)
+            for i in range(n)])
+
+        return self.storage.add_meal(meal)
+
+
+    def test_constant_number_of_statements(self):
+        counts = []
+        for n in (1, 5, 20):
+            meal = self.add_meal(n)
+
+            self.engine.count = 0
+            ret = self.ctrl.get_meal_ingredients(meal.id)
+            counts.append(self.engine.count)
+
+            self.assertEqual(len(ret), n)
+            self.assertEqual(sorted(x['ingredient']['name'] for x in ret), sorted('ingr{}'.format(i) for i in range(n)))
+            for x in ret:
+                self.assertEqual(x['meal_id'], meal.id)
+                self.assertEqual(x['ingredient_id'], x['ingredient']['id'])
+
+        self.assertEqual(counts, [1, 1, 1])
+
+
+class TestPagination(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = CountingEngine()
+        self.storage = MealStorage(self.engine)
+        self.storage.init()
+        self.ctrl = MealsController(self.storage)
+
+        self.storage.add_ingredients([Ingredient(name='ingr{}'.format(i), calories=i) for i in range(25)])
+
+
+    def pages(self, get, limit, **kwds):
+        ret, after = [], None
+        while True:
+            page = get(limit=limit, after=after, **kwds)
+            ret.append([x['id'] for x in page['items']])
+            after = page['next']
+            if after is None:
+                return ret
+
+
+    def test_ingredients(self):
+        ids = [x['id'] for x in self.ctrl.get_ingredients()]
+        self.assertEqual(len(ids), 25)
+
+        pages = self.pages(self.ctrl.get_ingredients, 10)
+        self.assertEqual([len(x) for x in pages], [10, 10, 5])
+        self.assertEqual(sum(pages, []), sorted(ids))
+
+        pages = self.pages(self.ctrl.get_ingredients, 5)
+        self.assertEqual([len(x) for x in pages], [5] * 5)
+
+
+    def test_meals(self):
+        for i in range(3):
+            self.storage.add_meal(Meal(name='obiad', date=today_at('14:00')))
+
+        pages = self.pages(self.ctrl.get_meals, 2)
+        self.assertEqual([len(x) for x in pages], [2, 1])
+
+
+    def test_search(self):
+        pages = self.pages(self.ctrl.search, 3, q='ingredients', name='ingr1')
+        self.assertEqual(sum(pages, []), sorted(x.id for x in self.storage.search_ingredients(name='ingr1')))
+        self.assertEqual([len(x) for x in pages], [3, 3, 3, 2])
+
+        self.storage._fts = False
+        pages = self.pages(self.ctrl.search, 3, q='ingredients', name='ingr1')
+        self.assertEqual([len(x) for x in pages], [3, 3, 3, 2])
+
+
+    def test_keyset_query(self):
+        self.engine.count = 0
+        page = self.ctrl.get_ingredients(limit='10', after='5')
+        self.assertEqual(self.engine.count, 1)
+        self.assertEqual(page['items'][0]['id'], 6)
+
+        sql, bind = self.storage.sqlstorage._prep_select('ingredients', Ingredient.columns(), 
+                where(gt('id', 5), order_by('id'), limit(11)))
+        plan = self.engine.execute('EXPLAIN QUERY PLAN ' + sql, bind, lambda cur: cur.fetchall())
+        self.assertIn('INTEGER PRIMARY KEY (rowid>?)', plan[0][-1])
+        self.assertNotIn('OFFSET', sql)
+
+
+    def test_invalid_params(self):
+        self.assertRaises(cherrypy.HTTPError, lambda: self.ctrl.get_ingredients(limit='abc'))
+        self.assertRaises(cherrypy.HTTPError, lambda: self.ctrl.get_ingredients(limit='0'))
+
+
+class TestStreaming(unittest.TestCase):
+
+    def setUp(self):
+        self.storage = MealStorage(SQLite3MemoryEngine())
+        self.storage.init()
+        self.ctrl = MealsController(self.storage)
+
+
+    def test_same_as_list(self):
+        import controllers
+        batch, controllers.STREAM_BATCH_SIZE = controllers.STREAM_BATCH_SIZE, 7
+        try:
+            for n in (0, 1, 7, 20):
+                self.storage.clear()
+                self.storage.add_ingredients([Ingredient(name='ingr{}'.format(i), calories=i) for i in range(n)])
+
+                body = b''.join(self.ctrl.get_ingredients(stream='1'))
+                self.assertEqual(body.decode('utf-8'), json.dumps(self.ctrl.get_ingredients()))
+
+            body = b''.join(self.ctrl.search('ingredients', stream='1', name='ingr1'))
+            self.assertEqual(len(json.loads(body.decode('utf-8'))), 11)
+        finally:
+            controllers.STREAM_BATCH_SIZE = batch
+
+
+    def test_stream_param(self):
+        self.storage.add_ingredients([Ingredient(name='ingr{}'.format(i), calories=i) for i in range(3)])
+
+        for stream in ('0', 'false'):
+            self.assertEqual(self.ctrl.get_ingredients(stream=stream), self.ctrl.get_ingredients())
+            self.assertEqual(self.ctrl.get_meals(stream=stream), [])
+        self.assertIsInstance(self.ctrl.get_ingredients(stream='true'), types.GeneratorType)
+
+        for get in (self.ctrl.get_ingredients, self.ctrl.get_meals, lambda stream: self.ctrl.search('meals', stream=stream)):
+            self.assertRaises(cherrypy.HTTPError, lambda: get(stream='yes'))
+
+
+class TestNutrition(unittest.TestCase):
+
+    def setUp(self):
+        self.storage = MealStorage(SQLite3MemoryEngine())
+        self.storage.init()
+        self.ctrl = MealsController(self.storage)
+
+
+    def test_nutrition(self):
+        self.storage.add_meal(Meal(name='obiad', date=today_at('14:00'), meal_ingredients=[
+            MealIngredient(ingredient=Ingredient(name='ryż', calories=350, carbo=78), quantity=200)]))
+
+        ret = self.ctrl.get_nutrition()
+        self.assertEqual(len(ret), 1)
+        self.assertEqual(ret[0]['calories'], 700)
+        self.assertEqual(ret[0]['carbo'], 156)
+
+        self.assertEqual(self.ctrl.get_nutrition(**{'from': '2001-01-01', 'to': '2001-12-31'}), [])
+        self.assertEqual(len(self.ctrl.get_nutrition('month')), 1)
+
+
+    def test_invalid_params(self):
+        self.assertRaises(cherrypy.HTTPError, lambda: self.ctrl.get_nutrition('year'))
+        self.assertRaises(cherrypy.HTTPError, lambda: self.ctrl.get_nutrition(**{'from': '01.01.2001'}))
+
+
+class TestConditionalGet(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = CountingEngine()
+        self.storage = MealStorage(self.engine)
+        self.storage.init()
+        self.ctrl = MealsController(self.storage)
+        self.storage.add_ingredients([Ingredient(name='ingr{}'.format(i), calories=i) for i in range(5)])
+
+
+    def tearDown(self):
+        cherrypy.serving.request.headers.pop('If-None-Match', None)
+        cherrypy.serving.response.headers.pop('ETag', None)
+
+
+    def get(self, handler, etag=None, **kwds):
+        """(status, etag) of conditional request"""
+        cherrypy.serving.request.headers.pop('If-None-Match', None)
+        if etag is not None:
+            cherrypy.serving.request.headers['If-None-Match'] = etag
+
+        try:
+            handler(**kwds)
+            status = 200
+        except cherrypy.HTTPRedirect as e:
+            status = e.status
+
+        return status, cherrypy.serving.response.headers['ETag']
+
+
+    def test_not_modified(self):
+        status, etag = self.get(self.ctrl.get_ingredients)
+        self.assertEqual(status, 200)
+
+        self.engine.count = 0
+        self.assertEqual(self.get(self.ctrl.get_ingredients, etag), (304, etag))
+        self.assertEqual(self.get(self.ctrl.get_ingredients, 'W/' + etag), (304, etag))
+        self.assertEqual(self.get(self.ctrl.get_ingredients, '"other", ' + etag, limit='2'), (304, etag))
+        self.assertEqual(self.engine.count, 0)
+
+        self.assertEqual(self.get(self.ctrl.get_ingredients, '"other"')[0], 200)
+
+
+    def test_writes_change_etag(self):
+        _, ingredients = self.get(self.ctrl.get_ingredients)
+        _, meals = self.get(self.ctrl.get_meals)
+
+        ingredient = self.storage.get_ingredient(1)
+        ingredient.calories = 100
+        self.storage.update_ingredient(ingredient)
+        self.assertEqual(self.get(self.ctrl.get_ingredients, ingredients)[0], 200)
+        self.assertEqual(self.get(self.ctrl.get_meals, meals), (304, meals))
+
+        self.storage.add_meal(Meal(name='obiad', date=today_at('14:00'), meal_ingredients=[
+            MealIngredient(ingredient=Ingredient(name='ryż'), quantity=100)]))
+        self.assertEqual(self.get(self.ctrl.get_meals, meals)[0], 200)
+
+        _, meals = self.get(self.ctrl.get_meals)
+        self.storage.delete_meal(id=1)
+        self.assertEqual(self.get(self.ctrl.get_meals, meals)[0], 200)
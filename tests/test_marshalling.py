@@ -5,7 +5,7 @@ from datetime import datetime
 
 sys.path.append('../')
 
-from meta import fields, JsonObject, post_load, MarshallError, InvalidFieldsError
+from meta import fields, JsonObject, post_load, MarshallError, InvalidFieldsError, attrs
 from model import *
 
 
@@ -99,7 +99,7 @@ class TestSimpleClassesMarshalling(unittest.TestCase):
     def test_class_2_object(self):
         a = Test.load({'name':'hello'})
         self.assertEqual(a.name, 'hello')
-        test_vars = vars(a)
+        test_vars = attrs(a)
         self.assertEqual(len(test_vars), 2)
         self.assertIn('name', test_vars)
         self.assertIn('date', test_vars)
@@ -112,14 +112,14 @@ class TestSimpleClassesMarshalling(unittest.TestCase):
     def test_class_2_text(self):
         a = Test.loads('{"name":"hello"}')
         self.assertEqual(a.name, 'hello')
-        test_vars = vars(a)
+        test_vars = attrs(a)
         self.assertEqual(len(test_vars), 2)
         self.assertIn('date', test_vars)
         self.assertIn('name', test_vars)
 
         a = Test.load('{"name":"hello"}')
         self.assertEqual(a.name, 'hello')
-        test_vars = vars(a)
+        test_vars = attrs(a)
         self.assertEqual(len(test_vars), 2)
         self.assertIn('date', test_vars)
         self.assertIn('name', test_vars)
@@ -127,7 +127,7 @@ class TestSimpleClassesMarshalling(unittest.TestCase):
 
         a = Test.load('{"date":"2010-11-22 22:59"}')
         self.assertEqual(a.date, datetime(2010, 11, 22, 22, 59))
-        test_vars = vars(a)
+        test_vars = attrs(a)
         self.assertEqual(len(test_vars), 1)
         self.assertIn('date', test_vars)
 
@@ -186,3 +186,138 @@ class TestSimpleNestedList(unittest.TestCase):
         test_dic = json.loads(test_text) # load text to dic with standard json lib
 
         self.assertEqual(test_dic, dic)
+
+
+class TestMany(unittest.TestCase):
+
+    def test_load_many(self):
+        dics = [{'id': i, 'name': 'due{}'.format(i), 'unos': [{'name': 'uno', 'date': '2010-10-30 22:15'}]} for i in range(3)]
+
+        test = Due.load_many(dics)
+        self.assertEqual(len(test), 3)
+        self.assertEqual([x.id for x in test], [0, 1, 2])
+        self.assertEqual(test[2].unos[0].date, datetime(2010, 10, 30, 22, 15))
+
+        self.assertRaises(MarshallError, lambda: Test.load_many([{'email': 'test@test.com'}, {'email': 'test'}]))
+
+
+    def test_dump_many(self):
+        objs = [Test(id=i, name='test', date=datetime(2010, 10, 20, 23, 59)) for i in range(3)]
+
+        test = Test.dump_many(objs)
+        self.assertEqual(test, [x.dump() for x in objs])
+
+        test = Test.dump_many(objs, ignore=('id',))
+        self.assertEqual(test, [x.dump(ignore=('id',)) for x in objs])
+        self.assertNotIn('id', test[0])
+
+
+    def test_threads(self):
+        import threading
+
+        errors = []
+        def work():
+            try:
+                for i in range(200):
+                    self.assertEqual(Due.load({'id': i, 'unos': [{'name': 'uno'}]}).dump(), {'id': i, 'unos': [{'name': 'uno'}]})
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+
+        self.assertEqual(errors, [])
+
+
+class TrustedPath(object):
+    """run tests of mixed in TestCase with generated (trusted) serializers"""
+
+    classes = (Test, ParamsHolder, Uno, Due, Ingredient, MealIngredient, Meal)
+
+    def setUp(self):
+        self.saved = []
+        for cls in self.classes:
+            load, loads, dump, dumps = cls.load, cls.loads, cls.dump, cls.dumps
+            self.saved.append((cls, load, loads, dump, dumps))
+
+            cls.load = lambda data, load=load: load(data, trusted=True)
+            cls.loads = lambda data, loads=loads: loads(data, trusted=True)
+            cls.dump = lambda self, ignore=None, dump=dump: dump(self, ignore, trusted=True)
+            cls.dumps = lambda self, dumps=dumps: dumps(self, trusted=True)
+
+
+    def tearDown(self):
+        for cls, load, loads, dump, dumps in self.saved:
+            cls.load, cls.loads, cls.dump, cls.dumps = load, loads, dump, dumps
+
+
+class TestSimpleMarshallingTrusted(TrustedPath, TestSimpleMarshalling):
+    pass
+
+
+class TestSimpleClassesMarshallingTrusted(TrustedPath, TestSimpleClassesMarshalling):
+    pass
+
+
+class TestSimpleNestedListTrusted(TrustedPath, TestSimpleNestedList):
+    pass
+
+
+class TestGeneratedSerializers(unittest.TestCase):
+
+    def meal(self):
+        return Meal(id=1, name='obiad', date=datetime(2001, 12, 1, 15, 45), meal_ingredients=[
+            MealIngredient(id=2, meal_id=1, ingredient_id=3, quantity=60, 
+                ingredient=Ingredient(id=3, name='jajka', calories=139, protein=12.5, carbo=0.6, fats=9.7)),
+            MealIngredient(id=4, meal_id=1, ingredient_id=5, quantity=15)])
+
+
+    def test_generated(self):
+        self.assertIsNotNone(Meal._schema._fast_dump)
+        self.assertIsNotNone(Meal._schema._fast_load)
+
+        # email field is not supported by generated code
+        self.assertIsNone(Test._schema._fast_dump)
+
+
+    def test_same_output(self):
+        meal = self.meal()
+        self.assertEqual(json.dumps(meal.dump(trusted=True)), json.dumps(meal.dump()))
+        self.assertEqual(meal.dumps(trusted=True), meal.dumps())
+        self.assertEqual(json.dumps(Meal.dump_many([meal, Meal()], trusted=True)), json.dumps(Meal.dump_many([meal, Meal()])))
+
+        dic = meal.dump()
+        self.assertEqual(repr(Meal.load(dic, trusted=True)), repr(Meal.load(dic)))
+        self.assertEqual(repr(Meal.load_many([dic, {}], trusted=True)), repr(Meal.load_many([dic, {}])))
+
+
+    def test_invalid_data_falls_back(self):
+        self.assertRaises(MarshallError, lambda: Ingredient.load({'id': 'abc'}, trusted=True))
+        self.assertRaises(MarshallError, lambda: Ingredient.load({'name': None}, trusted=True))
+        self.assertRaises(MarshallError, lambda: Meal.load_many([{'date': '2001-12-01'}], trusted=True))
+
+
+class TestCompactInstances(unittest.TestCase):
+
+    def test_slots(self):
+        ingr = Ingredient(id=1, name='jajka')
+        self.assertFalse(hasattr(ingr, '__dict__'))
+        self.assertFalse(hasattr(ingr, 'calories'))
+        self.assertEqual(attrs(ingr), {'id': 1, 'name': 'jajka'})
+        self.assertRaises(AttributeError, lambda: setattr(ingr, 'invalid', True))
+
+
+    def test_from_rows(self):
+        columns = Meal.columns()
+        rows = [(1, 'obiad', '2001-12-01 15:45'), (2, 'kolacja', '2001-12-01 19:00')]
+        dics = [dict(zip(columns, row)) for row in rows]
+
+        test = Meal.from_rows(columns, rows)
+        self.assertEqual(repr(test), repr(Meal.load_many(dics)))
+        self.assertEqual(test[0].date, datetime(2001, 12, 1, 15, 45))
+        self.assertEqual(test[1].meal_ingredients, [])
+
+
+    def test_from_rows_invalid(self):
+        self.assertRaises(MarshallError, lambda: Ingredient.from_rows(('id', 'name'), [(1, None)]))
@@ -1,14 +1,20 @@
+import os
 import unittest
 import sys
 import json
+import sqlite3
+import tempfile
+import threading
+from functools import partial
 from datetime import datetime
 
 sys.path = ['../'] + sys.path
 
 from model import *
-from sqlite3_engine import SQLite3MemoryEngine
+from sqlite3_engine import SQLite3MemoryEngine, SQLite3PooledEngine
 from meal_storage import MealStorage
 from conditions import *
+from meal_storage import MIGRATIONS
 from utils import first, today_at
 
 class TestAddObjects(unittest.TestCase):
@@ -178,6 +184,25 @@ class TestAddNestedObjects(unittest.TestCase):
             self.assertNotEqual(ingr.id, None)
 
 
+    def test_retry_failed_add_meal(self):
+        ingredient = Ingredient(name='jajka', calories=139)
+        meal = Meal(name='śniadanie', date=today_at('9:00'), meal_ingredients=[
+            MealIngredient(ingredient=ingredient, quantity=None)])
+
+        self.assertRaises(sqlite3.IntegrityError, lambda: self.storage.add_meal(meal))
+        # nothing stored, so no ids either
+        self.assertFalse(hasattr(meal, 'id'))
+        self.assertFalse(hasattr(ingredient, 'id'))
+        self.assertFalse(hasattr(meal.meal_ingredients[0], 'meal_id'))
+
+        meal.meal_ingredients[0].quantity = 60
+        self.storage.add_meal(meal)
+
+        mis = self.storage.get_meal_ingredients_with_ingredient(meal_id=meal.id)
+        self.assertEqual([x.ingredient.name for x in mis], ['jajka'])
+        self.assertEqual(mis[0].ingredient_id, ingredient.id)
+
+
     def test_add_meal_with_new_ingredients(self):
         ingredients = self.create_some_ingredients()
 
@@ -238,3 +263,498 @@ class TestAddNestedObjects(unittest.TestCase):
 
         test_m = list(self.storage.get_meals())
         self.assertEqual(len(test_m), 1)
+
+
+    def test_add_meal_all_or_nothing(self):
+        ingredients = self.create_some_ingredients()
+
+        meal = Meal(name='śniadanie', date=today_at('9:00'), meal_ingredients=[
+            MealIngredient(ingredient=ingredients[0], quantity=60),
+            MealIngredient(ingredient=ingredients[1], quantity=None)
+        ])
+
+        self.assertRaises(Exception, lambda: self.storage.add_meal(meal))
+
+        self.assertEqual(len(self.storage.get_meal_ingredients()), 0)
+        self.assertEqual(len(self.storage.get_ingredients()), 0)
+        self.assertEqual(len(self.storage.get_meals()), 0)
+
+
+class TestMigrations(unittest.TestCase):
+
+    def setUp(self):
+        self.storage = MealStorage(SQLite3MemoryEngine())
+        self.storage.init()
+
+
+    def query_plan(self, table, conds, storage=None):
+        storage = storage or self.storage
+        sql, bind = storage.sqlstorage._prep_select(table, (), conds)
+        rows = storage.sqlstorage.engine.execute('EXPLAIN QUERY PLAN ' + sql, bind, lambda cur: cur.fetchall())
+        return ' '.join(row[-1] for row in rows)
+
+
+    def test_version(self):
+        self.assertEqual(self.storage.version(), len(MIGRATIONS))
+
+        self.storage.init() # noop on up to date database
+        self.assertEqual(self.storage.version(), len(MIGRATIONS))
+
+        self.storage.delete()
+        self.assertEqual(self.storage.version(), 0)
+
+
+    def test_upgrade_unversioned_database(self):
+        storage = MealStorage(SQLite3MemoryEngine())
+        storage.sqlstorage.execute_ddl(MIGRATIONS[0])
+        added = storage.add_ingredient(Ingredient(name='test', calories=1.1))
+        self.assertEqual(storage.version(), 0)
+
+        storage.init()
+        self.assertEqual(storage.version(), len(MIGRATIONS))
+        self.assertEqual(storage.get_ingredient(added.id).name, 'test')
+        self.assertIn('idx_ingredients_name', self.query_plan('ingredients', where(eq('name', 'test')), storage))
+
+
+    def test_meal_ingredients_meal_id_index(self):
+        self.assertIn('idx_meal_ingredients_meal_id', self.query_plan('meal_ingredients', where(eq('meal_id', 1))))
+
+
+    def test_meal_ingredients_ingredient_id_index(self):
+        self.assertIn('idx_meal_ingredients_ingredient_id', self.query_plan('meal_ingredients', where(eq('ingredient_id', 1))))
+
+
+    def test_meals_date_index(self):
+        self.assertIn('idx_meals_date', self.query_plan('meals', where(eq('date', '2001-12-01 15:45'))))
+        self.assertIn('idx_meals_date', self.query_plan('meals', where(gt('date', '2001-12-01'), lt('date', '2001-12-31'))))
+
+
+    def test_ingredients_name_index(self):
+        self.assertIn('idx_ingredients_name', self.query_plan('ingredients', where(eq('name', 'jajka'))))
+
+
+class TestSearch(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.storage = MealStorage(SQLite3MemoryEngine())
+        cls.storage.init()
+
+
+    def setUp(self):
+        self.storage.clear()
+        self.storage.add_ingredients([
+            Ingredient(name='jajka kurze', calories=139),
+            Ingredient(name='łosoś wędzony', calories=162),
+            Ingredient(name='jajka przepiórcze jajka', calories=158),
+            Ingredient(name='avocado', calories=160)])
+
+
+    def names(self, ingredients):
+        return [x.name for x in ingredients]
+
+
+    def test_prefix_match(self):
+        self.assertTrue(self.storage.has_fts())
+        self.assertEqual(self.names(self.storage.search_ingredients(name='wędz')), ['łosoś wędzony'])
+        self.assertEqual(self.names(self.storage.search_ingredients(name='jaj kur')), ['jajka kurze'])
+        self.assertEqual(self.names(self.storage.search_ingredients(name='ocado')), [])
+
+
+    def test_ranking(self):
+        self.assertEqual(self.names(self.storage.search_ingredients(name='jajka')), ['jajka przepiórcze jajka', 'jajka kurze'])
+
+
+    def test_triggers(self):
+        ingr = first(self.storage.search_ingredients(name='avocado'))
+        ingr.name = 'awokado'
+        self.storage.update_ingredient(ingr)
+        self.assertEqual(self.names(self.storage.search_ingredients(name='avoc')), [])
+        self.assertEqual(self.names(self.storage.search_ingredients(name='awok')), ['awokado'])
+
+        self.storage.delete_ingredient(id=ingr.id)
+        self.assertEqual(self.names(self.storage.search_ingredients(name='awok')), [])
+
+        self.storage.add_meal(Meal(name='obiad', date=today_at('14:00')))
+        self.assertEqual(self.names(self.storage.search_meals(name='obi')), ['obiad'])
+
+
+    def test_like_fallback(self):
+        self.storage._fts = False
+        try:
+            self.assertEqual(self.names(self.storage.search_ingredients(name='ocado')), ['avocado'])
+        finally:
+            self.storage._fts = None
+
+
+class TestNutrition(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.storage = MealStorage(SQLite3MemoryEngine())
+        cls.storage.init()
+
+
+    def setUp(self):
+        self.storage.clear()
+        self.eggs, self.avocado = self.storage.add_ingredients([
+            Ingredient(name='jajka', calories=140, protein=12, carbo=0.5, fats=10),
+            Ingredient(name='avocado', calories=160, veg_protein=2, carbo=8, fats=15)])
+
+
+    def add_meal(self, date, eggs, avocado):
+        return self.storage.add_meal(Meal(name='posiłek', date=date, meal_ingredients=[
+            MealIngredient(ingredient=self.eggs, quantity=eggs),
+            MealIngredient(ingredient=self.avocado, quantity=avocado)]))
+
+
+    def nutrition(self, bucket='day', start='2001-01-01', end='2001-12-31'):
+        return dict((x[bucket], (round(x['calories'], 6), round(x['protein'], 6), round(x['fats'], 6))) 
+                for x in self.storage.get_nutrition(start, end, bucket))
+
+
+    def assertRebuildSame(self):
+        incremental = self.nutrition()
+        self.storage.rebuild_nutrition()
+        self.assertEqual(dict((k, v) for k, v in incremental.items() if any(v)), self.nutrition())
+
+
+    def test_incremental(self):
+        self.add_meal(datetime(2001, 12, 3, 9, 0), 100, 50)
+        meal = self.add_meal(datetime(2001, 12, 3, 19, 0), 50, 0)
+        self.add_meal(datetime(2001, 12, 4, 9, 0), 200, 100)
+
+        self.assertEqual(self.nutrition(), {
+            '2001-12-03': (290.0, 18.0, 22.5),
+            '2001-12-04': (440.0, 24.0, 35.0)})
+        self.assertRebuildSame()
+
+        self.eggs.calories = 100
+        self.storage.update_ingredient(self.eggs)
+        self.assertEqual(self.nutrition()['2001-12-03'], (230.0, 18.0, 22.5))
+        self.assertRebuildSame()
+
+        self.storage.delete_meal_ingredient(id=meal.meal_ingredients[0].id)
+        self.assertEqual(self.nutrition()['2001-12-03'], (180.0, 12.0, 17.5))
+        self.assertRebuildSame()
+
+        self.storage.delete_meal(date='2001-12-04 09:00')
+        self.assertEqual(self.nutrition()['2001-12-04'], (0.0, 0.0, 0.0))
+        self.assertRebuildSame()
+
+        self.storage.delete_ingredient(id=self.avocado.id)
+        self.assertEqual(self.nutrition()['2001-12-03'], (100.0, 12.0, 10.0))
+        self.assertRebuildSame()
+
+
+    def test_meal_without_ingredients(self):
+        meal = self.storage.add_meal(Meal(name='pusty', date=datetime(2001, 5, 1, 9, 0)))
+        self.storage.sqlstorage.update('meals', {'date': '2001-05-02 09:00'}, where(eq('id', meal.id)))
+        self.storage.delete_meal(id=meal.id)
+
+        # no ingredients - no rows, not even empty ones
+        self.assertEqual(self.nutrition(), {})
+
+
+    def test_buckets(self):
+        self.add_meal(datetime(2001, 12, 2, 9, 0), 100, 0) # sunday
+        self.add_meal(datetime(2001, 12, 3, 9, 0), 100, 0) # monday
+        self.add_meal(datetime(2001, 12, 9, 9, 0), 100, 0)
+        self.add_meal(datetime(2002, 1, 1, 9, 0), 100, 0)
+
+        self.assertEqual(self.nutrition('week', end='2002-12-31'), {
+            '2001-11-26': (140.0, 12.0, 10.0),
+            '2001-12-03': (280.0, 24.0, 20.0),
+            '2001-12-31': (140.0, 12.0, 10.0)})
+
+        self.assertEqual(self.nutrition('month', end='2002-12-31'), {
+            '2001-12-01': (420.0, 36.0, 30.0),
+            '2002-01-01': (140.0, 12.0, 10.0)})
+
+        self.assertEqual(self.nutrition('day', '2001-12-03', '2001-12-09'), {
+            '2001-12-03': (140.0, 12.0, 10.0),
+            '2001-12-09': (140.0, 12.0, 10.0)})
+
+
+    def test_reads_rollup_by_day(self):
+        sql, bind = self.storage.sqlstorage._prep_select('nutrition_daily', ('day',), where(between('day', '2001-01-01', '2001-12-31')))
+        plan = self.storage.sqlstorage.engine.execute('EXPLAIN QUERY PLAN ' + sql, bind, lambda cur: cur.fetchall())
+        self.assertIn('day>? AND day<?', plan[0][-1])
+
+
+class TestIngredientCache(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0
+        self.storage = MealStorage(SQLite3MemoryEngine(), ingredient_cache_size=2, ingredient_cache_ttl=10)
+        self.storage.ingredient_cache.clock = lambda: self.now
+        self.storage.init()
+
+        self.ingredients = self.storage.add_ingredients([Ingredient(name='ingr{}'.format(i), calories=i) for i in range(3)])
+        self.ids = [x.id for x in self.ingredients]
+
+
+    def stats(self):
+        return self.storage.ingredient_cache.stats()
+
+
+    def test_hits_and_copies(self):
+        test = self.storage.get_ingredient(self.ids[0])
+        self.assertEqual(self.stats(), dict(hits=0, misses=1, evictions=0, size=1))
+
+        test.name = 'changed'
+        again = self.storage.get_ingredient(str(self.ids[0]))
+        self.assertEqual(self.stats(), dict(hits=1, misses=1, evictions=0, size=1))
+        self.assertEqual(again.name, 'ingr0')
+        self.assertIsNot(again, test)
+
+        self.assertIsNone(self.storage.get_ingredient('abc'))
+
+
+    def test_eviction_and_ttl(self):
+        for id_ in self.ids:
+            self.storage.get_ingredient(id_)
+        self.assertEqual(self.stats(), dict(hits=0, misses=3, evictions=1, size=2))
+
+        self.storage.get_ingredient(self.ids[2])
+        self.assertEqual(self.stats()['hits'], 1)
+
+        self.now = 11
+        self.storage.get_ingredient(self.ids[2])
+        self.assertEqual(self.stats()['misses'], 4)
+
+
+    def test_invalidation(self):
+        test = self.storage.get_ingredient(self.ids[0])
+        test.calories = 100
+        self.storage.update_ingredient(test)
+        self.assertEqual(self.storage.get_ingredient(self.ids[0]).calories, 100)
+
+        self.storage.delete_ingredient(id=self.ids[0])
+        self.assertIsNone(self.storage.get_ingredient(self.ids[0]))
+
+        self.storage.get_ingredient(self.ids[1])
+        self.storage.delete_ingredient(like('name', 'ingr%'))
+        self.assertIsNone(self.storage.get_ingredient(self.ids[1]))
+
+
+    def test_stale_read_not_cached(self):
+        cache = self.storage.ingredient_cache
+        generation = cache.generation()
+        cache.invalidate(self.ids[0])
+        cache.put(self.ids[0], self.ingredients[0], generation)
+        self.assertIsNone(cache.get(self.ids[0]))
+
+
+class TestIngredientCacheTransaction(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.engine = SQLite3PooledEngine(os.path.join(self.tmpdir.name, 'test.db'))
+        self.storage = MealStorage(self.engine)
+        self.storage.init()
+        self.ingredient = self.storage.add_ingredient(Ingredient(name='stary'))
+
+
+    def tearDown(self):
+        self.engine.close()
+        self.tmpdir.cleanup()
+
+
+    def concurrent_read(self):
+        t = threading.Thread(target=lambda: self.storage.get_ingredient(self.ingredient.id))
+        t.start()
+        t.join()
+
+
+    def test_update_in_transaction(self):
+        with self.storage.sqlstorage.transaction():
+            self.storage.update_ingredient(Ingredient(id=self.ingredient.id, name='nowy'))
+            # other thread reads (and caches) committed row
+            self.concurrent_read()
+
+        self.assertEqual(self.storage.get_ingredient(self.ingredient.id).name, 'nowy')
+
+
+    def test_delete_in_transaction(self):
+        with self.storage.sqlstorage.transaction():
+            self.storage.delete_ingredient(id=self.ingredient.id)
+            self.concurrent_read()
+
+        self.assertIsNone(self.storage.get_ingredient(self.ingredient.id))
+
+
+class TestTableVersions(unittest.TestCase):
+
+    def setUp(self):
+        self.storage = MealStorage(SQLite3MemoryEngine())
+        self.storage.init()
+
+
+    def test_bumped_on_write(self):
+        tables = ('ingredients', 'meals', 'meal_ingredients')
+        v = self.storage.table_versions(*tables)
+
+        ingredient = self.storage.add_ingredient(Ingredient(name='ryż'))
+        v, prev = self.storage.table_versions(*tables), v
+        self.assertEqual((v[0] > prev[0], v[1:]), (True, prev[1:]))
+
+        self.storage.add_meal(Meal(name='obiad', date=today_at('14:00'), meal_ingredients=[
+            MealIngredient(ingredient_id=ingredient.id, quantity=100)]))
+        v, prev = self.storage.table_versions(*tables), v
+        self.assertEqual((v[0], v[1] > prev[1], v[2] > prev[2]), (prev[0], True, True))
+
+        self.storage.delete_meal_ingredient(meal_id=1)
+        v, prev = self.storage.table_versions(*tables), v
+        self.assertEqual((v[:2], v[2] > prev[2]), (prev[:2], True))
+
+        etag = self.storage.etag(*tables)
+        self.storage.clear()
+        self.assertNotEqual(self.storage.etag(*tables), etag)
+
+
+    def test_bumped_after_commit(self):
+        seen = []
+        with self.storage.sqlstorage.transaction():
+            self.storage.add_ingredient(Ingredient(name='ryż'))
+            seen.append(self.storage.table_versions('ingredients'))
+        self.assertEqual(seen, [(0,)])
+        self.assertEqual(self.storage.table_versions('ingredients'), (1,))
+
+
+class TestBatchWrites(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.engine = SQLite3PooledEngine(os.path.join(self.tmpdir.name, 'test.db'))
+        self.storage = MealStorage(self.engine, batch_writes=True, batch_max_delay=0.05)
+        self.storage.init()
+
+
+    def tearDown(self):
+        self.storage.close()
+        self.engine.close()
+        self.tmpdir.cleanup()
+
+
+    def concurrently(self, funcs):
+        """call funcs from threads at once, return (result, error) of every func"""
+        ret = [None] * len(funcs)
+
+        def call(i):
+            try:
+                ret[i] = (funcs[i](), None)
+            except Exception as e:
+                ret[i] = (None, e)
+
+        threads = [threading.Thread(target=call, args=(i,)) for i in range(len(funcs))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        return ret
+
+
+    def test_own_ids(self):
+        ingredients = [Ingredient(name='ingr{}'.format(i), calories=i) for i in range(20)]
+        ret = self.concurrently([partial(self.storage.add_ingredient, x) for x in ingredients])
+
+        self.assertEqual([e for _, e in ret], [None] * 20)
+        self.assertEqual(sorted(x.id for x in ingredients), list(range(1, 21)))
+        for x in ingredients:
+            self.assertEqual(self.storage.get_ingredient(x.id).name, x.name)
+
+        self.assertLess(self.storage.write_queue.batches, 20)
+        self.assertEqual(self.storage.write_queue.writes, 20)
+
+
+    def test_own_errors(self):
+        meals = [Meal(name='obiad{}'.format(i), date=today_at('14:00'), meal_ingredients=[
+            MealIngredient(ingredient=Ingredient(name='ingr{}'.format(i)), quantity=1)]) for i in range(5)]
+        # meal ingredient without quantity violates NOT NULL, whole meal is rolled back
+        meals[2].meal_ingredients = [MealIngredient(ingredient=Ingredient(name='ingr2'))]
+
+        ret = self.concurrently([partial(self.storage.add_meal, x) for x in meals])
+
+        errors = [e for _, e in ret]
+        self.assertIsInstance(errors[2], sqlite3.IntegrityError)
+        self.assertEqual(errors[:2] + errors[3:], [None] * 4)
+        self.assertEqual(sorted(x.name for x in self.storage.get_meals()), ['obiad0', 'obiad1', 'obiad3', 'obiad4'])
+        self.assertEqual(len(self.storage.get_meal_ingredients()), 4)
+        self.assertEqual(len(self.storage.get_ingredients()), 4)
+
+
+    def test_caller_transaction(self):
+        with self.assertRaises(RuntimeError):
+            with self.storage.sqlstorage.transaction():
+                self.storage.add_ingredient(Ingredient(name='ryż'))
+                raise RuntimeError()
+
+        self.assertEqual(self.storage.get_ingredients(), [])
+        self.assertEqual(self.storage.write_queue.writes, 0)
+
+
+    def test_base_exception(self):
+        queue = self.storage.write_queue
+
+        def exit():
+            raise SystemExit()
+
+        # only caller of work gets it, writer goes on
+        self.assertRaises(SystemExit, lambda: queue.submit(exit))
+        self.storage.add_ingredient(Ingredient(name='ryż'))
+
+        # writer dying fails waiting writes instead of leaving them blocked
+        commit, queue._commit = queue._commit, lambda batch: exit()
+        ret = []
+        thread = threading.Thread(target=lambda: ret.extend(self.concurrently([lambda: queue.submit(lambda: 1)])))
+        thread.start()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertIsInstance(ret[0][1], RuntimeError)
+
+        queue._commit = commit
+        self.storage.add_ingredient(Ingredient(name='kurczak'))
+        self.assertEqual(len(self.storage.get_ingredients()), 2)
+
+
+class TestExternalWrites(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        path = os.path.join(self.tmpdir.name, 'test.db')
+        # storages of two worker processes
+        self.engines = SQLite3PooledEngine(path), SQLite3PooledEngine(path)
+        self.storage = MealStorage(self.engines[0], external_writes=True)
+        self.other = MealStorage(self.engines[1])
+        self.storage.init()
+
+
+    def tearDown(self):
+        for engine in self.engines:
+            engine.close()
+        self.tmpdir.cleanup()
+
+
+    def test_other_process(self):
+        ingredient = self.storage.add_ingredient(Ingredient(name='stary'))
+        self.assertEqual(self.storage.get_ingredient(ingredient.id).name, 'stary')
+        etag = self.storage.etag('ingredients')
+        self.assertEqual(self.storage.etag('ingredients'), etag)
+
+        self.other.update_ingredient(Ingredient(id=ingredient.id, name='nowy'))
+
+        self.assertNotEqual(self.storage.etag('ingredients'), etag)
+        self.assertEqual(self.storage.get_ingredient(ingredient.id).name, 'nowy')
+
+
+    def test_new_thread(self):
+        etag = self.storage.etag('meals')
+        other = []
+        t = threading.Thread(target=lambda: other.append(self.storage.etag('meals')))
+        t.start()
+        t.join()
+
+        # thread can't tell what changed before it first looked
+        self.assertNotEqual(other[0], etag)
@@ -0,0 +1,107 @@
+import sys
+import sqlite3
+import unittest
+
+sys.path.append('../')
+
+from model import *
+from conditions import *
+from sqlite3_engine import SQLite3MemoryEngine
+from meal_storage import MealStorage
+from metrics import SQLMetrics, RequestMetrics, Histogram, exposition
+from controllers import MetricsController
+
+
+class TestSQLMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = SQLMetrics()
+        self.engine = SQLite3MemoryEngine()
+        self.storage = MealStorage(self.engine)
+        self.storage.init()
+        self.engine.instrument(self.metrics)
+
+
+    def stats(self, prefix):
+        return [v for k, v in self.metrics.stats().items() if k.startswith(prefix)]
+
+
+    def test_per_shape(self):
+        self.storage.add_ingredients([Ingredient(name='ingr{}'.format(i)) for i in range(5)])
+        for i in range(1, 4):
+            self.storage.get_ingredients(id=i)
+        self.storage.get_ingredients()
+
+        selects = sorted(self.stats('SELECT'), key=lambda x: x['count'])
+        self.assertEqual([(x['count'], x['rows']) for x in selects], [(1, 5), (3, 3)])
+        self.assertEqual(self.stats('INSERT')[0]['rows'], 5)
+        self.assertGreater(selects[1]['total'], 0)
+        self.assertGreaterEqual(selects[1]['total'], selects[1]['max'])
+
+
+    def test_in_lists(self):
+        self.storage.add_ingredients([Ingredient(name='ingr{}'.format(i)) for i in range(5)])
+        for i in range(1, 6):
+            self.storage.get_ingredients(in_('id', range(i)))
+
+        shapes = [k for k in self.metrics.stats() if ' IN ' in k]
+        self.assertEqual(len(shapes), 1)
+        self.assertIn('IN (?...)', shapes[0])
+        self.assertEqual(self.metrics.stats()[shapes[0]]['count'], 5)
+
+
+    def test_errors(self):
+        self.assertRaises(sqlite3.OperationalError, lambda: self.engine.execute('SELECT * FROM nope'))
+        stats = self.stats('SELECT * FROM nope')[0]
+        self.assertEqual((stats['count'], stats['errors'], stats['rows']), (1, 1, 0))
+
+
+    def test_slow_query_log(self):
+        self.metrics.slow_query_time = 0
+        with self.assertLogs('eatwatch.sql.slow') as logs:
+            self.storage.get_ingredients(name='secret')
+        self.assertIn("('str',)", logs.output[0])
+        self.assertNotIn('secret', logs.output[0])
+
+        self.metrics.redact = None
+        with self.assertLogs('eatwatch.sql.slow') as logs:
+            self.storage.get_ingredients(name='secret')
+        self.assertIn('secret', logs.output[0])
+
+
+    def test_ddl_literals(self):
+        self.engine.execute_ddl(("INSERT INTO ingredients(name) VALUES('a')", "INSERT INTO ingredients(name) VALUES('b')"))
+        self.assertEqual(self.stats('INSERT INTO ingredients(name) VALUES(?)')[0]['count'], 2)
+
+
+class TestExposition(unittest.TestCase):
+
+    def test_histogram(self):
+        histogram = Histogram((0.1, 1))
+        for x in (0.05, 0.5, 0.7, 5):
+            histogram.observe(x)
+
+        self.assertEqual(histogram.lines('h', (('a', 'x"y'),)), [
+            'h_bucket{a="x\\"y",le="0.1"} 1',
+            'h_bucket{a="x\\"y",le="1"} 3',
+            'h_bucket{a="x\\"y",le="+Inf"} 4',
+            'h_sum{a="x\\"y"} 6.25',
+            'h_count{a="x\\"y"} 4'])
+
+
+    def test_exposition(self):
+        sql, requests = SQLMetrics(), RequestMetrics()
+        sql.record('SELECT 1', (), 0.002, 1)
+        requests.record('get_meals', 'GET', '200', 0.01)
+        requests.record('get_meals', 'GET', '304', 0.001)
+
+        text = exposition(sql, requests)
+        self.assertIn('# TYPE eatwatch_sql_duration_seconds histogram\n', text)
+        self.assertIn('eatwatch_sql_statements_total{statement="SELECT 1"} 1\n', text)
+        self.assertIn('eatwatch_http_requests_total{route="get_meals",method="GET",status="304"} 1\n', text)
+        self.assertIn('eatwatch_http_request_duration_seconds_count{route="get_meals",method="GET"} 2\n', text)
+
+
+    def test_handler(self):
+        body = MetricsController().metrics().decode('utf-8')
+        self.assertIn('# TYPE eatwatch_http_requests_total counter', body)
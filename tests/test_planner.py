@@ -0,0 +1,99 @@
+import sys
+import unittest
+
+import cherrypy
+
+sys.path.append('../')
+
+from model import *
+from sqlite3_engine import SQLite3MemoryEngine
+from meal_storage import MealStorage
+from controllers import MealsController
+import planner
+
+
+@unittest.skipIf(planner.np is None, 'numpy not installed')
+class TestPlanner(unittest.TestCase):
+
+    def setUp(self):
+        self.storage = MealStorage(SQLite3MemoryEngine())
+        self.storage.init()
+        # per 100g
+        self.rice, self.chicken, self.oil = self.storage.add_ingredients([
+            Ingredient(name='ryż', calories=350, protein=7, carbo=78, fats=1),
+            Ingredient(name='kurczak', calories=110, protein=23, carbo=0, fats=1.5),
+            Ingredient(name='olej', calories=880, protein=0, carbo=0, fats=100)])
+        self.matrix = planner.NutrientMatrix(self.storage)
+
+
+    def test_exact(self):
+        # 150g rice, 200g chicken, 10g oil
+        targets = dict(protein=56.5, carbo=117, fats=14.5)
+        quantities, totals = planner.plan(self.matrix, targets, [self.rice.id, self.chicken.id, self.oil.id])
+
+        quantities = dict(quantities)
+        self.assertAlmostEqual(quantities[self.rice.id], 150, delta=1)
+        self.assertAlmostEqual(quantities[self.chicken.id], 200, delta=1)
+        self.assertAlmostEqual(quantities[self.oil.id], 10, delta=1)
+        self.assertAlmostEqual(totals['calories'], 525 + 220 + 88, delta=5)
+
+
+    def test_bounds(self):
+        quantities, _ = planner.plan(self.matrix, dict(protein=100), [self.chicken.id], max_quantity=300)
+        self.assertEqual(quantities, [(self.chicken.id, 300.0)])
+
+        # can't get negative quantity of rice to lower carbo
+        quantities, _ = planner.plan(self.matrix, dict(carbo=0, protein=23), [self.rice.id, self.chicken.id])
+        self.assertEqual(dict(quantities), {self.chicken.id: 100.0})
+
+
+    def test_catalog(self):
+        self.storage.add_ingredients([Ingredient(name='woda{}'.format(i)) for i in range(20)])
+        quantities, totals = planner.plan(self.matrix, dict(protein=46, carbo=78), size=2)
+
+        self.assertEqual(sorted(id_ for id_, _ in quantities), [self.rice.id, self.chicken.id])
+        self.assertAlmostEqual(totals['protein'], 46, delta=1)
+
+
+    def test_cache(self):
+        ids, _ = self.matrix.get()
+        self.matrix.get()
+        self.assertEqual(self.matrix.loads, 1)
+
+        self.storage.add_ingredient(Ingredient(name='jajko', calories=155, protein=13, fats=11))
+        ids, matrix = self.matrix.get()
+        self.assertEqual(self.matrix.loads, 2)
+        self.assertEqual(len(ids), 4)
+        self.assertEqual(list(matrix[:, -1]), [1.55, 0.13, 0.0, 0.11])
+
+
+    def test_unknown_ingredient(self):
+        self.assertRaises(KeyError, lambda: planner.plan(self.matrix, dict(protein=10), [self.rice.id, 100]))
+
+
+    def test_handler(self):
+        ctrl = MealsController(self.storage)
+        meal = ctrl.plan(name='obiad', ingredients='{},{}'.format(self.rice.id, self.chicken.id), protein='46', carbo='78')
+
+        self.assertEqual(meal['name'], 'obiad')
+        self.assertEqual(len(meal['meal_ingredients']), 2)
+
+        # ready to POST
+        added = self.storage.add_meal(Meal.load(meal))
+        self.assertEqual(len(self.storage.get_meal_ingredients(meal_id=added.id)), 2)
+
+        self.assertRaises(cherrypy.HTTPError, lambda: ctrl.plan(protein='abc'))
+        self.assertRaises(cherrypy.HTTPError, lambda: ctrl.plan(ingredients='1'))
+        self.assertRaises(cherrypy.HTTPError, lambda: ctrl.plan(ingredients='100', protein='10'))
+
+
+    def test_empty_catalog(self):
+        storage = MealStorage(SQLite3MemoryEngine())
+        storage.init()
+        ctrl = MealsController(storage)
+
+        with self.assertRaises(cherrypy.HTTPError) as e:
+            ctrl.plan(calories='500', ingredients='1')
+        self.assertEqual(e.exception.status, 404)
+
+        self.assertEqual(ctrl.plan(calories='500')['meal_ingredients'], [])
@@ -0,0 +1,129 @@
+import sys
+import json
+import marshal
+import cProfile
+import unittest
+
+import cherrypy
+
+sys.path.append('../')
+
+from model import *
+from sqlite3_engine import SQLite3MemoryEngine
+from meal_storage import MealStorage
+from profiling import RequestProfiler, collapsed
+from controllers import ProfileController
+
+
+class TestRequestProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.profiler = RequestProfiler(allowed=('10.0.0.0/8',))
+        self.storage = MealStorage(SQLite3MemoryEngine())
+        self.storage.init()
+        self.storage.add_ingredients([Ingredient(name='ingr{}'.format(i), calories=i) for i in range(200)])
+
+
+    def profile(self, route='get_ingredients'):
+        profile = cProfile.Profile()
+        profile.enable()
+        json.dumps(Ingredient.dump_many(self.storage.get_ingredients()))
+        profile.disable()
+        self.profiler.add(route, profile)
+
+
+    def test_wanted(self):
+        self.assertTrue(self.profiler.wanted({'X-Profile': '1'}, '10.1.2.3'))
+        self.assertFalse(self.profiler.wanted({'X-Profile': '1'}, '192.168.0.1'))
+        self.assertFalse(self.profiler.wanted({'X-Profile': '1'}, 'unknown'))
+        self.assertFalse(self.profiler.wanted({}, '10.1.2.3'))
+
+        self.profiler.configure(sample_rate=1.0)
+        self.assertTrue(self.profiler.wanted({}, '192.168.0.1'))
+        self.assertRaises(ValueError, lambda: self.profiler.configure(sample_rate=2))
+
+
+    def test_proxies(self):
+        headers = {'X-Profile': '1', 'X-Forwarded-For': '10.1.2.3'}
+        # forwarded by unknown proxy - client unknown, even if proxy is allowed
+        self.assertFalse(self.profiler.wanted(headers, '10.9.9.9'))
+
+        self.profiler.configure(allowed=('10.0.0.0/8',), proxies=('127.0.0.1/32', '172.16.0.0/12'))
+        self.assertEqual(self.profiler.client_ip(headers, '127.0.0.1'), '10.1.2.3')
+        self.assertTrue(self.profiler.wanted(headers, '127.0.0.1'))
+        self.assertFalse(self.profiler.wanted({'X-Profile': '1', 'X-Forwarded-For': '192.168.0.1'}, '127.0.0.1'))
+        # spoofed first address, last one not added by proxies counts
+        headers['X-Forwarded-For'] = '10.1.2.3, 192.168.0.1, 172.16.0.5'
+        self.assertEqual(self.profiler.client_ip(headers, '127.0.0.1'), '192.168.0.1')
+        self.assertFalse(self.profiler.wanted(headers, '127.0.0.1'))
+        # proxy's own request
+        self.assertIsNone(self.profiler.client_ip({}, '127.0.0.1'))
+
+
+    def test_one_at_a_time(self):
+        profile = self.profiler.start()
+        self.assertIsNotNone(profile)
+        self.assertIsNone(self.profiler.start())
+
+        sorted(range(100), key=str)
+        self.profiler.stop('sort', profile)
+        self.assertEqual(self.profiler.routes()['sort']['requests'], 1)
+
+        profile = self.profiler.start()
+        self.assertIsNotNone(profile)
+        self.profiler.stop('sort', profile)
+
+
+    def test_routes(self):
+        self.profile()
+        self.profile()
+
+        routes = self.profiler.routes()
+        self.assertEqual(list(routes), ['get_ingredients'])
+        route = routes['get_ingredients']
+        self.assertEqual(route['requests'], 2)
+        for category in ('storage', 'marshalling', 'json'):
+            self.assertGreater(route[category], 0)
+        self.assertLessEqual(route['storage'] + route['marshalling'] + route['json'], route['total'] * 1.01)
+
+
+    def test_formats(self):
+        self.profile()
+        stats = self.profiler.stats('get_ingredients')
+
+        self.assertEqual(marshal.loads(self.profiler.dump('get_ingredients')), stats.stats)
+        self.assertIsNone(self.profiler.dump('nope'))
+
+        lines = collapsed(stats).splitlines()
+        self.assertTrue(lines)
+        for line in lines:
+            stack, value = line.rsplit(' ', 1)
+            self.assertGreater(int(value), 0)
+        self.assertTrue(any('meal_storage.py' in x and x.count(';') > 0 for x in lines))
+
+
+class TestProfileController(unittest.TestCase):
+
+    def setUp(self):
+        self.profiler = RequestProfiler()
+        self.ctrl = ProfileController(self.profiler)
+
+        profile = cProfile.Profile()
+        profile.enable()
+        sorted(range(1000), key=str)
+        profile.disable()
+        self.profiler.add('get_meals', profile)
+
+
+    def test_get(self):
+        self.assertEqual(list(json.loads(self.ctrl.get_profile().decode('utf-8'))), ['get_meals'])
+        self.assertTrue(self.ctrl.get_profile('get_meals', 'text').startswith(b' '))
+        self.assertIn(b'sorted', self.ctrl.get_profile('get_meals', 'collapsed'))
+        self.assertRaises(cherrypy.HTTPError, lambda: self.ctrl.get_profile('get_meals', 'svg'))
+        self.assertRaises(cherrypy.HTTPError, lambda: self.ctrl.get_profile('nope'))
+
+
+    def test_forbidden(self):
+        self.profiler.configure(allowed=())
+        self.assertRaises(cherrypy.HTTPError, self.ctrl.get_profile)
+        self.assertRaises(cherrypy.HTTPError, self.ctrl.delete_profile)
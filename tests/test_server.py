@@ -0,0 +1,118 @@
+import io
+import sys
+import json
+import unittest
+
+import cherrypy
+
+sys.path.append('../')
+
+import server
+import routeconfig
+from sqlite3_engine import SQLite3MemoryEngine
+from meal_storage import MealStorage
+from metrics import SQL_METRICS
+from profiling import PROFILER
+
+
+class TestCreateApp(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = server.create_app({'engine': 'memory'})
+
+
+    @classmethod
+    def tearDownClass(cls):
+        cherrypy.engine.exit()
+        cherrypy.server.subscribe()
+
+
+    def request(self, method, path, body=b''):
+        environ = {
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': path,
+            'QUERY_STRING': '',
+            'SERVER_NAME': 'localhost',
+            'HTTP_HOST': 'localhost',
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'REMOTE_ADDR': '127.0.0.1',
+            'CONTENT_TYPE': 'application/json',
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': io.StringIO(),
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+            'wsgi.version': (1, 0),
+        }
+        started = []
+        body = b''.join(self.app(environ, lambda status, headers, exc_info=None: started.append((status, dict(headers)))))
+        status, headers = started[0]
+        return int(status.split()[0]), headers, json.loads(body.decode('utf-8'))
+
+
+    def test_config(self):
+        self.assertRaises(ValueError, lambda: server.create_app({'engine': 'replica'}))
+        self.assertRaises(ValueError, lambda: server.create_app({'profile': 'staging'}))
+
+
+    def test_profiler_config(self):
+        try:
+            server.create_app({'engine': 'memory', 'profiler.sample_rate': 0.5,
+                'profiler.proxies': ['10.0.0.1/32'], 'sql.slow_query_time': 0.1})
+            self.assertEqual(PROFILER.sample_rate, 0.5)
+            self.assertEqual(PROFILER.client_ip({'X-Forwarded-For': '127.0.0.1'}, '10.0.0.1'), '127.0.0.1')
+            self.assertEqual(SQL_METRICS.slow_query_time, 0.1)
+
+            self.assertRaises(KeyError, lambda: server.create_app({'profiler.rate': 0.5}))
+        finally:
+            cherrypy.config.pop('profiler.rate', None)
+            PROFILER.configure(sample_rate=0, proxies=())
+            SQL_METRICS.slow_query_time = None
+
+
+    def test_sql_instrument(self):
+        storage = MealStorage(SQLite3MemoryEngine())
+        routeconfig.init(cherrypy.dispatch.RoutesDispatcher(), storage)
+        self.assertIsNone(storage.sqlstorage.engine.metrics)
+
+        try:
+            cherrypy.config.update({'sql.instrument': True})
+            routeconfig.init(cherrypy.dispatch.RoutesDispatcher(), storage)
+            self.assertIs(storage.sqlstorage.engine.metrics, SQL_METRICS)
+        finally:
+            cherrypy.config.pop('sql.instrument', None)
+
+
+    def test_app(self):
+        self.assertFalse(cherrypy.config['engine.autoreload.on'])
+
+        status, headers, ret = self.request('POST', '/ingredients', json.dumps({'name': 'ryż', 'calories': 350}).encode('utf-8'))
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['Access-Control-Allow-Origin'], '*')
+
+        status, _, ret = self.request('GET', '/ingredients/{}'.format(ret['id']))
+        self.assertEqual((status, ret['name']), (200, 'ryż'))
+
+        status, _, ret = self.request('GET', '/ingredients/100')
+        self.assertEqual(status, 404)
+        self.assertEqual(ret['error']['http_status'], '404 Not Found')
+
+
+    def test_add_meal(self):
+        status, _, ingr = self.request('POST', '/ingredients', json.dumps({'name': 'jajko', 'calories': 150}).encode('utf-8'))
+        self.assertEqual(status, 200)
+
+        meal = {'name': 'śniadanie', 'date': '2020-01-02 08:00',
+                'meal_ingredients': [{'ingredient_id': ingr['id'], 'quantity': 100}]}
+        status, _, ret = self.request('POST', '/meals', json.dumps(meal).encode('utf-8'))
+        self.assertEqual(status, 200)
+        self.assertIsInstance(ret['id'], int)
+        self.assertEqual(ret['meal_ingredients'][0]['meal_id'], ret['id'])
+
+        status, _, got = self.request('GET', '/meals/{}'.format(ret['id']))
+        self.assertEqual((status, got['name'], got['date']), (200, 'śniadanie', '2020-01-02 08:00'))
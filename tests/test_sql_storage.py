@@ -31,18 +31,106 @@ class TestPrepareStmts(unittest.TestCase):
         self.assertEqual(test.bind, ())
 
 
+    def test_select_order_by(self):
+        test = self.stg._prep_select('mytable', ('uno',), where(match('mytable_fts', 'test'), order_by('rank', 'uno')))
+        self.assertEqual(test.sql, 'SELECT uno FROM mytable WHERE 1 = 1\nAND mytable_fts MATCH ?\nORDER BY rank, uno')
+        self.assertEqual(test.bind, ('test',))
+
+
+    def test_select_compound(self):
+        test = self.stg._prep_select('mytable', ('uno',), where(
+            limit(10, 20),
+            in_('id', [1, 2, 3]),
+            or_(is_null('due'), between('due', 1, 2), and_(eq('tre', 3), neq('uno', 4))),
+            order_by('-due', 'id')))
+
+        self.assertEqual(test.sql, 'SELECT uno FROM mytable WHERE 1 = 1\n'
+            'AND id IN (?, ?, ?)\n'
+            'AND (due IS NULL OR due BETWEEN ? AND ? OR (tre = ? AND uno != ?))\n'
+            'ORDER BY due DESC, id\n'
+            'LIMIT ? OFFSET ?')
+        self.assertEqual(test.bind, (1, 2, 3, 1, 2, 3, 4, 10, 20))
+
+        # in with different number of values is different statement
+        self.stg._prep_select('mytable', ('uno',), where(in_('id', [1, 2])))
+        self.stg._prep_select('mytable', ('uno',), where(in_('id', [3, 4, 5])))
+        self.stg._prep_select('mytable', ('uno',), where(in_('id', [6, 7])))
+        self.assertEqual(self.stg.stmt_cache.stats()['misses'], 3)
+
+
+    def test_prefixed(self):
+        test = self.stg._prep_select('mytable t', ('t.uno',), prefixed('t.', where(or_(eq('id', 1), eq('id', 2)), order_by('-id'), limit(1))))
+        self.assertEqual(test.sql, 'SELECT t.uno FROM mytable t WHERE 1 = 1\nAND (t.id = ? OR t.id = ?)\nORDER BY t.id DESC\nLIMIT ?')
+        self.assertEqual(test.bind, (1, 2, 1))
+
+
+    def test_no_limit_in_delete(self):
+        self.assertRaises(ValueError, lambda: self.stg._prep_delete('mytable', where(eq('id', 1), limit(1))))
+
+
     def test_simple_insert(self):
         test = self.stg._prep_insert('mytable', {'uno':1, 'due':2})
         self.assertEqual(test.sql, 'INSERT INTO mytable(uno, due) VALUES(?, ?)')
         self.assertEqual(test.bind, (1, 2))
 
 
+    def test_insert_many(self):
+        test = self.stg._prep_insert_many('mytable', [{'uno':1, 'due':2}, {'uno':3}, {'uno':4, 'due':5}])
+        self.assertEqual(len(test), 2)
+
+        idxs, stmt = test[0]
+        self.assertEqual(idxs, [0, 2])
+        self.assertEqual(stmt.sql, 'INSERT INTO mytable(uno, due) VALUES(?, ?)')
+        self.assertEqual(stmt.bind, [(1, 2), (4, 5)])
+
+        idxs, stmt = test[1]
+        self.assertEqual(idxs, [1])
+        self.assertEqual(stmt.sql, 'INSERT INTO mytable(uno) VALUES(?)')
+        self.assertEqual(stmt.bind, [(3,)])
+
+
     def test_simple_delete(self):
         test = self.stg._prep_delete('mytable', where(eq('id', 1)))
         self.assertEqual(test.bind, (1,))
         self.assertEqual(test.sql, 'DELETE FROM mytable WHERE 1 = 1\nAND id = ?')
 
 
+class TestStatementCache(unittest.TestCase):
+
+    def setUp(self):
+        self.stg = SQLStorage(None)
+
+
+    def test_hits_and_misses(self):
+        first = self.stg._prep_select('mytable', ('uno', 'due'), where(eq('id', 1)))
+        self.assertEqual(self.stg.stmt_cache.stats(), dict(hits=0, misses=1, size=1))
+
+        second = self.stg._prep_select('mytable', ('uno', 'due'), where(eq('id', 2)))
+        self.assertEqual(self.stg.stmt_cache.stats(), dict(hits=1, misses=1, size=1))
+        self.assertIs(first.sql, second.sql)
+        self.assertEqual(second.bind, (2,))
+
+        # different operator is different shape
+        self.stg._prep_select('mytable', ('uno', 'due'), where(neq('id', 2)))
+        self.assertEqual(self.stg.stmt_cache.stats(), dict(hits=1, misses=2, size=2))
+
+        self.stg._prep_insert('mytable', {'uno':1})
+        self.stg._prep_insert('mytable', {'uno':2})
+        self.stg._prep_update('mytable', {'uno':1}, where(eq('id', 1)))
+        self.stg._prep_delete('mytable', where(eq('id', 1)))
+        self.assertEqual(self.stg.stmt_cache.stats(), dict(hits=2, misses=5, size=5))
+
+
+    def test_bounded(self):
+        self.stg.stmt_cache.maxsize = 2
+        for table in ('uno', 'due', 'tre'):
+            self.stg._prep_select(table)
+
+        self.assertEqual(self.stg.stmt_cache.stats()['size'], 2)
+        self.stg._prep_select('uno')
+        self.assertEqual(self.stg.stmt_cache.stats()['misses'], 4)
+
+
 class DummyEngine():
     """do not use real db engine"""
 
@@ -126,6 +214,70 @@ class TestStmtExcecutionWithInMemoryEngine(unittest.TestCase):
         self.assertEqual(test[0], {'id': 1, 'uno': 1, 'due': 2, 'tre': 3})
 
 
+    def test_insert_many(self):
+        self.stg.insert('mytable', {'uno': 0})
+        ids = self.stg.insert_many('mytable', [{'uno': 1, 'due': 2}, {'tre': 3}, {'uno': 4, 'due': 5}])
+        self.assertEqual(ids, [2, 4, 3])
+
+        test = self.stg.select('mytable')
+        self.assertEqual(len(test), 4)
+        self.assertIn({'id': 4, 'uno': None, 'due': None, 'tre': 3}, test)
+        self.assertIn({'id': 3, 'uno': 4, 'due': 5, 'tre': None}, test)
+
+
+    def test_insert_many_all_or_nothing(self):
+        self.assertRaises(Exception, lambda: self.stg.insert_many('mytable', [{'uno': 1}, {'id': 5, 'uno': 2}, {'id': 5, 'uno': 3}]))
+        self.assertEqual(self.stg.select('mytable'), [])
+
+
+    def test_rollback_and_deferred_hooks(self):
+        calls = []
+        try:
+            with self.stg.transaction():
+                self.stg.on_rollback(lambda: calls.append('outer undo'))
+                self.stg.after_transaction(lambda: calls.append('deferred'))
+                try:
+                    with self.stg.transaction():
+                        self.stg.on_rollback(lambda: calls.append('inner undo'))
+                        raise ValueError()
+                except ValueError:
+                    pass
+                self.assertEqual(calls, ['inner undo'])
+                raise ValueError()
+        except ValueError:
+            pass
+
+        self.assertEqual(calls, ['inner undo', 'outer undo', 'deferred'])
+
+        del calls[:]
+        with self.stg.transaction():
+            self.stg.on_rollback(lambda: calls.append('undo'))
+        self.stg.on_rollback(lambda: calls.append('undo'))
+        self.stg.after_transaction(lambda: calls.append('now'))
+        self.assertEqual(calls, ['now'])
+
+
+    def test_set_and_top_n(self):
+        ids = self.stg.insert_many('mytable', [{'uno': x} for x in range(10)])
+
+        test = self.stg.select('mytable', ('id', 'uno'), where(in_('id', ids[2:5]), order_by('-uno')))
+        self.assertEqual([x['uno'] for x in test], [4, 3, 2])
+
+        test = self.stg.select('mytable', ('uno',), where(or_(lt('uno', 2), gt('uno', 7)), order_by('-uno'), limit(3)))
+        self.assertEqual([x['uno'] for x in test], [9, 8, 1])
+
+        test = self.stg.select('mytable', ('uno',), where(between('uno', 3, 5), is_null('due'), order_by('uno'), limit(2, 1)))
+        self.assertEqual([x['uno'] for x in test], [4, 5])
+
+
+    def test_empty_group(self):
+        self.stg.insert_many('mytable', [{'uno': x} for x in range(3)])
+
+        self.assertEqual(list(self.stg.select('mytable', ('uno',), where(or_()))), [])
+        test = self.stg.select('mytable', ('uno',), where(and_(), or_(eq('uno', 1), and_())))
+        self.assertEqual([x['uno'] for x in test], [0, 1, 2])
+
+
     def test_simple_insert_delete(self):
         id_ = self.stg.insert('mytable', {'uno': 1, 'tre':3})
         test = self.stg.select('mytable')
@@ -0,0 +1,381 @@
+import os
+import sys
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+sys.path.append('../')
+
+from sqlite3_engine import SQLite3PooledEngine, SQLite3ReplicaEngine, SQLite3SharedMemoryEngine
+from meal_storage import MealStorage, MIGRATIONS
+from model import *
+
+
+class TestPooledEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.engine = SQLite3PooledEngine(os.path.join(self.tmpdir.name, 'test.db'), synchronous='OFF', busy_timeout=1234)
+        self.engine.execute_ddl(('create table mytable(id integer primary key, uno)',))
+
+
+    def tearDown(self):
+        self.engine.close()
+        self.tmpdir.cleanup()
+
+
+    def pragma(self, name):
+        return self.engine.execute('PRAGMA {}'.format(name), func=lambda cur: cur.fetchone()[0])
+
+
+    def test_pragmas(self):
+        self.assertEqual(self.pragma('journal_mode'), 'wal')
+        self.assertEqual(self.pragma('synchronous'), 0)
+        self.assertEqual(self.pragma('busy_timeout'), 1234)
+
+
+    def test_connection_per_thread(self):
+        conn = self.engine.connection()
+        self.assertIs(conn, self.engine.connection())
+
+        other = []
+        t = threading.Thread(target=lambda: other.append(self.engine.connection()))
+        t.start()
+        t.join()
+
+        self.assertIsNot(conn, other[0])
+
+
+    def test_recycle_closed_connection(self):
+        id_ = self.engine.execute('insert into mytable(uno) values(?)', (1,))
+        conn = self.engine.connection()
+        conn.close()
+
+        self.assertIsNot(conn, self.engine.connection())
+        ret = self.engine.execute('select uno from mytable where id = ?', (id_,), lambda cur: cur.fetchall())
+        self.assertEqual(ret, [(1,)])
+
+
+    def test_visible_across_threads(self):
+        t = threading.Thread(target=lambda: self.engine.execute('insert into mytable(uno) values(?)', (2,)))
+        t.start()
+        t.join()
+
+        ret = self.engine.execute('select uno from mytable', func=lambda cur: cur.fetchall())
+        self.assertEqual(ret, [(2,)])
+
+
+    def test_func_error_rolls_back(self):
+        def fail(cursor):
+            raise ValueError()
+
+        self.assertRaises(ValueError, lambda: self.engine.execute('insert into mytable(uno) values(?)', (1,), fail))
+        self.assertFalse(self.engine.connection().in_transaction)
+
+        # other threads can write
+        t = threading.Thread(target=lambda: self.engine.execute('insert into mytable(uno) values(?)', (2,)))
+        t.start()
+        t.join()
+        ret = self.engine.execute('select uno from mytable', func=lambda cur: cur.fetchall())
+        self.assertEqual(ret, [(2,)])
+
+
+    def test_transaction(self):
+        def fail():
+            with self.engine.transaction():
+                self.engine.execute('insert into mytable(uno) values(?)', (1,))
+                with self.engine.transaction():
+                    self.engine.execute('insert into mytable(uno) values(?)', (2,))
+                raise ValueError()
+
+        self.assertRaises(ValueError, fail)
+        self.assertEqual(self.engine.execute('select count(*) from mytable', func=lambda cur: cur.fetchone()[0]), 0)
+
+        with self.engine.transaction():
+            self.engine.execute('insert into mytable(uno) values(?)', (1,))
+            try:
+                with self.engine.transaction():
+                    self.engine.execute('insert into mytable(uno) values(?)', (2,))
+                    raise ValueError()
+            except ValueError:
+                pass
+
+        ret = self.engine.execute('select uno from mytable', func=lambda cur: cur.fetchall())
+        self.assertEqual(ret, [(1,)])
+
+
+class TestReplicaEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'test.db')
+
+        engine = SQLite3PooledEngine(self.path)
+        engine.execute_ddl(('create table mytable(id integer primary key, uno)',))
+        engine.execute('insert into mytable(uno) values(?)', (1,))
+        engine.close()
+
+        self.engine = SQLite3ReplicaEngine(self.path, verify_interval=None)
+
+
+    def tearDown(self):
+        self.engine.close()
+        self.tmpdir.cleanup()
+
+
+    def select(self, conn=None):
+        if conn is not None:
+            return conn.execute('select uno from mytable order by id').fetchall()
+        return self.engine.execute('select uno from mytable order by id', func=lambda cur: cur.fetchall())
+
+
+    def test_loaded(self):
+        self.assertEqual(self.select(self.engine.replica.connection()), [(1,)])
+        self.assertEqual(self.select(), [(1,)])
+
+
+    def test_write_through(self):
+        id_ = self.engine.execute('insert into mytable(uno) values(?)', (2,))
+        self.engine.executemany('insert into mytable(uno) values(?)', ((x,) for x in (3, 4)))
+        self.engine.execute_ddl(('create index myindex on mytable(uno)', 'update mytable set uno = uno * 10'))
+
+        self.assertEqual(id_, 2)
+        self.assertEqual(self.select(self.engine.replica.connection()), [(10,), (20,), (30,), (40,)])
+        self.assertEqual(self.select(sqlite3.connect(self.path)), [(10,), (20,), (30,), (40,)])
+        self.assertTrue(self.engine.verify())
+
+
+    def test_transaction(self):
+        with self.engine.transaction():
+            self.engine.execute('insert into mytable(uno) values(?)', (2,))
+            # reads inside transaction see its writes
+            self.assertEqual(self.select(), [(1,), (2,)])
+            self.assertEqual(self.select(self.engine.replica.connection()), [(1,)])
+            try:
+                with self.engine.transaction():
+                    self.engine.execute('insert into mytable(uno) values(?)', (3,))
+                    raise ValueError()
+            except ValueError:
+                pass
+
+        self.assertEqual(self.select(), [(1,), (2,)])
+
+        try:
+            with self.engine.transaction():
+                self.engine.execute('insert into mytable(uno) values(?)', (4,))
+                raise ValueError()
+        except ValueError:
+            pass
+
+        self.assertEqual(self.select(), [(1,), (2,)])
+        self.assertTrue(self.engine.verify())
+
+
+    def test_failed_write(self):
+        self.engine.execute_ddl(('create table uniq(uno unique)',))
+        with self.engine.transaction():
+            try:
+                self.engine.executemany('insert into uniq values(?)', [(1,), (2,), (1,)])
+            except sqlite3.IntegrityError:
+                pass
+
+        # effect of failed executemany unknown - replica copied again
+        self.assertEqual(self.engine.execute('select uno from uniq', func=lambda cur: cur.fetchall()), [(1,), (2,)])
+        self.assertTrue(self.engine.verify())
+
+
+    def test_verify(self):
+        other = sqlite3.connect(self.path)
+        other.execute('insert into mytable(uno) values(?)', (5,))
+        other.commit()
+        other.close()
+
+        self.assertEqual(self.select(), [(1,)])
+        self.assertFalse(self.engine.verify())
+        self.assertEqual(self.engine.divergences, 1)
+        self.assertEqual(self.select(), [(1,), (5,)])
+        self.assertTrue(self.engine.verify())
+
+
+    def test_with_write(self):
+        self.engine.execute('with x(v) as (select 7) insert into mytable(uno) select v from x')
+
+        self.assertEqual(self.select(sqlite3.connect(self.path)), [(1,), (7,)])
+        self.assertEqual(self.select(), [(1,), (7,)])
+        self.assertTrue(self.engine.verify())
+
+
+    def test_verify_chunks(self):
+        engine = SQLite3ReplicaEngine(self.path, verify_interval=None, verify_chunk=2)
+        engine.executemany('insert into mytable(uno) values(?)', [(x,) for x in range(10)])
+        self.assertTrue(engine.verify())
+
+        other = sqlite3.connect(self.path)
+        other.execute('update mytable set uno = 100 where id = 7')
+        other.commit()
+        other.close()
+
+        self.assertFalse(engine.verify())
+        self.assertIn((100,), self.select(engine.replica.connection()))
+        engine.close()
+
+
+    def test_concurrent_reads(self):
+        errors = []
+
+        def work(i):
+            try:
+                for j in range(50):
+                    self.select()
+                    if j % 10 == 0:
+                        self.engine.execute('insert into mytable(uno) values(?)', (i,))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=work, args=(i,)) for i in range(8)]
+        for t in threads:
+            t.start()
+        verified = self.engine.verify()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(errors, [])
+        self.assertTrue(verified)
+        self.assertEqual(len(self.select()), 1 + 8 * 5)
+        self.assertTrue(self.engine.verify())
+
+
+    def test_periodic_verify(self):
+        engine = SQLite3ReplicaEngine(self.path, verify_interval=0.01)
+        other = sqlite3.connect(self.path)
+        other.execute('insert into mytable(uno) values(?)', (5,))
+        other.commit()
+        other.close()
+
+        for _ in range(200):
+            if engine.divergences:
+                break
+            threading.Event().wait(0.01)
+
+        self.assertEqual(engine.divergences, 1)
+        self.assertEqual(self.select(engine.replica.connection()), [(1,), (5,)])
+        engine.close()
+
+
+    def test_external_writes_etag(self):
+        storage = MealStorage(self.engine, external_writes=True)
+        storage.init()
+        other = SQLite3ReplicaEngine(self.path, verify_interval=None)
+        MealStorage(other).add_ingredient(Ingredient(name='nowy'))
+
+        # replica doesn't have it yet, neither has etag
+        etag = storage.etag('ingredients')
+        self.assertEqual(storage.get_ingredients(), [])
+        self.assertEqual(storage.etag('ingredients'), etag)
+
+        self.assertFalse(self.engine.verify())
+        self.assertNotEqual(storage.etag('ingredients'), etag)
+        self.assertEqual([x.name for x in storage.get_ingredients()], ['nowy'])
+        other.close()
+
+
+    def test_meal_storage(self):
+        storage = MealStorage(self.engine)
+        storage.init()
+        storage.add_ingredients([Ingredient(name='ingr{}'.format(i), calories=i) for i in range(10)])
+        storage.update_ingredient(Ingredient(id=3, name='nowy'))
+
+        self.assertEqual([x.name for x in storage.search_ingredients(name='nowy')], ['nowy'])
+        self.assertTrue(self.engine.verify())
+        self.assertEqual(storage.version(), len(MIGRATIONS))
+
+
+class TestSharedMemoryEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = SQLite3SharedMemoryEngine()
+        self.engine.execute_ddl(('create table mytable(id integer primary key, uno)',))
+
+
+    def tearDown(self):
+        self.engine.close()
+
+
+    def count(self, engine=None):
+        return (engine or self.engine).execute('select count(*) from mytable', func=lambda cur: cur.fetchone()[0])
+
+
+    def test_shared(self):
+        t = threading.Thread(target=lambda: self.engine.execute('insert into mytable(uno) values(?)', (1,)))
+        t.start()
+        t.join()
+        self.assertEqual(self.count(), 1)
+
+        other = SQLite3SharedMemoryEngine()
+        self.assertRaises(sqlite3.OperationalError, lambda: self.count(other))
+        other.close()
+
+        same = SQLite3SharedMemoryEngine(self.engine.name)
+        self.assertEqual(self.count(same), 1)
+        same.close()
+
+
+    def test_threads(self):
+        errors = []
+
+        def work(i):
+            try:
+                for j in range(50):
+                    if j % 5:
+                        self.count()
+                    else:
+                        with self.engine.transaction():
+                            self.engine.execute('insert into mytable(uno) values(?)', (i,))
+                            self.engine.executemany('insert into mytable(uno) values(?)', [(i,), (i,)])
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=work, args=(i,)) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(self.count(), 8 * 10 * 3)
+
+
+    def test_with_write(self):
+        t = threading.Thread(target=lambda: self.engine.execute(
+                'with x(v) as (select 7) insert into mytable(uno) select v from x'))
+        t.start()
+        t.join()
+        self.assertEqual(self.count(), 1)
+
+
+    def test_transaction(self):
+        try:
+            with self.engine.transaction():
+                self.engine.execute('insert into mytable(uno) values(?)', (1,))
+                self.assertEqual(self.count(), 1)
+                raise ValueError()
+        except ValueError:
+            pass
+
+        self.assertEqual(self.count(), 0)
+
+
+    def test_meal_storage(self):
+        storage = MealStorage(self.engine, batch_writes=True)
+        storage.init()
+
+        threads = [threading.Thread(target=storage.add_ingredient, args=(Ingredient(name='ingr{}'.format(i)),))
+                for i in range(10)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len(storage.search_ingredients(name='ingr')), 10)
+        storage.close()
@@ -1,3 +1,6 @@
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime
 
 def today_at(hour):
@@ -26,3 +29,71 @@ def extract(iterable, func=lambda x: True if x is not None else False):
 
 def first(iterable, func=lambda x: True if x is not None else False):
     return extract(iterable, func).first()
+
+
+class LRUCache(object):
+    """
+    thread safe bounded lru cache with optional ttl (seconds).
+    generation guards against storing values read before invalidation:
+    take generation() before reading the source, pass it to put()
+    """
+
+    _missing = object()
+
+    def __init__(self, maxsize=1024, ttl=None, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._generation = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+
+    def generation(self):
+        return self._generation
+
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._items.get(key, self._missing)
+            if item is not self._missing and (item[1] is None or item[1] > self.clock()):
+                self.hits += 1
+                self._items.move_to_end(key)
+                return item[0]
+
+            if item is not self._missing:
+                del self._items[key] # expired
+
+            self.misses += 1
+            return default
+
+
+    def put(self, key, value, generation=None):
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+
+            expires = None if self.ttl is None else self.clock() + self.ttl
+            self._items[key] = (value, expires)
+            self._items.move_to_end(key)
+
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+
+    def invalidate(self, key=_missing):
+        """drop key, or everything if no key given"""
+        with self._lock:
+            self._generation += 1
+            if key is self._missing:
+                self._items.clear()
+            else:
+                self._items.pop(key, None)
+
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions, size=len(self._items))